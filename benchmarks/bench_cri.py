@@ -0,0 +1,155 @@
+# Benchmarks for criprobe against emulated meters on pseudo-terminals.
+#
+#   python benchmarks/bench_cri.py [--quick] [--json results.json]
+#
+# Reports send_command latency percentiles, reply parse throughput,
+# autodetect time vs. number of ports and measurement-cycle time vs. number
+# of probes. Needs a POSIX system (os.openpty); no hardware is touched.
+import argparse
+import json
+import os
+import sys
+import time
+from unittest.mock import patch
+import numpy as np
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import criprobe as cri  # noqa: E402
+from criprobe.codec import decode_spectrum  # noqa: E402
+from criprobe.cri import parse_measurement  # noqa: E402
+from criprobe.emulator import CriEmulator  # noqa: E402
+
+PROBE = {'ID': 'A00001', 'Type': 'Spectroradiometer'}
+
+REPLIES = {'scalar': ('Y', b'OK:0:RM Y:2.239e+00\r\n'),
+           'triple': ('Radiometric', b'OK:0:RM Radiometric:0,3.209e-01,8.835e+17\r\n'),
+           'spectrum': ('Spectrum', b'OK:0:RM Spectrum:380.0,780.0,2.0,201\r\n' +
+                        b''.join(b'%.3e\r\n' % value for value in np.linspace(1e-4, 1e-3, 201)))}
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1e3
+    return {'p50_ms': float(np.percentile(samples, 50)),
+            'p90_ms': float(np.percentile(samples, 90)),
+            'p99_ms': float(np.percentile(samples, 99)),
+            'max_ms': float(samples.max())}
+
+
+def detect(emulators):
+    ports = os.pathsep.join(emulator.device for emulator in emulators)
+    with patch('serial.tools.list_ports.comports', return_value=[]), patch.dict(os.environ, {'CRIPROBE_PORTS': ports}):
+        return cri.CriProbe()
+
+
+def close(p):
+    for probe in p.probes:
+        probe['Port'].close()
+
+
+def bench_latency(count):
+    with CriEmulator() as emulator:
+        port = serial.Serial(emulator.device, 115200, timeout=5)
+        p = cri.CriProbe(simulated=True)
+        samples = []
+        for cmd in ['RC ID'] * count:
+            start = time.perf_counter()
+            p.send_command(port, cmd)
+            samples.append(time.perf_counter() - start)
+        port.close()
+    return percentiles(samples)
+
+
+def bench_parse(count):
+    results = {}
+    for name, (measure_type, reply) in REPLIES.items():
+        if measure_type == 'Spectrum':
+            def parse():
+                decode_spectrum(reply)
+        else:
+            def parse():
+                parse_measurement(PROBE, measure_type, reply)
+        start = time.perf_counter()
+        for _ in range(count):
+            parse()
+        elapsed = time.perf_counter() - start
+        results[name] = {'replies_per_s': count / elapsed, 'us_per_reply': elapsed / count * 1e6}
+    return results
+
+
+def bench_autodetect(sizes, repeat):
+    results = {}
+    for size in sizes:
+        emulators = [CriEmulator('A%05d' % (n + 1)).start() for n in range(size)]
+        try:
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                p = detect(emulators)
+                samples.append(time.perf_counter() - start)
+                close(p)
+        finally:
+            for emulator in emulators:
+                emulator.stop()
+        results[size] = percentiles(samples)
+    return results
+
+
+def bench_cycle(sizes, repeat, integration_time):
+    results = {}
+    for size in sizes:
+        emulators = [CriEmulator('A%05d' % (n + 1), integration_time=integration_time).start() for n in range(size)]
+        try:
+            p = detect(emulators)
+            results[size] = {}
+            for mode, concurrent in (('sequential', False), ('concurrent', True)):
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    p.measure(concurrent=concurrent)
+                    p.read_measure(['xy', 'Y'])
+                    samples.append(time.perf_counter() - start)
+                results[size][mode] = percentiles(samples)
+            close(p)
+        finally:
+            for emulator in emulators:
+                emulator.stop()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark criprobe against emulated meters')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for a smoke run')
+    parser.add_argument('--integration-time', type=float, default=0.05, help='emulated seconds per M')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    scale = 0.1 if args.quick else 1.0
+    sizes = [1, 2, 4] if args.quick else [1, 2, 4, 8]
+    results = {'send_command': bench_latency(int(500 * scale)),
+               'parse': bench_parse(int(20000 * scale)),
+               'autodetect': bench_autodetect(sizes, max(int(10 * scale), 2)),
+               'cycle': bench_cycle(sizes, max(int(10 * scale), 2), args.integration_time)}
+
+    print('send_command RC ID latency: %s' % format_percentiles(results['send_command']))
+    for name, result in results['parse'].items():
+        print('parse %-8s %10.0f replies/s  %7.1f us/reply' % (name, result['replies_per_s'], result['us_per_reply']))
+    for size, result in results['autodetect'].items():
+        print('autodetect %d port(s): %s' % (size, format_percentiles(result)))
+    for size, result in results['cycle'].items():
+        for mode, timing in result.items():
+            print('cycle %d probe(s) %-10s: %s' % (size, mode, format_percentiles(timing)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def format_percentiles(result):
+    return '  '.join('%s %.2f' % (key, value) for key, value in result.items())
+
+
+if __name__ == '__main__':
+    main()
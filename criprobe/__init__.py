@@ -1 +1,35 @@
-from .cri import CriProbe
\ No newline at end of file
+import importlib
+
+# Public names and the module each comes from. They are imported on first
+# use, so "import criprobe" and the command line tool start without loading
+# numpy or pyserial
+EXPORTS = {'CriProbe': 'cri',
+           'CriError': 'codec',
+           'CommandError': 'codec',
+           'MeasurementError': 'codec',
+           'ProbeTimeoutError': 'codec',
+           'ProtocolError': 'codec',
+           'AsyncCriProbe': 'aio',
+           'Measurement': 'records',
+           'MeasurementBatch': 'records',
+           'MeasurementPlan': 'scheduler',
+           'MeasurementStep': 'scheduler',
+           'CaptureStore': 'store',
+           'open_capture': 'store',
+           'ProbeBroker': 'broker',
+           'BrokerClient': 'broker'}
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name):
+    module = EXPORTS.get(name)
+    if module is None:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(EXPORTS))
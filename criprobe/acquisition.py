@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from .codec import decode_measure, decode_reply, decode_spectrum, quantity_decoder
+from .cri import rm_command, combine_measurements
+from .store import CaptureStore
+
+
+class RingBuffer:
+    # Fixed-size store of the most recent samples. Every row is written twice,
+    # at i and at i + capacity, so the latest n samples are always one
+    # contiguous slice and can be handed out as a view without copying
+    def __init__(self, capacity, shape, dtype=np.float64):
+        self.capacity = capacity
+        self.data = np.full((2 * capacity,) + tuple(shape), np.nan, dtype=dtype)
+        self.timestamps = np.full(2 * capacity, np.nan)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def next_row(self):
+        # Row to fill in place for the next sample; it becomes visible to
+        # readers only once commit() is called
+        return self.data[self.count % self.capacity]
+
+    def commit(self, timestamp):
+        i = self.count % self.capacity
+        self.data[i + self.capacity] = self.data[i]
+        self.timestamps[i] = self.timestamps[i + self.capacity] = timestamp
+        with self.lock:
+            self.count += 1
+
+    def append(self, timestamp, row):
+        self.next_row()[...] = row
+        self.commit(timestamp)
+
+    def latest(self, n=None):
+        # Views of the last n timestamps and samples, oldest first. They stay
+        # valid until another capacity - n samples have been written
+        with self.lock:
+            count = self.count
+        n = len(self) if n is None else min(n, len(self))
+        end = count % self.capacity + self.capacity
+        return self.timestamps[end - n:end], self.data[end - n:end]
+
+
+class Acquisition:
+    # Repeated M + RM cycles on every probe, written into a RingBuffer of
+    # shape (capacity, n_probes, n_values). The column layout is fixed by the
+    # first sample; after that replies are parsed straight into the buffer.
+    # With a store (a CaptureStore or the path of a new capture) every sample
+    # is also appended to disk
+    def __init__(self, cri_probe, quantities, capacity=1024, degree=2, store=None):
+        self.cri_probe = cri_probe
+        self.quantities = list(quantities)
+        self.capacity = capacity
+        self.probe_ids = [probe['ID'] for probe in cri_probe.probes]
+        self.commands = [[rm_command(probe, quantity, degree) for quantity in self.quantities]
+                         for probe in cri_probe.probes]
+        self.decoders = {quantity: quantity_decoder(quantity) for quantity in self.quantities}
+        self.columns = None
+        self.buffer = None
+        self.store = store
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def layout(self, results):
+        # Columns each quantity needs: its width when the codec knows it, so
+        # a first reading of 'NA' does not shrink it, otherwise the width of
+        # a first reading
+        columns = {}
+        start = 0
+        for quantity in self.quantities:
+            width = self.decoders[quantity].size or np.size(results[0][quantity])
+            columns[quantity] = slice(start, start + width)
+            start += width
+        return columns, start
+
+    def read_probe(self, n):
+        probe = self.cri_probe.probes[n]
+        decode_measure(self.cri_probe.send_command(probe['Port'], 'M'))
+        return self.cri_probe.send_commands(probe['Port'], self.commands[n])
+
+    def fill_row(self, row, results, commands):
+        for quantity, result, command in zip(self.quantities, results, commands):
+            columns = self.columns[quantity]
+            if quantity == 'Spectrum':
+                decode_spectrum(result, row[columns])
+            else:
+                self.decoders[quantity].decode_into(decode_reply(result, command)[1], row[columns])
+
+    def sample(self, executor=None):
+        # Run one cycle on every probe at once and return the timestamp and
+        # the (n_probes, n_values) row view it was written to
+        probes = range(len(self.probe_ids))
+        timestamp = time.time()
+        if executor is None:
+            replies = [self.read_probe(n) for n in probes]
+        else:
+            replies = list(executor.map(self.read_probe, probes))
+
+        if self.buffer is None:
+            records = [combine_measurements(probe, self.quantities, results, commands)
+                       for probe, results, commands in zip(self.cri_probe.probes, replies, self.commands)]
+            self.columns, width = self.layout(records)
+            self.buffer = RingBuffer(self.capacity, (len(self.probe_ids), width))
+            if isinstance(self.store, (str, os.PathLike)):
+                self.store = CaptureStore.create(self.store, self.quantities, records[0].get('Wavelength'),
+                                                 {quantity: s.stop - s.start for quantity, s in self.columns.items()})
+
+        row = self.buffer.next_row()
+        for n, results in enumerate(replies):
+            self.fill_row(row[n], results, self.commands[n])
+        self.buffer.commit(timestamp)
+        if self.store is not None:
+            self.store.append_row(timestamp, self.probe_ids, row, self.columns)
+        return timestamp, row
+
+    def samples(self, count=None):
+        # Generator over successive samples; each yielded row is a view into
+        # the ring buffer, not a copy
+        owns_store = isinstance(self.store, (str, os.PathLike))
+        try:
+            with ThreadPoolExecutor(max_workers=max(len(self.probe_ids), 1)) as executor:
+                n = 0
+                while count is None or n < count:
+                    if self.stop_event.is_set():
+                        return
+                    yield self.sample(executor)
+                    n += 1
+        finally:
+            # A capture created here from a path is closed with the stream
+            if owns_store and isinstance(self.store, CaptureStore):
+                self.store.close()
+
+    def run(self):
+        try:
+            for _ in self.samples():
+                pass
+        except Exception as err:
+            self.error = err
+
+    def start(self):
+        # Acquire on a background thread until stop() is called
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='criprobe-acquisition', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def latest(self, n=None):
+        if self.buffer is None:
+            return np.empty(0), np.empty((0, len(self.probe_ids), 0))
+        return self.buffer.latest(n)
@@ -0,0 +1,281 @@
+import asyncio
+import time
+import serial
+
+from .codec import (CriError, ProbeTimeoutError, decode_probe_id, decode_probe_model, decode_probe_type, decode_measure,
+                    decode_spectrum_header)
+from .cri import (list_ports, is_cri_port, identity_cache_key, load_identity_cache, save_identity_cache, rm_command,
+                  parse_measurement, combine_measurements, deadline_settings, decode_deadline_settings,
+                  measure_status, DEADLINE_COMMANDS)
+from .timeouts import MeasureDeadline, QUERY_TIMEOUT
+
+
+class AsyncSerial:
+    # Non-blocking serial port driven by the event loop. Incoming bytes are
+    # collected by a reader callback on the port's file descriptor, or by a
+    # short polling task where the platform has no selectable handle (Windows)
+    poll_interval = 0.005
+
+    def __init__(self, port, loop=None):
+        self.port = port
+        self.loop = loop or asyncio.get_running_loop()
+        self.lock = asyncio.Lock()
+        self.buffer = bytearray()
+        self.data_ready = asyncio.Event()
+        self.poll_task = None
+        try:
+            self.fd = port.fileno()
+        except (AttributeError, OSError, NotImplementedError):
+            self.fd = None
+        if self.fd is not None:
+            self.loop.add_reader(self.fd, self.on_readable)
+        else:
+            self.poll_task = self.loop.create_task(self.poll())
+
+    def on_readable(self):
+        data = self.port.read(self.port.in_waiting or 1)
+        if data:
+            self.buffer += data
+            self.data_ready.set()
+
+    async def poll(self):
+        while True:
+            if self.port.in_waiting:
+                self.on_readable()
+            await asyncio.sleep(self.poll_interval)
+
+    def write(self, data):
+        self.port.write(data)
+
+    def discard_input(self):
+        # Drop anything left over from a reply that was cancelled or timed out
+        self.buffer.clear()
+        self.data_ready.clear()
+        self.port.reset_input_buffer()
+
+    async def readline(self):
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(self.buffer[:end + 1])
+                del self.buffer[:end + 1]
+                return line
+            self.data_ready.clear()
+            await self.data_ready.wait()
+
+    async def read_lines(self, count):
+        # Wait for count complete lines and return them as one block
+        while True:
+            end = -1
+            for _ in range(count):
+                end = self.buffer.find(b'\n', end + 1)
+                if end < 0:
+                    break
+            if end >= 0:
+                lines = bytes(self.buffer[:end + 1])
+                del self.buffer[:end + 1]
+                return lines
+            self.data_ready.clear()
+            await self.data_ready.wait()
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            self.poll_task = None
+        self.port.close()
+
+
+class AsyncCriProbe:
+    def __init__(self, simulated=False, cache_path=None, validate_cache=True, timeout=None):
+        # Detection needs the event loop, so a real instance is populated by
+        # create() or detect(); the simulated probes mirror CriProbe. Without
+        # a fixed timeout, deadlines adapt per command as in CriProbe
+        self.cache_path = cache_path
+        self.validate_cache = validate_cache
+        self.timeout = timeout
+        self.deadlines = {}
+        if simulated:
+            self.probes = [{'Port': 'Mock Port',
+                            'ID': 'A19999',
+                            'Model': 'CR-100',
+                            'Type': 'Colorimeter'
+                            },
+                           {'Port': 'Mock Port',
+                            'ID': 'A29999',
+                            'Model': 'CR-250',
+                            'Type': 'Spectroradiometer'
+                            }]
+        else:
+            self.probes = []
+
+    @classmethod
+    async def create(cls, simulated=False, **kwargs):
+        probe = cls(simulated, **kwargs)
+        if not simulated:
+            await probe.detect()
+        return probe
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def detect(self):
+        # Autodetects CRI probe/s, querying every candidate port at once
+        cache = load_identity_cache(self.cache_path)
+        ports = [port for port in self.get_ports() if is_cri_port(port)]
+        self.probes = list(await asyncio.gather(*[self.detect_probe(port, cache) for port in ports]))
+        if self.cache_path:
+            save_identity_cache(self.cache_path, ports, self.probes)
+        return self.probes
+
+    async def detect_probe(self, port, cache=None):
+        cri_probe = await self.open_port(port.device)
+        probe_info = {'Port': cri_probe}
+
+        cached = (cache or {}).get(identity_cache_key(port))
+        if cached and not self.validate_cache:
+            probe_info.update(cached)
+            return probe_info
+
+        probe_info['ID'] = decode_probe_id(await self.send_command(cri_probe, 'RC ID'))
+        if cached and cached['ID'] == probe_info['ID']:
+            probe_info.update(cached)
+            return probe_info
+
+        probe_info['Model'] = decode_probe_model(await self.send_command(cri_probe, 'RC Model'))
+        probe_info['Type'] = decode_probe_type(await self.send_command(cri_probe, 'RC InstrumentType'))
+        return probe_info
+
+    def get_ports(self):
+        return list_ports()
+
+    async def open_port(self, device):
+        # The deadline is enforced by the event loop, so the port itself
+        # never blocks
+        return AsyncSerial(serial.Serial(device, 115200, timeout=0))
+
+    def deadline(self, port):
+        deadline = self.deadlines.get(port)
+        if deadline is None:
+            deadline = self.deadlines[port] = MeasureDeadline()
+        return deadline
+
+    def command_timeout(self, port, cmd, timeout=None):
+        if timeout is not None:
+            return timeout
+        if self.timeout is not None:
+            return self.timeout
+        return self.deadline(port).timeout() if cmd == 'M' else QUERY_TIMEOUT
+
+    async def send_command(self, port, cmd, timeout=None):
+        # One command in flight per probe; other probes proceed in parallel
+        cmd_bytes = bytes(cmd, 'utf-8') + b'\r\n'
+        if cmd == 'M' and timeout is None and self.timeout is None:
+            await self.prepare_deadline(port)
+        timeout = self.command_timeout(port, cmd, timeout)
+        async with port.lock:
+            port.discard_input()
+            start = time.perf_counter()
+            port.write(cmd_bytes)
+            try:
+                reply = await asyncio.wait_for(self.read_reply(port, cmd), timeout)
+            except asyncio.TimeoutError as err:
+                if cmd == 'M':
+                    self.deadline(port).missed()
+                raise ProbeTimeoutError('No reply to %s within %.1f s' % (cmd, timeout)) from err
+        if cmd == 'M' and reply.startswith(b'OK'):
+            self.deadline(port).observe(time.perf_counter() - start)
+        return reply
+
+    async def prepare_deadline(self, port):
+        # As CriProbe: read the exposure settings before the first M
+        deadline = self.deadline(port)
+        if deadline.unknown():
+            deadline.queried = True
+            replies = await self.send_commands(port, list(DEADLINE_COMMANDS))
+            deadline.update(**decode_deadline_settings(replies))
+
+    async def read_reply(self, port, cmd):
+        # A spectrum reply carries its samples on the lines after the header
+        reply = await port.readline()
+        if cmd == 'RM Spectrum':
+            reply += await port.read_lines(decode_spectrum_header(reply)[3])
+        return reply
+
+    async def send_commands(self, port, cmds, timeout=None):
+        # Pipeline several commands and collect the replies in order
+        cmd_bytes = b''.join(bytes(cmd, 'utf-8') + b'\r\n' for cmd in cmds)
+
+        async def read_replies():
+            return [await self.read_reply(port, cmd) for cmd in cmds]
+
+        timeout = self.command_timeout(port, 'RM', timeout)
+        async with port.lock:
+            port.discard_input()
+            port.write(cmd_bytes)
+            try:
+                return await asyncio.wait_for(read_replies(), timeout)
+            except asyncio.TimeoutError as err:
+                raise ProbeTimeoutError('No reply to %s within %.1f s' % (', '.join(cmds), timeout)) from err
+
+    async def read_spectrum(self):
+        return await self.read_measure('Spectrum')
+
+    async def measure(self):
+        # Trigger every probe at once and report each probe's status; a
+        # failure is raised once every probe has answered, as in CriProbe
+        async def measure_probe(probe):
+            status = {'Probe ID': probe['ID'], 'Status': None}
+            try:
+                status['Status'] = await self.send_command(probe['Port'], 'M')
+                decode_measure(status['Status'])
+            except CriError as err:
+                err.probe_id = probe['ID']
+                status['Error'] = err
+            return status
+
+        return measure_status(list(await asyncio.gather(*[measure_probe(probe) for probe in self.probes])))
+
+    async def read_measure(self, measure_type, degree=2):
+        if isinstance(measure_type, (list, tuple)):
+            return await self.read_measures(measure_type, degree)
+
+        # Validate every command before any probe is queried
+        commands = [rm_command(probe, measure_type, degree) for probe in self.probes]
+
+        async def read_probe(probe, rm):
+            result = await self.send_command(probe['Port'], rm)
+            if measure_type == 'Spectrum':
+                return combine_measurements(probe, [measure_type], [result])
+            response = parse_measurement(probe, measure_type, result, rm)
+            self.observe_settings(probe, response)
+            return response
+
+        return list(await asyncio.gather(*[read_probe(probe, rm) for probe, rm in zip(self.probes, commands)]))
+
+    async def read_measures(self, measure_types, degree=2):
+        commands = [[rm_command(probe, measure_type, degree) for measure_type in measure_types]
+                    for probe in self.probes]
+
+        async def read_probe(probe, rms):
+            results = await self.send_commands(probe['Port'], rms)
+            response = combine_measurements(probe, measure_types, results, rms)
+            self.observe_settings(probe, response)
+            return response
+
+        return list(await asyncio.gather(*[read_probe(probe, rms) for probe, rms in zip(self.probes, commands)]))
+
+    def observe_settings(self, probe, response):
+        settings = deadline_settings(response)
+        if settings:
+            self.deadline(probe['Port']).update(**settings)
+
+    def close(self):
+        for probe in self.probes:
+            if isinstance(probe['Port'], AsyncSerial):
+                probe['Port'].close()
@@ -0,0 +1,115 @@
+import numpy as np
+
+# Keys of a measure_averaged() record holding per-quantity statistics
+STATISTICS = ('Std', 'Stderr', 'Min', 'Max')
+
+
+class RunningStats:
+    # Mean, variance, min and max of a stream of readings without keeping
+    # them (Welford's method). Readings may be scalars or arrays such as
+    # spectra; every element is updated at once
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, value):
+        value = np.asarray(value, dtype=np.float64)
+        self.count += 1
+        if self.count == 1:
+            self.mean = value.copy()
+            self.m2 = np.zeros_like(value)
+            self.min = value.copy()
+            self.max = value.copy()
+            return
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        np.fmin(self.min, value, out=self.min)
+        np.fmax(self.max, value, out=self.max)
+
+    @property
+    def variance(self):
+        # Sample variance; NaN until there are two readings
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def stderr(self):
+        return self.std / np.sqrt(self.count)
+
+
+def unwrap(value):
+    # Scalars come back as floats, like read_measure
+    return float(value) if np.ndim(value) == 0 else value
+
+
+def precise(stats, target_stderr):
+    # True once every targeted quantity's standard error is within target on
+    # every element; target_stderr is one value or a dict per quantity
+    for quantity, quantity_stats in stats.items():
+        target = target_stderr.get(quantity) if isinstance(target_stderr, dict) else target_stderr
+        if target is None or quantity_stats is None:
+            continue
+        if not np.all(quantity_stats.stderr <= target):
+            return False
+    return True
+
+
+def measure_averaged(cri_probe, quantities, n=10, target_stderr=None, min_count=3, degree=2):
+    # Repeat M + RM up to n times and return one record per probe with the
+    # mean of each quantity plus its Std, Stderr, Min and Max. With
+    # target_stderr, stop as soon as every probe has reached it (after at
+    # least min_count cycles)
+    quantities = [quantities] if isinstance(quantities, str) else list(quantities)
+    if n < 1:
+        raise ValueError('At least one measurement required')
+    stats = [{quantity: None for quantity in quantities} for _ in cri_probe.probes]
+    last = [{} for _ in cri_probe.probes]
+
+    for count in range(1, n + 1):
+        cri_probe.measure(concurrent=True)
+        for probe_stats, probe_last, response in zip(stats, last, cri_probe.read_measure(quantities, degree)):
+            probe_last.update(response)
+            for quantity in quantities:
+                value = response.get(quantity)
+                # Text readings such as 'NA' are not averaged
+                if value is None or isinstance(value, str):
+                    continue
+                if probe_stats[quantity] is None:
+                    probe_stats[quantity] = RunningStats()
+                probe_stats[quantity].update(value)
+        if (target_stderr is not None and count >= max(min_count, 2) and
+                all(precise(probe_stats, target_stderr) for probe_stats in stats)):
+            break
+
+    return [summarize(quantities, probe_stats, response, count) for probe_stats, response in zip(stats, last)]
+
+
+def summarize(quantities, probe_stats, response, count):
+    # One probe's record: the mean of each averaged quantity and its
+    # statistics, and the last reading of anything that was not averaged
+    result = {'Probe ID': response.get('Probe ID'), 'Count': count}
+    summary = {key: {} for key in STATISTICS}
+    for quantity in quantities:
+        quantity_stats = probe_stats[quantity]
+        if quantity_stats is None:
+            result[quantity] = response.get(quantity)
+            continue
+        result[quantity] = unwrap(quantity_stats.mean)
+        summary['Std'][quantity] = unwrap(quantity_stats.std)
+        summary['Stderr'][quantity] = unwrap(quantity_stats.stderr)
+        summary['Min'][quantity] = unwrap(quantity_stats.min)
+        summary['Max'][quantity] = unwrap(quantity_stats.max)
+    result.update(summary)
+    for key in ('Wavelength', 'Units'):
+        if key in response:
+            result[key] = response[key]
+    return result
@@ -0,0 +1,363 @@
+import argparse
+import collections
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+from . import codec
+from .paths import DEFAULT_SOCKET_PATH
+
+# One process owns the serial ports and serves every other tool on the
+# station over a Unix domain socket. Messages are JSON framed by a 4 byte
+# length; arrays of BULK_SIZE values or more (spectra) travel through a
+# shared memory block per connection instead of the socket
+BULK_SIZE = 64
+FRAME = struct.Struct('>I')
+
+# Methods of CriProbe a client may call
+METHODS = ('measure', 'read_measure', 'read_colorimetry')
+
+# Exceptions re-raised on the client by name
+ERRORS = {error.__name__: error for error in (codec.CriError, codec.ProbeTimeoutError, codec.ProtocolError,
+                                              ValueError, RuntimeError)}
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(FRAME.pack(len(data)) + data)
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Broker connection closed')
+        data += chunk
+    return data
+
+
+def recv_message(sock):
+    size = FRAME.unpack(recv_exactly(sock, FRAME.size))[0]
+    return json.loads(recv_exactly(sock, size))
+
+
+def encode_value(value, bulk):
+    # JSON-safe form of a CriProbe result; large arrays are set aside in bulk
+    # and referenced by index
+    if isinstance(value, dict):
+        return {key: encode_value(item, bulk) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item, bulk) for item in value]
+    if isinstance(value, np.ndarray):
+        if value.size >= BULK_SIZE:
+            bulk.append(value)
+            return {'__bulk__': len(bulk) - 1}
+        return {'__array__': value.tolist(), 'dtype': value.dtype.str}
+    if isinstance(value, bytes):
+        return {'__bytes__': value.decode('latin-1')}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode_value(value, buffer=None):
+    if isinstance(value, list):
+        return [decode_value(item, buffer) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if '__array__' in value:
+        return np.array(value['__array__'], dtype=value['dtype'])
+    if '__bytes__' in value:
+        return value['__bytes__'].encode('latin-1')
+    if '__shm__' in value:
+        offset, shape, dtype = value['__shm__']
+        # Copied out, so the result outlives the next request on the block
+        return np.ndarray(shape, dtype, buffer, offset).copy()
+    return {key: decode_value(item, buffer) for key, item in value.items()}
+
+
+def encode_error(err):
+    error = {'type': type(err).__name__, 'message': str(err)}
+    if isinstance(err, codec.CommandError):
+        error.update(code=err.code, command=err.command, message=err.message)
+    return error
+
+
+def decode_error(error):
+    if error['type'] in ('CommandError', 'MeasurementError'):
+        return getattr(codec, error['type'])(error['code'], error['command'], error['message'])
+    return ERRORS.get(error['type'], RuntimeError)(error['message'])
+
+
+class Request:
+    # A queued call and the futures of every client it answers
+    def __init__(self, client, method, args):
+        self.client = client
+        self.method = method
+        self.args = args
+        self.key = (method, json.dumps(args, sort_keys=True))
+        self.futures = [Future()]
+
+
+class ProbeBroker:
+    # Owns the probes of a CriProbe and runs client requests on them one at a
+    # time. Clients are served round-robin, so a busy dashboard cannot starve
+    # a calibration job, and identical requests waiting at the head of other
+    # clients' queues (e.g. everyone polling read_measure('xy')) are answered
+    # by a single serial exchange
+    def __init__(self, cri_probe=None, path=DEFAULT_SOCKET_PATH):
+        if cri_probe is None:
+            from .cri import CriProbe
+            cri_probe = CriProbe()
+        self.cri_probe = cri_probe
+        self.path = path
+        self.queues = collections.OrderedDict()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.executed = 0
+        self.server = None
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        # Listen on the socket and serve requests on background threads
+        self.bind()
+        self.threads = [threading.Thread(target=self.server.serve_forever, name='criprobe-broker', daemon=True),
+                        threading.Thread(target=self.work, name='criprobe-broker-worker', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def serve_forever(self):
+        self.start()
+        for thread in self.threads:
+            thread.join()
+
+    def bind(self):
+        if os.path.exists(self.path):
+            # A socket left behind by a broker that died is reused; a live
+            # one means another broker already owns the meters
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.remove(self.path)
+            else:
+                probe.close()
+                raise RuntimeError('A broker is already running on %s' % self.path)
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                broker.serve_client(self.request)
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.server.daemon_threads = True
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, client, method, args):
+        # Queue a call for client and return a future for its result
+        if method not in METHODS:
+            raise ValueError('Unknown broker method %r' % method)
+        request = Request(client, method, args)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('Broker closed')
+            self.queues.setdefault(client, collections.deque()).append(request)
+            self.condition.notify_all()
+        return request.futures[0]
+
+    def next_request(self):
+        # Take the request at the head of the next client's queue, plus any
+        # identical ones at the head of other queues. Must hold the condition
+        client, queue = next(iter(self.queues.items()))
+        request = queue.popleft()
+        # The client goes to the back of the line
+        self.queues.move_to_end(client)
+        for other, queue in self.queues.items():
+            if queue and queue[0].key == request.key:
+                request.futures += queue.popleft().futures
+        for other in [other for other, queue in self.queues.items() if not queue]:
+            del self.queues[other]
+        return request
+
+    def work(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or self.queues)
+                if self.closed:
+                    for queue in self.queues.values():
+                        for request in queue:
+                            for future in request.futures:
+                                future.set_exception(RuntimeError('Broker closed'))
+                    self.queues.clear()
+                    return
+                request = self.next_request()
+            try:
+                result = getattr(self.cri_probe, request.method)(**request.args)
+            except Exception as err:
+                for future in request.futures:
+                    future.set_exception(err)
+            else:
+                for future in request.futures:
+                    future.set_result(result)
+            self.executed += 1
+
+    def serve_client(self, sock):
+        # One connection: answer requests in order until the client hangs up
+        client = object()
+        block = None
+        try:
+            while True:
+                try:
+                    message = recv_message(sock)
+                except (ConnectionError, OSError):
+                    return
+                reply = {'id': message.get('id')}
+                try:
+                    if message['method'] == 'probes':
+                        result = [{key: value for key, value in probe.items() if key != 'Port'}
+                                  for probe in self.cri_probe.probes]
+                    else:
+                        result = self.submit(client, message['method'], message.get('args', {})).result()
+                    bulk = []
+                    reply['result'] = encode_value(result, bulk)
+                    if bulk:
+                        block = self.share(reply, bulk, block)
+                except Exception as err:
+                    reply['error'] = encode_error(err)
+                send_message(sock, reply)
+        finally:
+            if block is not None:
+                block.close()
+                block.unlink()
+
+    def share(self, reply, bulk, block):
+        # Copy bulk arrays into the connection's shared memory block, growing
+        # it when needed, and point the reply at them
+        offsets = np.cumsum([0] + [-(-array.nbytes // 8) * 8 for array in bulk])
+        if block is None or block.size < offsets[-1]:
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = shared_memory.SharedMemory(create=True, size=max(int(offsets[-1]), 1 << 16))
+        for array, offset in zip(bulk, offsets):
+            np.ndarray(array.shape, array.dtype, block.buf, int(offset))[...] = array
+        reply['shm'] = block.name
+        reply['result'] = self.locate(reply['result'], bulk, offsets)
+        return block
+
+    def locate(self, value, bulk, offsets):
+        if isinstance(value, list):
+            return [self.locate(item, bulk, offsets) for item in value]
+        if isinstance(value, dict):
+            if '__bulk__' in value:
+                array = bulk[value['__bulk__']]
+                return {'__shm__': [int(offsets[value['__bulk__']]), list(array.shape), array.dtype.str]}
+            return {key: self.locate(item, bulk, offsets) for key, item in value.items()}
+        return value
+
+
+class BrokerClient:
+    # Same measure/read_measure API as CriProbe, served by a ProbeBroker
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=None):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.lock = threading.Lock()
+        self.block = None
+        self.count = 0
+        self.probes = self.call('probes')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def call(self, method, **args):
+        with self.lock:
+            self.count += 1
+            send_message(self.sock, {'id': self.count, 'method': method, 'args': args})
+            reply = recv_message(self.sock)
+            if 'error' in reply:
+                raise decode_error(reply['error'])
+            buffer = None
+            if 'shm' in reply:
+                buffer = self.attach(reply['shm']).buf
+            return decode_value(reply['result'], buffer)
+
+    def attach(self, name):
+        if self.block is None or self.block.name != name:
+            if self.block is not None:
+                self.block.close()
+            self.block = shared_memory.SharedMemory(name=name)
+            # The broker owns the block; without this the resource tracker
+            # would unlink it when this process exits
+            resource_tracker.unregister(self.block._name, 'shared_memory')
+        return self.block
+
+    def measure(self, concurrent=False):
+        return self.call('measure', concurrent=concurrent)
+
+    def read_measure(self, measure_type, degree=2):
+        if isinstance(measure_type, tuple):
+            measure_type = list(measure_type)
+        return self.call('read_measure', measure_type=measure_type, degree=degree)
+
+    def read_colorimetry(self, quantities=None):
+        return self.call('read_colorimetry', quantities=quantities)
+
+    def close(self):
+        if self.block is not None:
+            self.block.close()
+            self.block = None
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Share attached CRI meters with other processes')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Unix socket to listen on')
+    parser.add_argument('--cache', help='probe identity cache file')
+    args = parser.parse_args(argv)
+
+    from .cri import CriProbe
+    with CriProbe(cache_path=args.cache) as cri_probe:
+        print('Serving %d probe(s) on %s' % (len(cri_probe.probes), args.socket), flush=True)
+        broker = ProbeBroker(cri_probe, args.socket)
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            broker.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+from .paths import DEFAULT_SOCKET_PATH
+
+# Command line front end:
+#
+#   criprobe list
+#   criprobe measure xy Y [--format csv] [-o readings.csv]
+#   criprobe spectrum -o spectrum.npy
+#
+# Only argparse and the standard library are loaded up front; pyserial and
+# numpy are imported once a command actually talks to the meters. A running
+# broker (python -m criprobe.broker) is used when present, otherwise probes
+# are detected directly with the identity cache
+
+
+def connect(args):
+    if not args.no_broker:
+        path = args.socket or DEFAULT_SOCKET_PATH
+        if args.socket or os.path.exists(path):
+            from .broker import BrokerClient
+            try:
+                return BrokerClient(path)
+            except OSError:
+                # A socket left behind by a broker that is no longer running
+                if args.socket:
+                    raise
+    from .cri import CriProbe, DEFAULT_CACHE_PATH
+    return CriProbe(cache_path=args.cache or DEFAULT_CACHE_PATH, validate_cache=not args.no_validate)
+
+
+def output_format(args, default):
+    if args.format:
+        return args.format
+    extension = os.path.splitext(args.output or '')[1].lstrip('.').lower()
+    return extension if extension in ('json', 'csv', 'npy') else default
+
+
+def open_output(args, binary=False):
+    if args.output and args.output != '-':
+        return open(args.output, 'wb' if binary else 'w', newline=None if binary else '')
+    return contextlib.nullcontext(sys.stdout.buffer if binary else sys.stdout)
+
+
+def json_default(value):
+    # numpy arrays and scalars, and raw replies
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, bytes):
+        return value.decode('latin-1').rstrip('\r\n')
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def flatten(record):
+    # One CSV cell per value: xy becomes xy[0] and xy[1]
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            continue
+        if hasattr(value, 'tolist'):
+            value = value.tolist()
+        if isinstance(value, list):
+            for n, item in enumerate(value):
+                row['%s[%d]' % (key, n)] = item
+        else:
+            row[key] = json_default(value) if isinstance(value, bytes) else value
+    return row
+
+
+def write_records(records, fmt, args):
+    if fmt == 'json':
+        with open_output(args) as f:
+            json.dump(records, f, default=json_default, indent=2)
+            f.write('\n')
+    elif fmt == 'csv':
+        rows = [flatten(record) for record in records]
+        fields = []
+        for row in rows:
+            fields += [field for field in row if field not in fields]
+        with open_output(args) as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    elif fmt == 'text':
+        with open_output(args) as f:
+            for record in records:
+                f.write('  '.join(str(value) for value in record.values()) + '\n')
+    else:
+        raise ValueError('%s output is not supported for this command' % fmt)
+
+
+def list_probes(args):
+    with connect(args) as cri_probe:
+        probes = [{key: probe.get(key) for key in ('ID', 'Model', 'Type')} for probe in cri_probe.probes]
+    write_records(probes, output_format(args, 'text'), args)
+
+
+def measure(args):
+    with connect(args) as cri_probe:
+        if not args.no_trigger:
+            cri_probe.measure(concurrent=True)
+        records = cri_probe.read_measure(args.quantities, args.degree)
+    write_records(records, output_format(args, 'json'), args)
+
+
+def spectrum(args):
+    with connect(args) as cri_probe:
+        if not args.no_trigger:
+            cri_probe.measure(concurrent=True)
+        records = cri_probe.read_measure('Spectrum')
+    fmt = output_format(args, 'json')
+    if fmt == 'json':
+        return write_records(records, fmt, args)
+
+    # One table: the wavelength grid, then a spectrum per probe
+    import numpy as np
+    if not records:
+        raise ValueError('No spectroradiometer found')
+    wavelength = records[0]['Wavelength']
+    if any(not np.array_equal(record['Wavelength'], wavelength) for record in records):
+        raise ValueError('Spectra are on different wavelength grids; use JSON output')
+    table = np.vstack([wavelength] + [record['Spectrum'] for record in records])
+    if fmt == 'npy':
+        with open_output(args, binary=True) as f:
+            np.save(f, table)
+    elif fmt == 'csv':
+        with open_output(args) as f:
+            writer = csv.writer(f)
+            writer.writerow(['Wavelength'] + [record['Probe ID'] for record in records])
+            writer.writerows(table.T.tolist())
+    else:
+        raise ValueError('%s output is not supported for this command' % fmt)
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='criprobe', description='Colorimetry Research meters from the command line')
+    parser.add_argument('--socket', help='broker socket to use (default: use a running broker if there is one)')
+    parser.add_argument('--no-broker', action='store_true', help='open the meters directly')
+    parser.add_argument('--cache', help='probe identity cache file')
+    parser.add_argument('--no-validate', action='store_true', help='trust cached identities without querying')
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    def output_options(command, formats):
+        command.add_argument('-o', '--output', help='output file (default: standard output)')
+        command.add_argument('--format', choices=formats, help='output format (default: from the file extension)')
+
+    command = commands.add_parser('list', help='list attached probes')
+    output_options(command, ['text', 'json', 'csv'])
+    command.set_defaults(func=list_probes)
+
+    command = commands.add_parser('measure', help='measure and report quantities, e.g. xy Y')
+    command.add_argument('quantities', nargs='+')
+    command.add_argument('--degree', type=int, default=2, choices=[2, 10], help='standard observer')
+    command.add_argument('--no-trigger', action='store_true', help='report the last measurement without M')
+    output_options(command, ['json', 'csv'])
+    command.set_defaults(func=measure)
+
+    command = commands.add_parser('spectrum', help='measure and dump spectra')
+    command.add_argument('--no-trigger', action='store_true', help='report the last measurement without M')
+    output_options(command, ['json', 'csv', 'npy'])
+    command.set_defaults(func=spectrum)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    try:
+        args.func(args)
+    except (RuntimeError, ValueError, OSError) as err:
+        sys.exit('criprobe: %s' % err)
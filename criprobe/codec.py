@@ -0,0 +1,232 @@
+import functools
+import re
+
+# Replies have the form <status>:<code>:<command>:<value>, where status is OK
+# or ER, e.g. OK:0:RM xy:0.3754,0.3773 or ER:20:M:Measurement failed. A
+# Spectrum reply continues with one sample per line after the header line.
+# numpy is imported only where arrays are built, so detecting probes and
+# reading scalars do not load it
+
+NUMBER = re.compile(rb'-?\d+[\d.eE+-]*')
+PROBE_ID = re.compile(rb'A\d{5}')
+PROBE_MODEL = re.compile(rb'CR-\d{3}')
+INSTRUMENT_TYPE = re.compile(rb'\d')
+
+INSTRUMENT_TYPES = {0: 'Photometer', 1: 'Colorimeter', 2: 'Spectroradiometer'}
+
+# Units reported by quantities whose meaning is not known to the codec
+UNITS = (b'msec', b'Hz', b'deg')
+
+
+class CriError(RuntimeError):
+    # Base class for errors reported by or about a probe; probe_id names the
+    # probe once it is known
+    probe_id = None
+
+    def __str__(self):
+        message = super().__str__()
+        return message if self.probe_id is None else '%s: %s' % (self.probe_id, message)
+
+
+class ProbeTimeoutError(CriError):
+    # A probe did not answer within the command's deadline
+    pass
+
+
+class ProtocolError(CriError, ValueError):
+    # A reply that does not follow the remote protocol
+    pass
+
+
+class CommandError(CriError):
+    # The probe answered a command with an ER status
+    def __init__(self, code, command, message):
+        super().__init__('%s failed with error %d: %s' % (command, code, message))
+        self.code = code
+        self.command = command
+        self.message = message
+
+
+class MeasurementError(CommandError):
+    # The probe could not complete a measurement (M)
+    pass
+
+
+def decode_status(reply):
+    # Split a reply into (code, command, value) without decoding the value;
+    # ER replies raise CommandError, or MeasurementError for M
+    fields = reply.split(b':', 3)
+    if len(fields) != 4 or fields[0] not in (b'OK', b'ER'):
+        raise ProtocolError('Malformed reply %r' % bytes(reply[:64]))
+    try:
+        code = int(fields[1])
+    except ValueError:
+        raise ProtocolError('Malformed status code in reply %r' % bytes(reply[:64]))
+    command = fields[2].decode('utf-8', 'replace')
+    value = fields[3].rstrip(b'\r\n')
+    if fields[0] == b'ER':
+        error = MeasurementError if command == 'M' else CommandError
+        raise error(code, command, value.decode('utf-8', 'replace'))
+    return code, command, value
+
+
+def decode_reply(reply, command):
+    # decode_status() of the reply to command, without the echo. A reply to
+    # another command, e.g. a late one after a timeout, raises ProtocolError
+    code, echoed, value = decode_status(reply)
+    if echoed != command:
+        raise ProtocolError('Expected a reply to %s, got one to %s' % (command, echoed))
+    return code, value
+
+
+def decode_probe_id(reply):
+    match = PROBE_ID.search(decode_status(reply)[2])
+    if match:
+        return match.group().decode()
+    raise RuntimeError('CRI Probe ID Not Found')
+
+
+def decode_probe_model(reply):
+    match = PROBE_MODEL.search(decode_status(reply)[2])
+    if match:
+        return match.group().decode()
+    raise RuntimeError('CRI Probe Model Not Found')
+
+
+def decode_probe_type(reply):
+    match = INSTRUMENT_TYPE.match(decode_status(reply)[2])
+    if match:
+        return INSTRUMENT_TYPES.get(int(match.group()), 'Unknown')
+    raise RuntimeError('CRI Probe Type Not Found')
+
+
+def decode_measure(reply):
+    # Check the reply to M; failures raise MeasurementError
+    return decode_status(reply)[0]
+
+
+def decode_text(value):
+    return value.decode('utf-8', 'replace')
+
+
+def decode_scalar(value):
+    # The meter answers e.g. 'NA' when a quantity is not available
+    numbers = NUMBER.findall(value)
+    return float(numbers[0]) if numbers else decode_text(value)
+
+
+def decode_vector(value):
+    import numpy as np
+    numbers = NUMBER.findall(value)
+    return np.array(numbers, dtype=np.float64) if numbers else decode_text(value)
+
+
+def decode_auto(value):
+    # Shape inferred from the reply, for quantities the codec does not know
+    numbers = NUMBER.findall(value)
+    if not numbers:
+        return decode_text(value)
+    if len(numbers) == 1:
+        return float(numbers[0])
+    import numpy as np
+    return np.array(numbers, dtype=np.float64)
+
+
+class QuantityDecoder:
+    # How to decode one RM quantity: a value decoder, the number of values
+    # it carries (None if not fixed) and its unit
+    __slots__ = ('decode', 'size', 'unit')
+
+    def __init__(self, decode, size=None, unit=None):
+        self.decode = decode
+        self.size = size
+        self.unit = unit
+
+    def decode_into(self, value, out):
+        # Parse the numbers of a reply value straight into out; missing or
+        # mismatched values are stored as NaN
+        numbers = NUMBER.findall(value)
+        if len(numbers) == len(out):
+            out[:] = numbers
+        else:
+            out[:] = float('nan')
+
+
+SCALAR = QuantityDecoder(decode_scalar, 1)
+PAIR = QuantityDecoder(decode_vector, 2)
+TRIPLE = QuantityDecoder(decode_vector, 3)
+TEXT = QuantityDecoder(decode_text, 0)
+AUTO = QuantityDecoder(decode_auto)
+
+QUANTITIES = {'X': SCALAR, 'Y': SCALAR, 'Z': SCALAR,
+              'X10': SCALAR, 'Y10': SCALAR, 'Z10': SCALAR,
+              'xy': PAIR, 'xy10': PAIR, 'uv': PAIR, 'uv10': PAIR,
+              'XYZ': TRIPLE, 'XYZ10': TRIPLE,
+              'CCT': PAIR,
+              'Radiometric': TRIPLE,
+              'Photometric': SCALAR,
+              'Exposure': QuantityDecoder(decode_scalar, 1, 'msec'),
+              'SyncFreq': QuantityDecoder(decode_scalar, 1, 'Hz'),
+              'Time': SCALAR,
+              'RangeMode': TEXT,
+              'Mode': TEXT}
+
+
+def quantity_decoder(measure_type):
+    return QUANTITIES.get(measure_type, AUTO)
+
+
+def decode_measurement(measure_type, reply, command=None):
+    # Decode an RM reply into (value, unit); unit is None when there is none.
+    # The reply must echo command (RM <measure_type> unless given, e.g. for a
+    # 10 degree variant) and a quantity of fixed width must carry that many
+    # numbers, or ProtocolError is raised; text such as 'NA' is passed on
+    value = decode_reply(reply, 'RM ' + measure_type if command is None else command)[1]
+    if not value:
+        raise ValueError('Invalid measurement')
+    decoder = QUANTITIES.get(measure_type)
+    if decoder is not None and decoder.size:
+        count = len(NUMBER.findall(value))
+        if count and count != decoder.size:
+            raise ProtocolError('Expected %d values for %s, got %d' % (decoder.size, measure_type, count))
+    if decoder is None:
+        unit = None
+        for name in UNITS:
+            if name in value:
+                unit = name.decode()
+        return decode_auto(value), unit
+    return decoder.decode(value), decoder.unit
+
+
+@functools.lru_cache(maxsize=None)
+def wavelength_axis(start, step, count):
+    # Shared, read-only wavelength grid for each spectrum header
+    import numpy as np
+    axis = start + step * np.arange(count, dtype=np.float64)
+    axis.flags.writeable = False
+    return axis
+
+
+def decode_spectrum_header(reply):
+    # RM Spectrum replies start with 'start,stop,step,count', e.g.
+    # OK:0:RM Spectrum:380.0,780.0,2.0,201
+    header = decode_reply(reply.split(b'\n', 1)[0], 'RM Spectrum')[1]
+    try:
+        start, stop, step, count = header.split(b',')
+        return float(start), float(stop), float(step), int(float(count))
+    except ValueError:
+        raise ProtocolError('Invalid spectrum header')
+
+
+def decode_spectrum(reply, out=None):
+    # Parse a complete Spectrum reply (header line followed by one value per
+    # line) straight into a float64 array, optionally one supplied by the caller
+    start, stop, step, count = decode_spectrum_header(reply)
+    values = reply.split(b'\n', 1)[1].split() if b'\n' in reply else []
+    if len(values) != count:
+        raise ProtocolError('Expected %d spectral values, got %d' % (count, len(values)))
+    if out is None:
+        import numpy as np
+        out = np.empty(count, dtype=np.float64)
+    out[:] = values
+    return wavelength_axis(start, step, count), out
@@ -1,12 +1,213 @@
+import json
+import os
 import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 import serial
 import serial.tools.list_ports
-import numpy as np
+from serial.tools.list_ports_common import ListPortInfo
+
+from .codec import (CommandError, CriError, ProbeTimeoutError, decode_probe_id, decode_probe_model, decode_probe_type,
+                    decode_measure, decode_measurement, decode_reply, decode_scalar, decode_spectrum, decode_status,
+                    decode_text)
+from .framing import ReplyReader
+from .instrumentation import Instrumentation, command_verb
+from .timeouts import MeasureDeadline, QUERY_TIMEOUT, MEASURE_TIMEOUT
+
+# Readings that determine how long M takes, see deadline_settings()
+DEADLINE_QUANTITIES = ('Exposure', 'SyncFreq', 'RangeMode')
+
+# Read in one batch before the first M: the readings and the exposure mode
+DEADLINE_COMMANDS = tuple('RM ' + quantity for quantity in DEADLINE_QUANTITIES) + ('RS ExposureMode',)
+
+# Instrument setup handled by configure(), in the order it is applied: each
+# mode goes before the value it governs
+SETTINGS = ('Speed', 'ExposureMode', 'Exposure', 'RangeMode', 'Range', 'SyncMode', 'SyncFreq', 'Aperture',
+            'Accessory')
+
+# Settings whose values are numbers, so '100.000 msec' is the same as 100
+NUMERIC_SETTINGS = ('Exposure', 'SyncFreq', 'Range')
+
+# Default location for the on-disk probe identity cache
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'criprobe', 'probes.json')
+
+
+def list_ports():
+    ports = list(serial.tools.list_ports.comports())
+    # Devices that do not enumerate as USB serial ports, such as emulated
+    # meters, can be added through CRIPROBE_PORTS
+    extra = os.environ.get('CRIPROBE_PORTS')
+    if extra:
+        ports += [ListPortInfo(device) for device in extra.split(os.pathsep) if device]
+    return ports
+
+
+def is_cri_port(port):
+    # Detect a probable CRI meter on windows or mac
+    return bool(('COM' in port.description and 'Colorimetry Research' in port.description) or
+                re.search(r'A\d{6}', port.device))
+
+
+def identity_cache_key(port):
+    # Key on the device path plus the USB serial number when the OS
+    # reports one, so a meter moved to another port is not mistaken
+    return '%s|%s' % (port.device, getattr(port, 'serial_number', None) or '')
+
+
+def load_identity_cache(cache_path):
+    if not cache_path:
+        return {}
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        # A missing or corrupt cache just means a full detection
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_identity_cache(cache_path, ports, probes):
+    cache = {}
+    for port, probe in zip(ports, probes):
+        cache[identity_cache_key(port)] = {key: probe[key] for key in ('ID', 'Model', 'Type')}
+
+    # Write to a temporary file first so a concurrent reader never sees a
+    # partially written cache
+    cache_dir = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def rm_command(probe, measure_type, degree=2):
+    # Setup RM command
+    rm = 'RM ' + measure_type
+    suffix = ''
+
+    # RM commands change based on 2 or 10 degree
+    if degree == 10:
+        if measure_type not in ('X', 'Y', 'Z', 'XYZ', 'xy'):
+            raise ValueError('10 degree only valid with X, Y, Z, XYZ, and xy')
+        if probe['Type'] != 'Spectroradiometer':
+            raise RuntimeError('10 degree only valid if instrument type is spectroradiometer')
+        suffix = '10'
+    elif degree != 2:
+        raise ValueError('Degree of 2 or 10 required')
+
+    return rm + suffix
+
+
+def parse_measurement(probe, measure_type, result, rm=None):
+    # Create probe ID; rm is the command sent when it is not RM measure_type
+    response = {'Probe ID': probe['ID']}
+    response[measure_type], unit = decode_measurement(measure_type, result, rm)
+    if unit is not None:
+        response['Unit'] = unit
+    return response
+
+
+def combine_measurements(probe, measure_types, results, rms=None):
+    # Combine the quantities into one record per probe, keeping the unit of
+    # each quantity that reports one; rms are the commands sent, if not the
+    # plain RM of each quantity
+    response = {'Probe ID': probe['ID']}
+    units = {}
+    for n, (measure_type, result) in enumerate(zip(measure_types, results)):
+        if measure_type == 'Spectrum':
+            response['Wavelength'], response['Spectrum'] = decode_spectrum(result)
+            continue
+        measurement = parse_measurement(probe, measure_type, result, None if rms is None else rms[n])
+        response[measure_type] = measurement[measure_type]
+        if 'Unit' in measurement:
+            units[measure_type] = measurement['Unit']
+    if units:
+        response['Units'] = units
+    return response
+
+
+def deadline_settings(response):
+    # Pick the readings and settings that determine how long M takes out of
+    # a record
+    settings = {}
+    for name, key in (('Exposure', 'exposure'), ('SyncFreq', 'sync_freq'), ('RangeMode', 'range_mode'),
+                      ('ExposureMode', 'exposure_mode')):
+        value = response.get(name)
+        if isinstance(value, float) or (name in ('RangeMode', 'ExposureMode') and isinstance(value, str)):
+            settings[key] = value
+    return settings
+
+
+def decode_deadline_settings(replies):
+    # deadline_settings() of the replies to DEADLINE_COMMANDS; values a
+    # meter rejects are left out
+    response = {}
+    for cmd, reply in zip(DEADLINE_COMMANDS, replies):
+        verb, name = cmd.split(' ')
+        try:
+            if verb == 'RS':
+                response[name] = decode_text(decode_reply(reply, cmd)[1])
+            else:
+                response[name] = decode_measurement(name, reply)[0]
+        except (CommandError, ValueError):
+            continue
+    return deadline_settings(response)
+
+
+def measure_status(results):
+    # Per-probe results of a concurrent M. Once every probe has answered, the
+    # first failure is raised with the results of all probes attached
+    errors = [result['Error'] for result in results if 'Error' in result]
+    if errors:
+        errors[0].results = results
+        raise errors[0]
+    return results
+
+
+def setting_text(value):
+    # Wire form of a setting value. Floats are sent in full, as the shortest
+    # text that reads back as the same number, so e.g. a SyncFreq of
+    # 59.94006 is not rounded to 59.9401
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def same_setting(name, current, value):
+    # Numeric settings are compared by value, so a reported '100.000 msec'
+    # matches a requested 100; anything else by its text, ignoring case, so
+    # an Aperture of '1 deg' differs from '1/8 deg'
+    if current is None:
+        return False
+    value = setting_text(value)
+    if name in NUMERIC_SETTINGS:
+        current_number = decode_scalar(current.encode())
+        number = decode_scalar(value.encode())
+        if isinstance(current_number, float) and isinstance(number, float):
+            return abs(current_number - number) <= 1e-9 * max(abs(current_number), abs(number))
+    return current.strip().casefold() == value.strip().casefold()
 
 
 class CriProbe:
-    def __init__(self, simulated=False):
-        # Autodetects CRI probe/s
+    def __init__(self, simulated=False, cache_path=None, validate_cache=True, pool=None):
+        # Autodetects CRI probe/s. With pool=True (or a SessionPool) ports are
+        # borrowed from a process-wide pool and returned to it by close()
+        self.cache_path = cache_path
+        self.validate_cache = validate_cache
+        self.instrumentation = None
+        self.deadlines = {}
+        self.readers = {}
+        # Last known setup of each port, see read_settings()
+        self.settings = {}
+        if pool is True:
+            from .pool import default_pool
+            pool = default_pool
+        self.pool = pool
         if simulated:
             # Create two simulated probes which mirror the ID, Model, and Type
             # information that would be found during real probe autodetect
@@ -21,114 +222,421 @@ class CriProbe:
                             'Type': 'Spectroradiometer'
                             }]
         else:
-            self.probes = []
-            ports = self.get_ports()
-            for port in ports:
-                # Detect a probable CRI meter on windows or mac
-                if ('COM' in port.description and 'Colorimetry Research' in port.description) or re.search(r'A\d{6}',
-                                                                                                           port.device):
-                    # Save the port device for later use
-                    cri_probe = self.open_port(port.device)
-                    probe_info = {'Port': cri_probe}
-
-                    probe_result = self.send_command(cri_probe, 'RC ID')
-                    id = re.search(r'(A\d{5})', str(probe_result))
-                    if id:
-                        probe_info['ID'] = str(id.group(1))
-                    else:
-                        raise RuntimeError('CRI Probe ID Not Found')
-
-                    probe_result = self.send_command(cri_probe, 'RC Model')
-                    model = re.search(r'(CR-\d{3})', str(probe_result))
-                    if model:
-                        probe_info['Model'] = str(model.group(1))
-                    else:
-                        raise RuntimeError('CRI Probe Model Not Found')
-
-                    probe_result = self.send_command(cri_probe, 'RC InstrumentType')
-                    instrument_type = re.search(r'InstrumentType:(\d)', str(probe_result))
-                    if instrument_type:
-                        reg_type = instrument_type.group(1)
-                        probe_type = 'Unknown'
-                        if int(reg_type) == 0:
-                            probe_type = 'Photometer'
-                        elif int(reg_type) == 1:
-                            probe_type = 'Colorimeter'
-                        elif int(reg_type) == 2:
-                            probe_type = 'Spectroradiometer'
-                        probe_info['Type'] = probe_type
-                    else:
-                        raise RuntimeError('CRI Probe Type Not Found')
-
-                    self.probes.append(probe_info)
+            cache = load_identity_cache(self.cache_path)
+            ports = [port for port in self.get_ports() if is_cri_port(port)]
+            if self.pool is not None:
+                self.pool.prune(port.device for port in ports)
+
+            # Query every candidate port at once so startup time does not grow
+            # with the number of attached meters
+            self.probes = self.map_probes(lambda port: self.detect_probe(port, cache), ports)
+
+            if self.cache_path:
+                save_identity_cache(self.cache_path, ports, self.probes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # Hand pooled ports back to the pool, close any others
+        for probe in self.probes:
+            if self.pool is not None:
+                self.pool.release(probe['Port'])
+            elif hasattr(probe['Port'], 'close'):
+                probe['Port'].close()
+        self.probes = []
+
+    def detect_probe(self, port, cache=None):
+        if self.pool is not None:
+            probe_info = self.pool.acquire(port.device, lambda: self.identify_probe(port, cache))
+            # Commands go through the session's reader from now on
+            self.readers.pop(probe_info['Port'], None)
+            return probe_info
+        return self.identify_probe(port, cache)
+
+    def identify_probe(self, port, cache=None):
+        # Save the port device for later use
+        cri_probe = self.open_port(port.device)
+        probe_info = {'Port': cri_probe}
+
+        # A cached identity is used as is when validation is turned off, so no
+        # RC queries are sent at all
+        cached = (cache or {}).get(identity_cache_key(port))
+        if cached and not self.validate_cache:
+            probe_info.update(cached)
+            return probe_info
+
+        probe_info['ID'] = decode_probe_id(self.send_command(cri_probe, 'RC ID'))
+
+        # Otherwise the ID alone confirms the cached identity; a different
+        # meter on the same port falls through to a full refresh
+        if cached and cached['ID'] == probe_info['ID']:
+            probe_info.update(cached)
+            return probe_info
+
+        probe_info['Model'] = decode_probe_model(self.send_command(cri_probe, 'RC Model'))
+        probe_info['Type'] = decode_probe_type(self.send_command(cri_probe, 'RC InstrumentType'))
+        return probe_info
 
     def get_ports(self):
-        return serial.tools.list_ports.comports()
+        return list_ports()
 
     def open_port(self, device):
-        # Allow up to 30 seconds for probe to return a measurement
-        return serial.Serial(device, 115200, timeout=30)
+        # Allow up to 30 seconds for probe to return a measurement; each
+        # command narrows this to its own deadline
+        return serial.Serial(device, 115200, timeout=MEASURE_TIMEOUT)
+
+    def deadline(self, port):
+        deadline = self.deadlines.get(port)
+        if deadline is None:
+            deadline = self.deadlines[port] = MeasureDeadline()
+        return deadline
+
+    def set_timeout(self, port, cmd):
+        # Queries fail fast; M gets a deadline derived from the probe's
+        # exposure settings and measurement history
+        timeout = self.deadline(port).timeout() if cmd == 'M' else QUERY_TIMEOUT
+        if getattr(port, 'timeout', None) != timeout:
+            port.timeout = timeout
+
+    def reader(self, port):
+        # Pooled ports share one reader between every instance using them
+        reader = self.readers.get(port)
+        if reader is None:
+            if self.pool is not None:
+                reader = self.pool.reader(port)
+            if reader is None:
+                reader = ReplyReader(port)
+            self.readers[port] = reader
+        return reader
 
     def send_command(self, port, cmd):
+        if cmd == 'M':
+            self.prepare_deadline(port)
         cmd_bytes = bytes(cmd, 'utf-8') + b'\r\n'
-        port.write(cmd_bytes)
-        probe_result = port.readline()
+        with self.reader(port).lock:
+            self.set_timeout(port, cmd)
+            start = time.perf_counter()
+            self.write(port, cmd_bytes)
+            try:
+                probe_result = self.receive(port, cmd, start, len(cmd_bytes))
+            except ProbeTimeoutError:
+                if cmd == 'M':
+                    self.deadline(port).missed()
+                raise
+        if cmd == 'M' and probe_result.startswith(b'OK'):
+            self.deadline(port).observe(time.perf_counter() - start)
+        return probe_result
+
+    def prepare_deadline(self, port):
+        # The first M on a probe is given a deadline from its exposure
+        # settings, read in one pipelined batch, instead of MEASURE_TIMEOUT,
+        # so a meter that hangs is given up on quickly from the first cycle
+        deadline = self.deadline(port)
+        if deadline.unknown():
+            deadline.queried = True
+            replies = self.send_commands(port, list(DEADLINE_COMMANDS))
+            deadline.update(**decode_deadline_settings(replies))
+
+    def write(self, port, cmd_bytes):
+        reader = self.reader(port)
+        try:
+            # Whatever is left over from a command that timed out must not be
+            # taken for the reply to this one
+            if reader.stale:
+                reader.discard()
+            port.write(cmd_bytes)
+        except serial.SerialException:
+            self.reclaim(port)
+            raise
+
+    def receive(self, port, cmd, start, bytes_written):
+        # Read the reply to cmd from the port's buffer, recording its latency
+        # from start when instrumented
+        reader = self.reader(port)
+        bytes_read = reader.bytes_read
+        try:
+            probe_result = reader.read_reply(cmd)
+        except serial.SerialException:
+            self.reclaim(port)
+            raise
+        except ProbeTimeoutError:
+            if self.instrumentation is not None:
+                self.instrumentation.record(self.probe_name(port), command_verb(cmd), time.perf_counter() - start,
+                                            bytes_written, reader.bytes_read - bytes_read, True)
+            raise
+        if self.instrumentation is not None:
+            self.instrumentation.record(self.probe_name(port), command_verb(cmd), time.perf_counter() - start,
+                                        bytes_written, len(probe_result))
         return probe_result
 
-    def measure(self):
+    def reclaim(self, port):
+        # A port that failed at the OS level (e.g. the meter was unplugged)
+        # must not be handed out again
+        self.readers.pop(port, None)
+        self.settings.pop(port, None)
+        if self.pool is not None:
+            self.pool.discard(port)
+
+    def send_commands(self, port, cmds):
+        # Pipeline several commands: write them all in one go, then collect
+        # the replies in order, so the link latency is paid once. A spectrum
+        # is sent last so the short replies are not held up behind its bulk
+        # readout
+        order = sorted(range(len(cmds)), key=lambda i: cmds[i] == 'RM Spectrum')
+        cmd_bytes = b''.join(bytes(cmds[i], 'utf-8') + b'\r\n' for i in order)
+        results = [None] * len(cmds)
+        with self.reader(port).lock:
+            self.set_timeout(port, 'RM')
+            start = time.perf_counter()
+            self.write(port, cmd_bytes)
+            for i in order:
+                # Each command's latency runs from the shared write to its reply
+                results[i] = self.receive(port, cmds[i], start, len(cmds[i]) + 2)
+        return results
+
+    def read_spectrum(self, out=None):
+        # Read the full spectrum from every probe. Rows of an optional
+        # (n_probes, n_wavelengths) float64 array are filled in place
+        def read_probe(args):
+            n, probe = args
+            # The reader frames the header and every sample line as one reply
+            result = self.send_command(probe['Port'], 'RM Spectrum')
+            wavelength, spectrum = self.parse_reply(probe, 'RM Spectrum', decode_spectrum, result,
+                                                    None if out is None else out[n])
+            return {'Probe ID': probe['ID'], 'Wavelength': wavelength, 'Spectrum': spectrum}
+
+        return self.map_probes(read_probe, list(enumerate(self.probes)))
+
+    def read_colorimetry(self, quantities=None):
+        # Compute XYZ, xy, uv and CCT (and their 10 degree variants) locally
+        # from a single RM Spectrum per probe instead of an RM per quantity
+        from .colorimetry import QUANTITIES, colorimetry
+        quantities = QUANTITIES if quantities is None else quantities
+        if any(probe['Type'] != 'Spectroradiometer' for probe in self.probes):
+            raise RuntimeError('Local colorimetry only valid if instrument type is spectroradiometer')
+        return [dict({'Probe ID': response['Probe ID']},
+                     **colorimetry(response['Spectrum'], response['Wavelength'], quantities))
+                for response in self.read_measure('Spectrum')]
+
+    def read_resampled(self, wavelength, method='interpolate'):
+        # Read spectra and move them to another wavelength grid, e.g.
+        # read_resampled(grid(400, 700, 5), method='bin'); see resample.py
+        from .resample import resample_records
+        if any(probe['Type'] != 'Spectroradiometer' for probe in self.probes):
+            raise RuntimeError('Spectrum only valid if instrument type is spectroradiometer')
+        return resample_records(self.read_measure('Spectrum'), wavelength, method)
+
+    def observe_settings(self, probe, response):
+        # Exposure, SyncFreq, RangeMode and ExposureMode refine the probe's M
+        # deadline
+        settings = deadline_settings(response)
+        if settings:
+            self.deadline(probe['Port']).update(**settings)
+
+    def probe_settings(self, probe, names, refresh=False):
+        # Cached setup of one probe; values not known yet are queried with a
+        # single pipelined batch of RS commands
+        cache = self.settings.setdefault(probe['Port'], {})
+        missing = [name for name in names if refresh or name not in cache]
+        if missing:
+            replies = self.send_commands(probe['Port'], ['RS ' + name for name in missing])
+            for name, reply in zip(missing, replies):
+                cache[name] = decode_text(decode_reply(reply, 'RS ' + name)[1])
+        return cache
+
+    def read_settings(self, settings=SETTINGS, refresh=False):
+        # Report the setup of every probe. Values are read from the meters
+        # once and then served from the settings cache unless refresh is set
+        names = [settings] if isinstance(settings, str) else list(settings)
+
+        def read_probe(probe):
+            cache = self.probe_settings(probe, names, refresh)
+            return dict({'Probe ID': probe['ID']}, **{name: cache[name] for name in names})
+
+        return self.map_probes(read_probe)
+
+    def configure(self, settings=None, **kwargs):
+        # Apply setup values, e.g. configure(ExposureMode='Fixed', Exposure=200),
+        # to every probe at once. Only the values that differ from the cached
+        # setup are sent, as one pipelined batch of SM commands per probe.
+        # Returns the settings changed on each probe
+        settings = dict(settings or {}, **kwargs)
+        for name in settings:
+            if name not in SETTINGS:
+                raise ValueError('Unknown setting %s, expected one of %s' % (name, ', '.join(SETTINGS)))
+        names = sorted(settings, key=SETTINGS.index)
+
+        def configure_probe(probe):
+            cache = self.probe_settings(probe, names)
+            changed = {name: settings[name] for name in names if not same_setting(name, cache[name], settings[name])}
+            if not changed:
+                return {'Probe ID': probe['ID'], 'Changed': changed}
+            replies = self.send_commands(probe['Port'], ['SM %s %s' % (name, setting_text(value))
+                                                         for name, value in changed.items()])
+            error = None
+            for (name, value), reply in zip(changed.items(), replies):
+                try:
+                    decode_status(reply)
+                except CommandError as err:
+                    # The meter's value is unknown again
+                    del cache[name]
+                    error = error or err
+                else:
+                    cache[name] = setting_text(value)
+            self.observe_settings(probe, {name: decode_scalar(cache[name].encode())
+                                          for name in ('ExposureMode', 'Exposure', 'SyncFreq', 'RangeMode')
+                                          if name in changed and name in cache})
+            if error is not None:
+                raise error
+            return {'Probe ID': probe['ID'], 'Changed': changed}
+
+        return self.map_probes(configure_probe)
+
+    def forget_settings(self):
+        # Drop the settings cache, e.g. after the setup was changed on the
+        # meter's front panel
+        self.settings.clear()
+
+    def update_deadlines(self):
+        # Query the settings that determine how long M takes on every probe
+        return self.read_measure(list(DEADLINE_QUANTITIES))
+
+    def instrument(self, callback=None):
+        # Start collecting per probe, per verb timing and I/O statistics;
+        # set self.instrumentation to None to turn it off again
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation()
+        if callback is not None:
+            self.instrumentation.add_callback(callback)
+        return self.instrumentation
+
+    def probe_name(self, port):
+        # Statistics are keyed by probe ID once detection has found it
+        for probe in getattr(self, 'probes', []):
+            if probe['Port'] is port and 'ID' in probe:
+                return probe['ID']
+        return getattr(port, 'port', None) or str(port)
+
+    def parse_reply(self, probe, verb, parser, *args):
+        if self.instrumentation is None:
+            return parser(*args)
+        start = time.perf_counter()
+        result = parser(*args)
+        self.instrumentation.record(probe['ID'], verb, parse_time=time.perf_counter() - start)
+        return result
+
+    def map_probes(self, func, probes=None):
+        # Run func(probe) for every probe (or port) at once, one worker per
+        # serial port, and return the results in order
+        if probes is None:
+            probes = self.probes
+        if len(probes) < 2:
+            return [func(probe) for probe in probes]
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            return list(executor.map(func, probes))
+
+    def measure(self, concurrent=False):
+        if concurrent:
+            # Trigger every probe at once so the cycle costs the slowest
+            # integration time rather than the sum of all of them
+            def measure_probe(probe):
+                status = {'Probe ID': probe['ID'], 'Status': None}
+                try:
+                    status['Status'] = self.send_command(probe['Port'], 'M')
+                    decode_measure(status['Status'])
+                except CriError as err:
+                    err.probe_id = probe['ID']
+                    status['Error'] = err
+                return status
+
+            return measure_status(self.map_probes(measure_probe))
+
         result = []
         for probe in self.probes:
             # Initialize probe measurement
             result = self.send_command(probe['Port'], 'M')
+            # A failed measurement raises MeasurementError
+            try:
+                decode_measure(result)
+            except CriError as err:
+                err.probe_id = probe['ID']
+                raise
         return result
 
-    def read_measure(self, measure_type, degree=2):
+    def read_measure(self, measure_type, degree=2, columnar=False):
+        if columnar:
+            # Return a MeasurementBatch instead of a list of dicts
+            from .records import MeasurementBatch
+            timestamp = time.time()
+            return MeasurementBatch.from_records(self.read_measure(measure_type, degree), timestamp)
+
+        if isinstance(measure_type, (list, tuple)):
+            return self.read_measures(measure_type, degree)
+
+        # Spectra span many lines and need their own reader
+        if measure_type == 'Spectrum':
+            for probe in self.probes:
+                rm_command(probe, measure_type, degree)
+            return self.read_spectrum()
+
         final_result = []
 
         for probe in self.probes:
-            response = {}
-
-            # Setup RM command
-            rm = 'RM ' + measure_type
-            suffix = ''
-
-            # RM commands change based on 2 or 10 degree
-            if degree == 10:
-                if measure_type != 'X' or 'Y' or 'Z' or 'XYZ' or 'xy':
-                    raise ValueError('10 degree only valid with X, Y, Z, XYZ, and xy')
-                if probe['Type'] != 'Spectroradiometer':
-                    raise RuntimeError('10 degree only valid if instrument type is spectroradiometer')
-                suffix = '10'
-            elif degree != 2:
-                raise ValueError('Degree of 2 or 10 required')
-
-            # Create probe ID
-            response['Probe ID'] = probe['ID']
-
-            # RM
-            rm += suffix
+            rm = rm_command(probe, measure_type, degree)
             result = self.send_command(probe['Port'], rm)
-            new_result = result.decode().rstrip().split(':')
-            measurement = new_result[3]
-
-            # Validate measurement
-            if measurement == '':
-                raise ValueError('Invalid measurement')
-
-            # Return unit
-            for unit in ['msec', 'Hz', 'deg']:
-                if unit in measurement:
-                    response['Unit'] = unit
-
-            # Find and return measurement
-            m_list = re.findall(r'(-?\d+[\d.eE+-]*)', measurement)
-            if m_list:
-                if len(m_list) == 1:
-                    response[measure_type] = float(m_list[0])
-                else:
-                    response[measure_type] = np.array(m_list).astype('float')
-            else:
-                response[measure_type] = measurement
+            response = self.parse_reply(probe, rm, parse_measurement, probe, measure_type, result, rm)
+            self.observe_settings(probe, response)
             final_result.append(response)
 
         return final_result
+
+    def read_measures(self, measure_types, degree=2):
+        # Validate every command before any probe is queried
+        commands = [[rm_command(probe, measure_type, degree) for measure_type in measure_types]
+                    for probe in self.probes]
+
+        def read_probe(args):
+            probe, rms = args
+            results = self.send_commands(probe['Port'], rms)
+            response = self.parse_reply(probe, 'RM ' + ','.join(measure_types), combine_measurements,
+                                        probe, measure_types, results, rms)
+            self.observe_settings(probe, response)
+            return response
+
+        return self.map_probes(read_probe, list(zip(self.probes, commands)))
+
+    def measure_averaged(self, quantities, n=10, target_stderr=None, min_count=3, degree=2):
+        # Average up to n M + RM cycles with running statistics, stopping
+        # early once the standard error of every quantity is within
+        # target_stderr (one value, or a dict per quantity)
+        from .averaging import measure_averaged
+        return measure_averaged(self, quantities, n, target_stderr, min_count, degree)
+
+    def stream(self, quantities, count=None, capacity=1024, degree=2, store=None):
+        # Generator of (timestamp, values) for repeated M + RM cycles; values
+        # is an (n_probes, n_values) view into a bounded ring buffer. Samples
+        # are also appended to store (a CaptureStore or a new capture's path)
+        from .acquisition import Acquisition
+        return Acquisition(self, quantities, capacity, degree, store).samples(count)
+
+    def start_acquisition(self, quantities, capacity=1024, degree=2, store=None):
+        # Same cycle on a background thread; pull samples with latest(n) and
+        # end it with stop() or a with block
+        from .acquisition import Acquisition
+        return Acquisition(self, quantities, capacity, degree, store).start()
+
+    def run_plan(self, plan, on_result=None, on_step=None):
+        # Run a MeasurementPlan with work overlapped across probes and return
+        # the records of every step
+        from .scheduler import PlanScheduler
+        return PlanScheduler(self, plan, on_result, on_step).run()
+
+    def start_plan(self, plan, on_result=None, on_step=None):
+        # Same, in the background; results arrive through the scheduler's
+        # futures and callbacks
+        from .scheduler import PlanScheduler
+        return PlanScheduler(self, plan, on_result, on_step).start()
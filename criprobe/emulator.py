@@ -0,0 +1,250 @@
+import argparse
+import os
+import random
+import select
+import shutil
+import tempfile
+import threading
+import time
+import tty
+import numpy as np
+
+# Readings returned by RM when no value is configured, in the meter's own
+# reply format
+DEFAULT_READINGS = {'xy': '0.3127,0.3290',
+                    'uv': '0.1978,0.4683',
+                    'Y': '1.000e+02',
+                    'XYZ': '9.505e+01,1.000e+02,1.089e+02',
+                    'xy10': '0.3138,0.3310',
+                    'Y10': '1.000e+02',
+                    'XYZ10': '9.481e+01,1.000e+02,1.073e+02',
+                    'CCT': '6504,0.0032',
+                    'Radiometric': '0,3.209e-01,8.835e+17',
+                    'SyncFreq': '0.00 Hz',
+                    'RangeMode': 'Auto',
+                    'Mode': 'Colorimeter',
+                    'Time': 'NA'}
+
+# Setup reported by RS and changed by SM. Exposure, RangeMode and SyncFreq
+# are kept with the readings RM reports
+DEFAULT_SETTINGS = {'Speed': 'Normal',
+                    'ExposureMode': 'Auto',
+                    'Range': '0',
+                    'SyncMode': 'None',
+                    'Aperture': '1 deg',
+                    'Accessory': 'None'}
+
+INSTRUMENT_TYPES = {'Photometer': 0, 'Colorimeter': 1, 'Spectroradiometer': 2}
+
+# Error codes sent as ER:<code>:<command>:<message>
+ERROR_INVALID_COMMAND = 1
+ERROR_NOT_SUPPORTED = 2
+ERROR_INVALID_PARAMETER = 3
+ERROR_MEASUREMENT = 20
+
+
+def default_spectrum(start=380.0, stop=780.0, step=2.0):
+    # A smooth, daylight-like spectral radiance for the Spectrum reply
+    wavelength = np.arange(start, stop + step / 2, step)
+    return wavelength, 1e-3 * np.exp(-0.5 * ((wavelength - 560.0) / 120.0) ** 2)
+
+
+class CriEmulator:
+    # Emulates one CRI meter on a pseudo-terminal. The slave side is exposed
+    # through a symlink whose name carries the probe ID, so CriProbe detects
+    # it like a real USB meter once its path is listed in CRIPROBE_PORTS
+    def __init__(self, probe_id='A00001', model='CR-250', instrument_type='Spectroradiometer',
+                 integration_time=0.1, jitter=0.0, error_rate=0.0, drop_rate=0.0, readings=None,
+                 spectrum=None, directory=None, seed=None):
+        self.probe_id = probe_id
+        self.model = model
+        self.instrument_type = instrument_type
+        self.integration_time = integration_time
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.readings = dict(DEFAULT_READINGS, **(readings or {}))
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.spectrum = default_spectrum() if spectrum is None else spectrum
+        self.directory = directory
+        self.random = random.Random(seed)
+        self.master = None
+        self.slave = None
+        self.device = None
+        self.own_directory = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.commands = []
+        self.pending_errors = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='criprobe-')
+            self.own_directory = True
+        # Real meters enumerate as e.g. /dev/cu.usbmodemA004891
+        self.device = os.path.join(self.directory, 'cu.usbmodem%s1' % self.probe_id)
+        os.symlink(os.ttyname(self.slave), self.device)
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.serve, name='criprobe-emulator-%s' % self.probe_id,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.device is not None and os.path.lexists(self.device):
+            os.remove(self.device)
+        if self.own_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+            self.own_directory = False
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def inject_error(self, code=ERROR_MEASUREMENT, message='Measurement failed'):
+        # The next command is answered with this error instead of its reply
+        self.pending_errors.append((code, message))
+
+    def serve(self):
+        buf = bytearray()
+        while not self.stop_event.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                buf += os.read(self.master, 4096)
+            except OSError:
+                return
+            while True:
+                end = buf.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buf[:end]).strip()
+                del buf[:end + 1]
+                if line:
+                    self.handle(line.decode('utf-8', 'replace'))
+
+    def handle(self, cmd):
+        self.commands.append(cmd)
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            # Emulate a hung meter: no reply at all
+            return
+        if self.pending_errors:
+            code, message = self.pending_errors.pop(0)
+            return self.reply('ER:%d:%s:%s' % (code, cmd, message))
+        if cmd == 'M':
+            delay = self.integration_time + self.random.uniform(-self.jitter, self.jitter)
+            time.sleep(max(delay, 0.0))
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.reply('ER:%d:M:Measurement failed' % ERROR_MEASUREMENT)
+            return self.reply('OK:0:M:No errors')
+        verb, _, argument = cmd.partition(' ')
+        if verb == 'RC':
+            return self.reply(self.report_configuration(cmd, argument))
+        if verb == 'RM':
+            return self.reply(self.report_measurement(cmd, argument))
+        if verb == 'RS':
+            return self.reply(self.report_setup(cmd, argument))
+        if verb == 'SM':
+            return self.reply(self.set_setup(cmd, argument))
+        return self.reply('ER:%d:%s:Invalid command' % (ERROR_INVALID_COMMAND, cmd))
+
+    def report_configuration(self, cmd, argument):
+        values = {'ID': self.probe_id,
+                  'Model': self.model,
+                  'InstrumentType': INSTRUMENT_TYPES.get(self.instrument_type, 1)}
+        if argument not in values:
+            return 'ER:%d:%s:Invalid command' % (ERROR_INVALID_COMMAND, cmd)
+        return 'OK:0:%s:%s' % (cmd, values[argument])
+
+    def report_measurement(self, cmd, argument):
+        if argument == 'Spectrum':
+            if self.instrument_type != 'Spectroradiometer':
+                return 'ER:%d:%s:Not supported' % (ERROR_NOT_SUPPORTED, cmd)
+            wavelength, values = self.spectrum
+            step = wavelength[1] - wavelength[0] if len(wavelength) > 1 else 0.0
+            header = 'OK:0:%s:%.1f,%.1f,%.1f,%d' % (cmd, wavelength[0], wavelength[-1], step, len(values))
+            return '\r\n'.join([header] + ['%.3e' % value for value in values])
+        if argument == 'Exposure':
+            return 'OK:0:%s:%.3f msec' % (cmd, self.integration_time * 1000)
+        if argument not in self.readings:
+            return 'ER:%d:%s:Invalid command' % (ERROR_INVALID_COMMAND, cmd)
+        return 'OK:0:%s:%s' % (cmd, self.readings[argument])
+
+    def report_setup(self, cmd, argument):
+        if argument == 'Exposure':
+            return 'OK:0:%s:%.3f msec' % (cmd, self.integration_time * 1000)
+        if argument in ('RangeMode', 'SyncFreq'):
+            return 'OK:0:%s:%s' % (cmd, self.readings[argument])
+        if argument not in self.settings:
+            return 'ER:%d:%s:Invalid command' % (ERROR_INVALID_COMMAND, cmd)
+        return 'OK:0:%s:%s' % (cmd, self.settings[argument])
+
+    def set_setup(self, cmd, argument):
+        name, _, value = argument.partition(' ')
+        if not value or (name not in self.settings and name not in ('Exposure', 'RangeMode', 'SyncFreq')):
+            return 'ER:%d:%s:Invalid command' % (ERROR_INVALID_COMMAND, cmd)
+        try:
+            if name == 'Exposure':
+                self.integration_time = float(value) / 1000
+            elif name == 'SyncFreq':
+                self.readings[name] = '%.2f Hz' % float(value)
+        except ValueError:
+            return 'ER:%d:%s:Invalid parameter' % (ERROR_INVALID_PARAMETER, cmd)
+        if name == 'RangeMode':
+            self.readings[name] = value
+        elif name in self.settings:
+            self.settings[name] = value
+        return 'OK:0:%s:No errors' % cmd
+
+    def reply(self, text):
+        data = memoryview(text.encode() + b'\r\n')
+        while data:
+            try:
+                written = os.write(self.master, data)
+            except OSError:
+                return
+            data = data[written:]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Emulate CRI meters on pseudo-terminals')
+    parser.add_argument('-n', '--count', type=int, default=1, help='number of meters')
+    parser.add_argument('--model', default='CR-250')
+    parser.add_argument('--type', default='Spectroradiometer', choices=sorted(INSTRUMENT_TYPES))
+    parser.add_argument('--integration-time', type=float, default=0.1, help='seconds per M')
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds of integration jitter')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    emulators = [CriEmulator('A%05d' % (n + 1), args.model, args.type, args.integration_time, args.jitter,
+                             args.error_rate, args.drop_rate).start()
+                 for n in range(args.count)]
+    print('export CRIPROBE_PORTS=%s' % os.pathsep.join(emulator.device for emulator in emulators), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
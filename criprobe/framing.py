@@ -0,0 +1,136 @@
+import threading
+from .codec import ProbeTimeoutError, ProtocolError, decode_spectrum_header
+
+# Compact the receive buffer once this many consumed bytes sit at its front
+COMPACT_SIZE = 1 << 16
+
+
+class ReplyReader:
+    # Receive buffer for one port. Everything the port has waiting is read in
+    # one call and complete replies are cut out of the buffer, so a spectrum
+    # costs a handful of reads instead of a Python call per byte. A reply is
+    # one line, except RM Spectrum, whose header says how many sample lines
+    # follow
+    def __init__(self, port):
+        self.port = port
+        self.buffer = bytearray()
+        # Start of the unconsumed data and how far it has been scanned
+        self.start = 0
+        self.scanned = 0
+        # Set after a timeout: stray bytes are dropped before the next
+        # command and late replies to earlier commands are skipped
+        self.stale = False
+        # Commands that timed out before any of their reply arrived, by
+        # command. That many late replies echoing the same command are
+        # skipped, so a late OK:0:M is not taken for the next M's reply
+        self.unanswered = {}
+        self.bytes_read = 0
+        # Held for a whole command and reply exchange, so threads or pooled
+        # CriProbe instances sharing the port never read each other's replies
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.buffer) - self.start
+
+    def fill(self):
+        # Append whatever the port has waiting, blocking for at most its
+        # timeout; False when nothing arrived
+        chunk = self.port.read(max(self.port.in_waiting, 1))
+        if not chunk:
+            return False
+        if self.start >= COMPACT_SIZE or self.start == len(self.buffer):
+            del self.buffer[:self.start]
+            self.scanned -= self.start
+            self.start = 0
+        self.buffer += chunk
+        self.bytes_read += len(chunk)
+        return True
+
+    def find_line(self, offset):
+        # Offset, from the start of the unconsumed data, just past the next
+        # newline at or after offset, reading more from the port as needed;
+        # None on timeout. Offsets stay valid when fill() compacts the buffer
+        while True:
+            end = self.buffer.find(b'\n', max(self.start + offset, self.scanned))
+            if end >= 0:
+                return end + 1 - self.start
+            self.scanned = len(self.buffer)
+            if not self.fill():
+                return None
+
+    def take(self, end):
+        # Copy one reply out of the buffer and consume it
+        with memoryview(self.buffer) as view:
+            reply = bytes(view[self.start:self.start + end])
+        self.start = self.scanned = self.start + end
+        return reply
+
+    def frame_lines(self, end):
+        # Number of sample lines that follow the reply header ending at end
+        if not self.buffer.startswith(b'OK:', self.start):
+            return 0
+        with memoryview(self.buffer) as view:
+            header = bytes(view[self.start:self.start + end])
+        if header.split(b':', 3)[2:3] != [b'RM Spectrum']:
+            return 0
+        try:
+            return decode_spectrum_header(header)[3]
+        except ProtocolError:
+            return 0
+
+    def read_reply(self, cmd):
+        # Return the next complete reply to cmd; ProbeTimeoutError if it does
+        # not arrive within the port's timeout
+        while True:
+            end = self.find_line(0)
+            if end is None:
+                self.timed_out(cmd)
+                raise ProbeTimeoutError('No reply to %s within %.1f s' % (cmd, self.port.timeout))
+            for _ in range(self.frame_lines(end)):
+                end = self.find_line(end)
+                if end is None:
+                    self.stale = True
+                    raise ProbeTimeoutError('Timed out reading from probe')
+            reply = self.take(end)
+            if self.stale and (not self.matches(reply, cmd) or self.unanswered.get(cmd)):
+                # Stray bytes or a late reply to a command that timed out
+                self.answered(reply)
+                continue
+            # Replies come back in order, so a command still unanswered by
+            # now was lost; this is also how a lost reply stops costing the
+            # next command of its kind
+            self.stale = False
+            self.unanswered.clear()
+            return reply
+
+    def timed_out(self, cmd):
+        # When nothing of the reply has arrived yet it may still turn up late
+        if not len(self):
+            self.unanswered[cmd] = self.unanswered.get(cmd, 0) + 1
+        self.stale = True
+
+    def answered(self, reply):
+        # Account for a dropped late reply
+        fields = reply.split(b':', 3)
+        if len(fields) == 4 and fields[0] in (b'OK', b'ER'):
+            cmd = fields[2].decode(errors='replace')
+            if self.unanswered.get(cmd):
+                self.unanswered[cmd] -= 1
+
+    def matches(self, reply, cmd):
+        fields = reply.split(b':', 3)
+        return len(fields) == 4 and fields[0] in (b'OK', b'ER') and fields[2] == cmd.encode()
+
+    def discard(self):
+        # Drop buffered and pending input, e.g. before a command that follows
+        # a timeout
+        pending = self.buffer[self.start:]
+        del self.buffer[:]
+        self.start = self.scanned = 0
+        while self.port.in_waiting:
+            chunk = self.port.read(self.port.in_waiting)
+            if not chunk:
+                break
+            pending += chunk
+        for line in pending.split(b'\n')[:-1]:
+            self.answered(bytes(line))
@@ -0,0 +1,116 @@
+import bisect
+import collections
+import threading
+
+# Upper bounds of the latency histogram buckets in seconds, log spaced from
+# 10 us to 100 s; a final bucket catches anything slower
+BUCKETS = tuple(10.0 ** (-5 + 7 * n / 28) for n in range(29))
+
+# One observation passed to callbacks. latency is None for events that only
+# carry parse time or extra bytes read
+CommandEvent = collections.namedtuple('CommandEvent', ['probe', 'verb', 'latency', 'bytes_written', 'bytes_read',
+                                                       'timed_out', 'parse_time'])
+
+
+def command_verb(cmd):
+    # Group commands by verb, keeping the quantity for RM: 'RC', 'M', 'RM xy'
+    if cmd.startswith('RM '):
+        return cmd
+    return cmd.split(' ', 1)[0]
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th percentile
+        if not self.count:
+            return float('nan')
+        rank = q / 100 * self.count
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[n], self.max) if n < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else float('nan'),
+                'min': self.min if self.count else float('nan'),
+                'max': self.max if self.count else float('nan'),
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+class CommandStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.parse_time = Histogram()
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.timeouts = 0
+
+    def summary(self):
+        return {'latency': self.latency.summary(),
+                'parse_time': self.parse_time.summary(),
+                'bytes_written': self.bytes_written,
+                'bytes_read': self.bytes_read,
+                'timeouts': self.timeouts}
+
+
+class Instrumentation:
+    # Per probe and per verb command statistics. CriProbe only calls record()
+    # when instrumentation is enabled, so the disabled cost is one None check
+    def __init__(self, callback=None):
+        self.stats = {}
+        self.callbacks = [] if callback is None else [callback]
+        self.lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def record(self, probe, verb, latency=None, bytes_written=0, bytes_read=0, timed_out=False, parse_time=None):
+        with self.lock:
+            stats = self.stats.get((probe, verb))
+            if stats is None:
+                stats = self.stats[(probe, verb)] = CommandStats()
+            if latency is not None:
+                stats.latency.observe(latency)
+            if parse_time is not None:
+                stats.parse_time.observe(parse_time)
+            stats.bytes_written += bytes_written
+            stats.bytes_read += bytes_read
+            stats.timeouts += bool(timed_out)
+        if self.callbacks:
+            event = CommandEvent(probe, verb, latency, bytes_written, bytes_read, timed_out, parse_time)
+            for callback in self.callbacks:
+                callback(event)
+
+    def snapshot(self):
+        # Nested {probe: {verb: summary}} dict, e.g. for a metrics exporter
+        with self.lock:
+            result = {}
+            for (probe, verb), stats in self.stats.items():
+                result.setdefault(probe, {})[verb] = stats.summary()
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
@@ -0,0 +1,10 @@
+import getpass
+import os
+import tempfile
+
+# Default locations shared by the command line front end and the broker,
+# kept apart so finding them loads nothing else
+
+# Unix socket of the broker (python -m criprobe.broker)
+DEFAULT_SOCKET_PATH = os.environ.get('CRIPROBE_SOCKET') or os.path.join(
+    tempfile.gettempdir(), 'criprobe-%s.sock' % getpass.getuser())
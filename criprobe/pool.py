@@ -0,0 +1,116 @@
+import atexit
+import os
+import threading
+from .framing import ReplyReader
+
+
+class Session:
+    # An open, identified port shared by every CriProbe that uses the device,
+    # with the one reply reader they all exchange commands through
+    def __init__(self, device):
+        self.device = device
+        self.info = None
+        self.reader = None
+        self.users = 0
+        self.lock = threading.Lock()
+
+
+class SessionPool:
+    # Process-wide registry of open ports keyed by device path. Ports stay
+    # open and identified after their CriProbe is closed, so the next
+    # instance gets them without reopening or re-running detection
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(session.info is not None for session in self.sessions.values())
+
+    def acquire(self, device, factory):
+        # Return a copy of the probe info for device, calling factory() to
+        # open and identify it only when there is no usable session yet
+        with self.lock:
+            session = self.sessions.get(device)
+            if session is None:
+                session = self.sessions[device] = Session(device)
+        with session.lock:
+            if session.info is not None and not self.healthy(session):
+                self.close_session(session)
+            if session.info is None:
+                session.info = factory()
+            session.users += 1
+            return dict(session.info)
+
+    def reader(self, port):
+        # The ReplyReader shared by every user of a pooled port, or None for
+        # a port the pool does not hold
+        session = self.find(port)
+        if session is None:
+            return None
+        with session.lock:
+            if session.reader is None:
+                session.reader = ReplyReader(port)
+            return session.reader
+
+    def release(self, port):
+        # The CriProbe using port is done with it; the port stays open
+        session = self.find(port)
+        if session is not None:
+            with session.lock:
+                session.users = max(session.users - 1, 0)
+
+    def discard(self, port):
+        # Close and forget a port, e.g. after its meter was unplugged
+        session = self.find(port)
+        if session is not None:
+            with session.lock:
+                self.close_session(session)
+
+    def prune(self, devices):
+        # Reclaim idle sessions whose device is no longer attached
+        devices = set(devices)
+        for session in list(self.sessions.values()):
+            if session.device not in devices:
+                with session.lock:
+                    if session.users == 0:
+                        self.close_session(session)
+
+    def close_all(self):
+        for session in list(self.sessions.values()):
+            with session.lock:
+                self.close_session(session)
+
+    def find(self, port):
+        for session in list(self.sessions.values()):
+            if session.info is not None and session.info['Port'] is port:
+                return session
+        return None
+
+    def healthy(self, session):
+        port = session.info['Port']
+        if not getattr(port, 'is_open', True):
+            return False
+        # Device nodes disappear when a USB meter is unplugged
+        if session.device.startswith(os.sep) and not os.path.exists(session.device):
+            return False
+        return True
+
+    def close_session(self, session):
+        if session.info is not None:
+            close = getattr(session.info['Port'], 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except OSError:
+                    pass
+        session.info = None
+        session.reader = None
+        session.users = 0
+        with self.lock:
+            if self.sessions.get(session.device) is session:
+                del self.sessions[session.device]
+
+
+# Shared by every CriProbe created with pool=True
+default_pool = SessionPool()
+atexit.register(default_pool.close_all)
@@ -0,0 +1,145 @@
+import numpy as np
+
+# One row per (probe, quantity) reading. Numeric values live in a single flat
+# float64 array and each row points at its slice, so quantities of any width
+# (Y, xy, Radiometric, Spectrum) share one columnar layout
+RECORD_DTYPE = np.dtype([('probe_id', 'S8'),
+                         ('quantity', 'S16'),
+                         ('unit', 'S8'),
+                         ('timestamp', 'f8'),
+                         ('offset', 'i8'),
+                         ('size', 'i4'),
+                         ('text', 'S16')])
+
+# Keys of a read_measure() or measure_averaged() record that are not quantities.
+# The wavelength grid of a spectrum is kept once per batch instead
+RECORD_KEYS = ('Probe ID', 'Unit', 'Units', 'Count', 'Std', 'Stderr', 'Min', 'Max', 'Wavelength')
+
+
+def same_wavelength(wavelength, other):
+    # Spectra in one batch must share a grid, as they share one wavelength
+    if wavelength is not None and not np.array_equal(wavelength, other):
+        raise ValueError('Spectra in a batch must share one wavelength grid')
+    return other if wavelength is None else wavelength
+
+
+class Measurement:
+    # A single reading; slots keep per-instance memory to a minimum
+    __slots__ = ('probe_id', 'quantity', 'value', 'unit', 'timestamp')
+
+    def __init__(self, probe_id, quantity, value, unit='', timestamp=np.nan):
+        self.probe_id = probe_id
+        self.quantity = quantity
+        self.value = value
+        self.unit = unit
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return 'Measurement(%r, %r, %r, unit=%r, timestamp=%r)' % (
+            self.probe_id, self.quantity, self.value, self.unit, self.timestamp)
+
+    def __eq__(self, other):
+        if not isinstance(other, Measurement):
+            return NotImplemented
+        return (self.probe_id == other.probe_id and self.quantity == other.quantity and
+                self.unit == other.unit and np.array_equal(self.value, other.value) and
+                np.array_equal(self.timestamp, other.timestamp, equal_nan=True))
+
+
+class MeasurementBatch:
+    # Columnar container for many readings: a structured array of row
+    # metadata plus the flat values array the rows index into. wavelength is
+    # the grid shared by every Spectrum reading, if there are any
+    def __init__(self, records=None, values=None, wavelength=None):
+        self.records = np.empty(0, dtype=RECORD_DTYPE) if records is None else records
+        self.values = np.empty(0, dtype=np.float64) if values is None else values
+        self.wavelength = wavelength
+
+    @classmethod
+    def from_measurements(cls, measurements):
+        measurements = list(measurements)
+        records = np.zeros(len(measurements), dtype=RECORD_DTYPE)
+        sizes = [0 if isinstance(m.value, str) else np.size(m.value) for m in measurements]
+        values = np.empty(sum(sizes), dtype=np.float64)
+        offset = 0
+        for n, (m, size) in enumerate(zip(measurements, sizes)):
+            records[n] = (m.probe_id, m.quantity, m.unit or '', m.timestamp, offset, size,
+                          m.value if size == 0 else '')
+            values[offset:offset + size] = np.ravel(m.value)
+            offset += size
+        return cls(records, values)
+
+    @classmethod
+    def from_records(cls, results, timestamp=np.nan):
+        # Convert read_measure() output, single or batched, into a batch
+        measurements = []
+        wavelength = None
+        for result in results:
+            if 'Wavelength' in result:
+                wavelength = same_wavelength(wavelength, result['Wavelength'])
+            units = result.get('Units') or {}
+            for quantity, value in result.items():
+                if quantity in RECORD_KEYS:
+                    continue
+                unit = units.get(quantity, '') if 'Units' in result else result.get('Unit', '')
+                measurements.append(Measurement(result['Probe ID'], quantity, value, unit, timestamp))
+        batch = cls.from_measurements(measurements)
+        batch.wavelength = wavelength
+        return batch
+
+    @classmethod
+    def concatenate(cls, batches):
+        # Joining batches only shifts the value offsets of the later ones
+        batches = list(batches)
+        if not batches:
+            return cls()
+        shifts = np.cumsum([0] + [len(batch.values) for batch in batches[:-1]])
+        records = np.concatenate([batch.records for batch in batches])
+        records['offset'] += np.repeat(shifts, [len(batch) for batch in batches])
+        wavelength = None
+        for batch in batches:
+            if batch.wavelength is not None:
+                wavelength = same_wavelength(wavelength, batch.wavelength)
+        return cls(records, np.concatenate([batch.values for batch in batches]), wavelength)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.measurement(index)
+        # Slices and masks keep sharing the values array
+        return MeasurementBatch(self.records[index], self.values, self.wavelength)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self.measurement(n)
+
+    def measurement(self, n):
+        record = self.records[n]
+        if record['size'] == 0:
+            value = record['text'].decode()
+        elif record['size'] == 1:
+            value = float(self.values[record['offset']])
+        else:
+            value = self.values[record['offset']:record['offset'] + record['size']]
+        return Measurement(record['probe_id'].decode(), record['quantity'].decode(), value,
+                           record['unit'].decode(), float(record['timestamp']))
+
+    def select(self, quantity=None, probe_id=None):
+        mask = np.ones(len(self), dtype=bool)
+        if quantity is not None:
+            mask &= self.records['quantity'] == quantity.encode()
+        if probe_id is not None:
+            mask &= self.records['probe_id'] == probe_id.encode()
+        return self[mask]
+
+    def array(self, quantity):
+        # Stack every reading of one quantity into an (n, width) array
+        batch = self.select(quantity)
+        sizes = np.unique(batch.records['size'])
+        if len(sizes) > 1:
+            raise ValueError('%s readings do not all have the same size' % quantity)
+        width = int(sizes[0]) if len(sizes) else 0
+        index = batch.records['offset'][:, np.newaxis] + np.arange(width)
+        return self.values[index]
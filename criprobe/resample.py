@@ -0,0 +1,128 @@
+import numpy as np
+from .codec import wavelength_axis
+
+# Spectra moved from the grid in the RM Spectrum header (380-780 nm in 2 nm
+# steps on a CR-250) to another wavelength grid. Each pair of grids gets one
+# weight matrix, built once and cached, so a whole stack of spectra is
+# resampled with a single matrix multiply:
+#
+#   resample(spectra, wavelength, grid(400, 700, 5), method='bin')
+
+METHODS = ('interpolate', 'bin')
+
+# Weight matrices by (method, source grid, target grid)
+MATRICES = {}
+
+
+def grid(start, stop, step):
+    # Wavelength grid from start to stop inclusive, e.g. grid(400, 700, 1)
+    count = int(round((stop - start) / step)) + 1
+    if count < 1:
+        raise ValueError('Empty wavelength grid')
+    return wavelength_axis(float(start), float(step), count)
+
+
+def check_grids(source, target):
+    if len(source) < 2 or np.any(np.diff(source) <= 0):
+        raise ValueError('Spectrum wavelengths must be increasing')
+    if len(target) > 1 and np.any(np.diff(target) <= 0):
+        raise ValueError('Target wavelengths must be increasing')
+    # Allow for rounding in grids built from headers
+    tolerance = 1e-6 * (source[-1] - source[0])
+    if target[0] < source[0] - tolerance or target[-1] > source[-1] + tolerance:
+        raise ValueError('Target grid %g-%g nm is outside the spectrum (%g-%g nm)' %
+                         (target[0], target[-1], source[0], source[-1]))
+
+
+def segments(source, wavelength):
+    # Index of the source interval holding each wavelength and the offset
+    # into it
+    wavelength = np.clip(wavelength, source[0], source[-1])
+    index = np.clip(np.searchsorted(source, wavelength, side='right') - 1, 0, len(source) - 2)
+    return index, wavelength - source[index]
+
+
+def interpolation_matrix(source, target):
+    # (n_source, n_target) linear interpolation weights: each target sample
+    # mixes the two source samples around it
+    index, offset = segments(source, target)
+    fraction = offset / np.diff(source)[index]
+    matrix = np.zeros((len(source), len(target)))
+    columns = np.arange(len(target))
+    matrix[index, columns] = 1 - fraction
+    matrix[index + 1, columns] += fraction
+    return matrix
+
+
+def integral_weights(source, wavelength):
+    # (len(wavelength), n_source) weights giving the integral of the linearly
+    # interpolated spectrum from source[0] to each wavelength
+    width = np.diff(source)
+    # Trapezoid weights of each whole interval, accumulated
+    steps = np.zeros((len(source) - 1, len(source)))
+    rows = np.arange(len(width))
+    steps[rows, rows] = steps[rows, rows + 1] = width / 2
+    cumulative = np.vstack([np.zeros(len(source)), np.cumsum(steps, axis=0)])
+
+    index, offset = segments(source, wavelength)
+    rows = np.arange(len(wavelength))
+    partial = offset ** 2 / (2 * width[index])
+    weights = cumulative[index]
+    weights[rows, index] += offset - partial
+    weights[rows, index + 1] += partial
+    return weights
+
+
+def binning_matrix(source, target):
+    # (n_source, n_target) weights averaging the spectrum over each target
+    # sample's band: from halfway to the previous sample to halfway to the
+    # next, clipped to the measured range. Band integrals are preserved
+    if len(target) > 1:
+        edges = np.concatenate([[1.5 * target[0] - 0.5 * target[1]], (target[1:] + target[:-1]) / 2,
+                                [1.5 * target[-1] - 0.5 * target[-2]]])
+    else:
+        edges = np.array([source[0], source[-1]])
+    edges = np.clip(edges, source[0], source[-1])
+    integrals = integral_weights(source, edges)
+    return ((integrals[1:] - integrals[:-1]) / np.diff(edges)[:, None]).T
+
+
+def resampling_matrix(wavelength, target, method='interpolate'):
+    # Cached, read-only (n_source, n_target) matrix for a pair of grids
+    if method not in METHODS:
+        raise ValueError('Unknown resampling method %r' % method)
+    source = np.asarray(wavelength, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    key = (method, source.tobytes(), target.tobytes())
+    matrix = MATRICES.get(key)
+    if matrix is None:
+        check_grids(source, target)
+        build = interpolation_matrix if method == 'interpolate' else binning_matrix
+        matrix = build(source, target)
+        matrix.flags.writeable = False
+        MATRICES[key] = matrix
+    return matrix
+
+
+def resample(spectra, wavelength, target, method='interpolate', out=None):
+    # Spectra of shape (..., n_source) on the wavelength grid, resampled to
+    # target: 'interpolate' samples the spectrum at each target wavelength,
+    # 'bin' averages it over each target sample's band
+    matrix = resampling_matrix(wavelength, target, method)
+    return np.matmul(np.asarray(spectra, dtype=np.float64), matrix, out=out)
+
+
+def resample_records(records, target, method='interpolate'):
+    # read_measure('Spectrum') records with their spectra moved to target.
+    # Probes sharing a grid are stacked and resampled together
+    target = np.asarray(target, dtype=np.float64)
+    groups = {}
+    for n, record in enumerate(records):
+        wavelength = record['Wavelength']
+        groups.setdefault(np.asarray(wavelength, dtype=np.float64).tobytes(), (wavelength, []))[1].append(n)
+    results = [dict(record, Wavelength=target) for record in records]
+    for wavelength, members in groups.values():
+        spectra = resample([records[n]['Spectrum'] for n in members], wavelength, target, method)
+        for n, spectrum in zip(members, spectra):
+            results[n]['Spectrum'] = spectrum
+    return results
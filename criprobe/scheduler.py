@@ -0,0 +1,165 @@
+import threading
+from concurrent.futures import Future
+
+from .codec import decode_measure
+from .cri import rm_command, combine_measurements
+
+
+class MeasurementStep:
+    # One step of a plan: an optional setup callable (e.g. set the pattern
+    # generator), then M and the listed RM quantities on every probe
+    def __init__(self, quantities, setup=None, degree=2, name=None):
+        self.quantities = list(quantities)
+        self.setup = setup
+        self.degree = degree
+        self.name = name
+
+
+class MeasurementPlan:
+    def __init__(self, steps=None):
+        self.steps = list(steps or [])
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def add(self, quantities, setup=None, degree=2, name=None):
+        self.steps.append(MeasurementStep(quantities, setup, degree, name))
+        return self
+
+
+class PlanScheduler:
+    # Runs a plan with one worker per probe. A step's setup runs as soon as
+    # every probe has finished integrating the previous step, so probes read
+    # out step k while the pattern for step k + 1 is set and faster probes
+    # already integrate it. Per-probe results resolve futures[k][n] and
+    # step_futures[k] resolves to the list of records once all probes are done
+    def __init__(self, cri_probe, plan, on_result=None, on_step=None):
+        self.cri_probe = cri_probe
+        self.plan = plan if isinstance(plan, MeasurementPlan) else MeasurementPlan(plan)
+        self.on_result = on_result
+        self.on_step = on_step
+        probes = cri_probe.probes
+        self.commands = [[[rm_command(probe, quantity, step.degree) for quantity in step.quantities]
+                          for probe in probes] for step in self.plan]
+        self.futures = [[Future() for _ in probes] for _ in self.plan]
+        self.step_futures = [Future() for _ in self.plan]
+        self.condition = threading.Condition()
+        self.ready = 0
+        self.integrated = [0] * len(self.plan)
+        self.remaining = [len(probes)] * len(self.plan)
+        self.error = None
+        self.threads = []
+
+    def start(self):
+        probes = self.cri_probe.probes
+        self.threads = [threading.Thread(target=self.coordinate, name='criprobe-plan', daemon=True)]
+        self.threads += [threading.Thread(target=self.run_probe, args=(n,), name='criprobe-plan-%s' % probe['ID'],
+                                          daemon=True) for n, probe in enumerate(probes)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def join(self):
+        # Wait for the plan to finish and raise whatever failed it, including
+        # an on_step error on the last step, whose records are already set
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        # Run the whole plan and return the records of every step
+        self.start()
+        self.join()
+        return [future.result() for future in self.step_futures]
+
+    def cancel(self):
+        self.fail(RuntimeError('Measurement plan cancelled'))
+
+    def coordinate(self):
+        n_probes = len(self.cri_probe.probes)
+        for k, step in enumerate(self.plan):
+            with self.condition:
+                # The previous step's pattern must stay up until every probe
+                # has integrated it
+                self.condition.wait_for(lambda: self.error is not None or k == 0 or
+                                        self.integrated[k - 1] == n_probes)
+                if self.error is not None:
+                    return
+            if step.setup is not None:
+                try:
+                    step.setup()
+                except Exception as err:
+                    self.fail(err)
+                    return
+            with self.condition:
+                self.ready = k + 1
+                self.condition.notify_all()
+            if not n_probes:
+                self.finish_step(k)
+
+    def run_probe(self, n):
+        probe = self.cri_probe.probes[n]
+        for k, step in enumerate(self.plan):
+            with self.condition:
+                self.condition.wait_for(lambda: self.error is not None or self.ready > k)
+                if self.error is not None:
+                    return
+            if not self.futures[k][n].set_running_or_notify_cancel():
+                return
+            try:
+                decode_measure(self.cri_probe.send_command(probe['Port'], 'M'))
+                with self.condition:
+                    self.integrated[k] += 1
+                    self.condition.notify_all()
+                results = self.cri_probe.send_commands(probe['Port'], self.commands[k][n])
+                record = combine_measurements(probe, step.quantities, results, self.commands[k][n])
+                self.cri_probe.observe_settings(probe, record)
+            except Exception as err:
+                self.futures[k][n].set_exception(err)
+                self.fail(err)
+                return
+
+            self.futures[k][n].set_result(record)
+            if self.on_result is not None:
+                # A failing callback stops the plan like a failing probe,
+                # rather than leaving the step's future unresolved
+                try:
+                    self.on_result(k, probe['ID'], record)
+                except Exception as err:
+                    self.fail(err)
+                    return
+            with self.condition:
+                self.remaining[k] -= 1
+                done = self.remaining[k] == 0
+            if done:
+                self.finish_step(k)
+
+    def finish_step(self, k):
+        records = [future.result() for future in self.futures[k]]
+        with self.condition:
+            if self.step_futures[k].done():
+                return
+            self.step_futures[k].set_result(records)
+        if self.on_step is not None:
+            try:
+                self.on_step(k, records)
+            except Exception as err:
+                self.fail(err)
+
+    def fail(self, err):
+        # Stop every worker and fail whatever has not completed yet
+        with self.condition:
+            if self.error is None:
+                self.error = err
+            self.condition.notify_all()
+            # Futures already being worked on finish normally
+            for futures in self.futures:
+                for future in futures:
+                    future.cancel()
+            for future in self.step_futures:
+                if not future.done():
+                    future.set_exception(self.error)
@@ -0,0 +1,213 @@
+import json
+import os
+import struct
+import threading
+import numpy as np
+
+from .codec import quantity_decoder
+
+# Capture file layout:
+#   0   8 bytes  magic
+#   8   uint64   committed record count
+#   16  uint64   offset of the first record
+#   24  uint64   length of the JSON schema
+#   32  ...      JSON schema: quantity widths and the wavelength grid
+# followed, at a page-aligned offset, by fixed-size records. A record only
+# counts once the count field covers it, so a crash mid-append leaves at
+# worst some unreferenced bytes at the end of the file
+MAGIC = b'CRICAP01'
+HEADER = struct.Struct('<8sQQQ')
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 8
+ALIGNMENT = 4096
+
+
+def record_dtype(fields):
+    # fields is a list of (quantity, width); scalars get a plain f8 field
+    # and everything else a subarray, so store.records['xy'] is (n, 2)
+    dtype = [('timestamp', '<f8'), ('probe_id', 'S8')]
+    for name, width in fields:
+        dtype.append((name, '<f8') if width == 1 else (name, '<f8', (width,)))
+    return np.dtype(dtype)
+
+
+def quantity_width(quantity, wavelength=None, widths=None):
+    if widths and quantity in widths:
+        return int(widths[quantity])
+    if quantity == 'Spectrum':
+        if wavelength is None:
+            raise ValueError('Storing spectra requires a wavelength grid')
+        return len(wavelength)
+    size = quantity_decoder(quantity).size
+    if size == 0:
+        raise ValueError('Cannot store text quantity %s' % quantity)
+    if size is None:
+        raise ValueError('Width of %s must be given' % quantity)
+    return size
+
+
+class CaptureStore:
+    # Append-only, fixed-schema capture file. Readers get the committed
+    # records as a numpy.memmap, so opening and slicing a multi-GB capture
+    # does not read it into memory. The file stays open unbuffered; every
+    # seek and the read or write after it happen under the lock
+    def __init__(self, path, readonly=False, durable=True):
+        self.path = path
+        self.readonly = readonly
+        self.durable = durable
+        self.lock = threading.Lock()
+        self.mmap = None
+        self.file = open(path, 'rb' if readonly else 'r+b', buffering=0)
+        try:
+            self.read_header()
+            if not readonly:
+                # Drop whatever an interrupted append left past the last
+                # committed record
+                self.file.truncate(self.data_offset + self.count * self.dtype.itemsize)
+        except Exception:
+            self.file.close()
+            raise
+
+    @classmethod
+    def create(cls, path, quantities, wavelength=None, widths=None, durable=True):
+        # Create a new, empty capture; widths override the number of values
+        # stored for quantities the codec has no fixed size for
+        quantities = list(quantities)
+        if wavelength is not None:
+            wavelength = [float(value) for value in wavelength]
+        fields = [(quantity, quantity_width(quantity, wavelength, widths)) for quantity in quantities]
+        schema = json.dumps({'fields': fields, 'wavelength': wavelength}).encode()
+        data_offset = -(-(HEADER.size + len(schema)) // ALIGNMENT) * ALIGNMENT
+        # Exclusive creation, so an existing capture is never overwritten
+        with open(path, 'xb') as f:
+            f.write(HEADER.pack(MAGIC, 0, data_offset, len(schema)) + schema)
+            f.truncate(data_offset)
+            f.flush()
+            if durable:
+                os.fsync(f.fileno())
+        return cls(path, durable=durable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def read_at(self, offset, size):
+        # Up to size bytes from offset; shorter at the end of the file
+        with self.lock:
+            self.file.seek(offset)
+            data = bytearray(size)
+            with memoryview(data) as view:
+                filled = 0
+                while filled < size:
+                    count = self.file.readinto(view[filled:])
+                    if not count:
+                        break
+                    filled += count
+            return bytes(data[:filled])
+
+    def write_at(self, offset, data):
+        # Caller holds the lock
+        self.file.seek(offset)
+        with memoryview(data) as view:
+            view = view.cast('B')
+            while view:
+                view = view[self.file.write(view):]
+
+    def read_header(self):
+        header = self.read_at(0, HEADER.size)
+        if len(header) != HEADER.size:
+            raise ValueError('%s is not a criprobe capture' % self.path)
+        magic, self.count, self.data_offset, schema_size = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError('%s is not a criprobe capture' % self.path)
+        schema = json.loads(self.read_at(HEADER.size, schema_size))
+        self.fields = [(name, width) for name, width in schema['fields']]
+        self.quantities = [name for name, _ in self.fields]
+        self.wavelength = None if schema['wavelength'] is None else np.array(schema['wavelength'])
+        self.dtype = record_dtype(self.fields)
+
+    def refresh(self):
+        # Pick up records committed by another writer since the last look
+        self.count = COUNT.unpack(self.read_at(COUNT_OFFSET, COUNT.size))[0]
+        return self.count
+
+    @property
+    def records(self):
+        # Zero-copy view of the committed records
+        if self.count == 0:
+            return np.empty(0, dtype=self.dtype)
+        if self.mmap is None or len(self.mmap) != self.count:
+            self.mmap = np.memmap(self.path, dtype=self.dtype, mode='r', offset=self.data_offset,
+                                  shape=(self.count,))
+        return self.mmap
+
+    def array(self, quantity, probe_id=None):
+        # All readings of one quantity, optionally for a single probe
+        records = self.records
+        if probe_id is None:
+            return records[quantity]
+        return records[quantity][records['probe_id'] == probe_id.encode()]
+
+    def empty(self, count):
+        # Records to fill in place before append(); quantities not filled in
+        # stay NaN
+        records = np.zeros(count, dtype=self.dtype)
+        for name, _ in self.fields:
+            records[name] = np.nan
+        return records
+
+    def append(self, records):
+        # Write records after the last committed one, then publish them by
+        # updating the count; with durable=True both steps reach the disk in
+        # that order
+        if self.readonly:
+            raise RuntimeError('Capture opened read-only')
+        records = np.ascontiguousarray(records, dtype=self.dtype)
+        with self.lock:
+            self.write_at(self.data_offset + self.count * self.dtype.itemsize, records)
+            if self.durable:
+                os.fsync(self.file.fileno())
+            self.write_at(COUNT_OFFSET, COUNT.pack(self.count + len(records)))
+            if self.durable:
+                os.fsync(self.file.fileno())
+            self.count += len(records)
+        return self.count
+
+    def append_measurements(self, results, timestamp):
+        # Append read_measure() output, one record per probe
+        records = self.empty(len(results))
+        records['timestamp'] = timestamp
+        for n, result in enumerate(results):
+            records['probe_id'][n] = result['Probe ID']
+            for name in self.quantities:
+                value = result.get(name)
+                if value is not None and not isinstance(value, str):
+                    records[name][n] = value
+        return self.append(records)
+
+    def append_row(self, timestamp, probe_ids, row, columns):
+        # Append one acquisition sample: row is (n_probes, n_values) with each
+        # quantity at its slice of columns
+        records = self.empty(len(probe_ids))
+        records['timestamp'] = timestamp
+        records['probe_id'] = probe_ids
+        for name in self.quantities:
+            records[name] = row[:, columns[name]].reshape(records[name].shape)
+        return self.append(records)
+
+    def close(self):
+        self.mmap = None
+        self.file.close()
+
+
+def open_capture(path):
+    # Open a capture for reading
+    return CaptureStore(path, readonly=True)
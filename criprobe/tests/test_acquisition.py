@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+import numpy as np
+import criprobe as cri
+from criprobe.acquisition import RingBuffer
+
+
+class LoopbackSerial:
+    # Answers M and RM commands with fixed replies, one write at a time
+    replies = {b'M': b'OK:0:M:No errors\r\n',
+               b'RM xy': b'OK:0:RM xy:0.3754,0.3773\r\n',
+               b'RM Y': b'OK:0:RM Y:2.239e+00\r\n',
+               b'RM Exposure': b'OK:0:RM Exposure:111.622 msec\r\n',
+               b'RM SyncFreq': b'OK:0:RM SyncFreq:NA\r\n',
+               b'RM RangeMode': b'OK:0:RM RangeMode:Fixed\r\n',
+               b'RS ExposureMode': b'OK:0:RS ExposureMode:Fixed\r\n',
+               b'RM Spectrum': b'OK:0:RM Spectrum:380.0,384.0,2.0,3\r\n2.5e-01\r\n5.0e-01\r\n7.5e-01\r\n'}
+
+    def __init__(self):
+        self.data = bytearray()
+        self.lock = threading.Lock()
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def write(self, data):
+        with self.lock:
+            for cmd in data.split(b'\r\n')[:-1]:
+                self.data += self.replies[cmd]
+        return len(data)
+
+    def read(self, size=1):
+        with self.lock:
+            chunk = bytes(self.data[:size])
+            del self.data[:size]
+        return chunk
+
+    def readline(self):
+        end = self.data.find(b'\n')
+        return self.read(len(self.data) if end < 0 else end + 1)
+
+
+def loopback_probe():
+    p = cri.CriProbe(simulated=True)
+    for probe in p.probes:
+        probe['Port'] = LoopbackSerial()
+    return p
+
+
+class MyTestCase(unittest.TestCase):
+    def test_ring_buffer_latest_is_view(self):
+        buffer = RingBuffer(4, (2,))
+        for n in range(6):
+            buffer.append(float(n), [n, -n])
+
+        timestamps, data = buffer.latest(3)
+        self.assertEqual(timestamps.tolist(), [3.0, 4.0, 5.0])
+        self.assertEqual(data[:, 0].tolist(), [3.0, 4.0, 5.0])
+        self.assertTrue(np.shares_memory(data, buffer.data))
+
+        # Only the last capacity samples are kept
+        timestamps, data = buffer.latest()
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(timestamps.tolist(), [2.0, 3.0, 4.0, 5.0])
+
+    def test_stream(self):
+        p = loopback_probe()
+        samples = [(timestamp, values.copy()) for timestamp, values in p.stream(['xy', 'Y', 'Exposure'], count=5,
+                                                                                capacity=3)]
+        self.assertEqual(len(samples), 5)
+        for timestamp, values in samples:
+            self.assertEqual(values.shape, (2, 4))
+            self.assertEqual(values.tolist(), [[0.3754, 0.3773, 2.239, 111.622]] * 2)
+
+    def test_stream_first_reading_missing(self):
+        p = loopback_probe()
+        for probe in p.probes:
+            probe['Port'].replies = {**LoopbackSerial.replies, b'RM xy': b'OK:0:RM xy:NA\r\n'}
+        samples = p.stream(['xy', 'Y'], count=3)
+        timestamp, values = next(samples)
+        # xy keeps both of its columns
+        self.assertEqual(values.shape, (2, 3))
+        self.assertTrue(np.isnan(values[:, :2]).all())
+        for probe in p.probes:
+            probe['Port'].replies = LoopbackSerial.replies
+        for timestamp, values in samples:
+            self.assertEqual(values.tolist(), [[0.3754, 0.3773, 2.239]] * 2)
+
+    def test_stream_spectrum(self):
+        p = loopback_probe()
+        for timestamp, values in p.stream(['Y', 'Spectrum'], count=2):
+            self.assertEqual(values.tolist(), [[2.239, 0.25, 0.5, 0.75]] * 2)
+
+    def test_background_acquisition(self):
+        p = loopback_probe()
+        with p.start_acquisition(['xy', 'Y'], capacity=16) as acquisition:
+            while acquisition.buffer is None or len(acquisition.buffer) < 16:
+                time.sleep(0.01)
+            timestamps, values = acquisition.latest(10)
+            self.assertEqual(acquisition.columns, {'xy': slice(0, 2), 'Y': slice(2, 3)})
+        self.assertEqual(values.shape, (10, 2, 3))
+        self.assertTrue(np.all(np.diff(timestamps) >= 0))
+        self.assertEqual(values[-1, 0].tolist(), [0.3754, 0.3773, 2.239])
+
+    def test_background_acquisition_error(self):
+        p = loopback_probe()
+        p.probes[0]['Port'].replies = {}
+        acquisition = p.start_acquisition(['Y'])
+        acquisition.thread.join()
+        with self.assertRaises(KeyError):
+            acquisition.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
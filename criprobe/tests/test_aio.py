@@ -0,0 +1,156 @@
+import asyncio
+import os
+import tty
+import unittest
+from unittest.mock import patch
+import serial
+import criprobe as cri
+from criprobe.aio import AsyncSerial
+
+
+class TestPort:
+    device = '/dev/cu.usbmodemA004891'
+    description = 'Colorimetry Research (COMx)'
+
+
+class FakeMeter:
+    # Answers CRI commands on the master side of a pseudo-terminal
+    def __init__(self, replies, delay=0.0):
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.device = os.ttyname(slave)
+        os.close(slave)
+        self.replies = replies
+        self.delay = delay
+        self.received = bytearray()
+
+    def start(self, loop):
+        loop.add_reader(self.master, self.on_command)
+
+    def on_command(self):
+        self.received += os.read(self.master, 1024)
+        while b'\r\n' in self.received:
+            cmd, _, rest = bytes(self.received).partition(b'\r\n')
+            self.received[:] = rest
+            reply = self.replies.get(cmd.decode())
+            if reply is not None:
+                asyncio.get_running_loop().call_later(self.delay, os.write, self.master, reply)
+
+    def stop(self, loop):
+        loop.remove_reader(self.master)
+        os.close(self.master)
+
+
+class MyTestCase(unittest.TestCase):
+    def test_init_simulated(self):
+        p = asyncio.run(cri.AsyncCriProbe.create(simulated=True))
+        self.assertEqual([probe['ID'] for probe in p.probes], ['A19999', 'A29999'])
+
+    @patch('criprobe.AsyncCriProbe.get_ports', autospec=True)
+    @patch('criprobe.AsyncCriProbe.open_port', autospec=True)
+    @patch('criprobe.AsyncCriProbe.send_command', autospec=True)
+    def test_measure_xy(self, mock_send_command, mock_open_port, mock_get_ports):
+        mock_get_ports.return_value = [TestPort()]
+        mock_open_port.return_value = 'Mock Port'
+        mock_send_command.side_effect = [b'OK:0:RC ID:A00489\r\n',
+                                         b'OK:0:RC Model:CR-100\r\n',
+                                         b'OK:0:RC InstrumentType:1\r\n',
+                                         b'OK:0:M:No errors\r\n',
+                                         b'OK:0:RM xy:0.3754,0.3773\r\n']
+
+        async def run():
+            p = await cri.AsyncCriProbe.create()
+            return p, await p.measure(), await p.read_measure('xy')
+
+        p, status, result = asyncio.run(run())
+        self.assertEqual(p.probes[0], {'Port': 'Mock Port', 'ID': 'A00489', 'Model': 'CR-100',
+                                       'Type': 'Colorimeter'})
+        self.assertEqual(status, [{'Probe ID': 'A00489', 'Status': b'OK:0:M:No errors\r\n'}])
+        self.assertEqual(result[0]['xy'].tolist(), [0.3754, 0.3773])
+
+    @patch('criprobe.AsyncCriProbe.send_command', autospec=True)
+    def test_measure_failure(self, mock_send_command):
+        async def send_command(self, port, cmd):
+            if port == 'Port 0':
+                raise cri.ProbeTimeoutError('No reply to M within 1.0 s')
+            await asyncio.sleep(0.05)
+            return b'OK:0:M:No errors\r\n'
+
+        mock_send_command.side_effect = send_command
+        p = cri.AsyncCriProbe(simulated=True)
+        for n, probe in enumerate(p.probes):
+            probe['Port'] = 'Port %d' % n
+        with self.assertRaises(cri.ProbeTimeoutError) as cm:
+            asyncio.run(p.measure())
+        # Raised once the other probe has finished, naming the probe that failed
+        self.assertEqual(str(cm.exception), 'A19999: No reply to M within 1.0 s')
+        self.assertEqual(cm.exception.results[1], {'Probe ID': 'A29999', 'Status': b'OK:0:M:No errors\r\n'})
+
+    def test_invalid_degree(self):
+        p = cri.AsyncCriProbe(simulated=True)
+        with self.assertRaises(ValueError) as cm:
+            asyncio.run(p.read_measure('xy', degree=4))
+        self.assertEqual(str(cm.exception), 'Degree of 2 or 10 required')
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pseudo-terminal')
+    def test_concurrent_serial_io(self):
+        replies = {'M': b'OK:0:M:No errors\r\n', 'RM Y': b'OK:0:RM Y:2.239e+00\r\n',
+                   'RM Exposure': b'OK:0:RM Exposure:111.622 msec\r\n',
+                   'RM Spectrum': b'OK:0:RM Spectrum:380.0,384.0,2.0,3\r\n2.5e-01\r\n5.0e-01\r\n7.5e-01\r\n'}
+        meters = [FakeMeter(replies, delay=0.2) for _ in range(3)]
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            for meter in meters:
+                meter.start(loop)
+            p = cri.AsyncCriProbe()
+            p.probes = [{'Port': await p.open_port(meter.device), 'ID': 'A0000%d' % n, 'Type': 'Colorimeter'}
+                        for n, meter in enumerate(meters)]
+            try:
+                # The exposure is known, so M goes out without reading it first
+                await p.read_measure('Exposure')
+                start = loop.time()
+                status = await p.measure()
+                elapsed = loop.time() - start
+                result = await p.read_measure('Y')
+                batch = await p.read_measure(['Y', 'Exposure'])
+                spectra = await p.read_spectrum()
+            finally:
+                p.close()
+                for meter in meters:
+                    meter.stop(loop)
+            return status, elapsed, result, batch, spectra
+
+        status, elapsed, result, batch, spectra = asyncio.run(run())
+        # All three meters integrate at once instead of one after another
+        self.assertLess(elapsed, 0.45)
+        self.assertEqual([s['Status'] for s in status], [b'OK:0:M:No errors\r\n'] * 3)
+        self.assertEqual([r['Y'] for r in result], [2.239] * 3)
+        self.assertEqual([(r['Y'], r['Exposure'], r['Units']) for r in batch],
+                         [(2.239, 111.622, {'Exposure': 'msec'})] * 3)
+        self.assertEqual([r['Spectrum'].tolist() for r in spectra], [[0.25, 0.5, 0.75]] * 3)
+        self.assertEqual(spectra[0]['Wavelength'].tolist(), [380.0, 382.0, 384.0])
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pseudo-terminal')
+    def test_timeout(self):
+        meter = FakeMeter({})
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            meter.start(loop)
+            port = AsyncSerial(serial.Serial(meter.device, 115200, timeout=0))
+            p = cri.AsyncCriProbe(timeout=0.1)
+            try:
+                with self.assertRaises(cri.ProbeTimeoutError):
+                    await p.send_command(port, 'RC ID')
+                # The lock is released so the port stays usable
+                self.assertFalse(port.lock.locked())
+            finally:
+                port.close()
+                meter.stop(loop)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
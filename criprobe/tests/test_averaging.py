@@ -0,0 +1,99 @@
+import unittest
+import numpy as np
+import criprobe as cri
+from criprobe.averaging import RunningStats
+from criprobe.tests.test_acquisition import LoopbackSerial
+
+
+class NoisySerial(LoopbackSerial):
+    # Y readings drawn from a normal distribution, spectra from a uniform one
+    def __init__(self, sigma, seed=0):
+        super().__init__()
+        self.sigma = sigma
+        self.rng = np.random.default_rng(seed)
+        self.cycles = 0
+
+    def write(self, data):
+        with self.lock:
+            for cmd in data.split(b'\r\n')[:-1]:
+                if cmd == b'M':
+                    self.cycles += 1
+                if cmd == b'RM Y':
+                    self.data += b'OK:0:RM Y:%.6e\r\n' % self.rng.normal(1.0, self.sigma)
+                elif cmd == b'RM Spectrum':
+                    self.data += (b'OK:0:RM Spectrum:380.0,384.0,2.0,3\r\n' +
+                                  b''.join(b'%.6e\r\n' % value for value in self.rng.random(3)))
+                else:
+                    self.data += self.replies[cmd]
+        return len(data)
+
+
+def noisy_probe(sigma):
+    p = cri.CriProbe(simulated=True)
+    p.probes = p.probes[1:]
+    p.probes[0]['Port'] = NoisySerial(sigma)
+    return p
+
+
+class MyTestCase(unittest.TestCase):
+    def test_running_stats(self):
+        values = np.random.default_rng(1).normal(5, 2, (50, 4))
+        stats = RunningStats()
+        for value in values:
+            stats.update(value)
+        self.assertEqual(stats.count, 50)
+        np.testing.assert_allclose(stats.mean, values.mean(axis=0))
+        np.testing.assert_allclose(stats.variance, values.var(axis=0, ddof=1))
+        np.testing.assert_allclose(stats.stderr, values.std(axis=0, ddof=1) / np.sqrt(50))
+        np.testing.assert_array_equal(stats.min, values.min(axis=0))
+        np.testing.assert_array_equal(stats.max, values.max(axis=0))
+
+    def test_single_reading(self):
+        stats = RunningStats()
+        stats.update(2.0)
+        self.assertEqual(stats.mean, 2.0)
+        self.assertTrue(np.isnan(stats.std))
+
+    def test_measure_averaged(self):
+        p = noisy_probe(0.1)
+        result = p.measure_averaged(['Y', 'xy', 'Exposure', 'Spectrum'], n=20)
+
+        self.assertEqual(p.probes[0]['Port'].cycles, 20)
+        self.assertEqual(result[0]['Probe ID'], 'A29999')
+        self.assertEqual(result[0]['Count'], 20)
+        self.assertAlmostEqual(result[0]['Y'], 1.0, delta=0.1)
+        self.assertIsInstance(result[0]['Y'], float)
+        self.assertLessEqual(result[0]['Min']['Y'], result[0]['Y'])
+        self.assertGreaterEqual(result[0]['Max']['Y'], result[0]['Y'])
+        np.testing.assert_allclose(result[0]['xy'], [0.3754, 0.3773])
+        np.testing.assert_array_equal(result[0]['Std']['xy'], [0, 0])
+        self.assertEqual(result[0]['Spectrum'].shape, (3,))
+        self.assertEqual(result[0]['Stderr']['Spectrum'].shape, (3,))
+        self.assertEqual(result[0]['Wavelength'].tolist(), [380.0, 382.0, 384.0])
+        self.assertEqual(result[0]['Units'], {'Exposure': 'msec'})
+
+    def test_target_stderr(self):
+        # A quiet reading reaches the target after the minimum count
+        p = noisy_probe(1e-6)
+        result = p.measure_averaged('Y', n=50, target_stderr=1e-3)
+        self.assertEqual(result[0]['Count'], 3)
+        self.assertEqual(p.probes[0]['Port'].cycles, 3)
+
+        # A noisy one keeps going until n
+        p = noisy_probe(0.5)
+        result = p.measure_averaged(['Y', 'xy'], n=10, target_stderr={'Y': 1e-3})
+        self.assertEqual(result[0]['Count'], 10)
+
+    def test_columnar(self):
+        p = noisy_probe(0.1)
+        result = p.measure_averaged(['Y', 'xy'], n=3)
+        batch = cri.MeasurementBatch.from_records(result)
+        self.assertEqual(sorted(set(batch.records['quantity'].tolist())), [b'Y', b'xy'])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            noisy_probe(0.1).measure_averaged('Y', n=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import socket
+import tempfile
+import unittest
+import numpy as np
+import criprobe as cri
+from criprobe.broker import ProbeBroker, BrokerClient
+from criprobe.tests.test_acquisition import LoopbackSerial
+
+SPECTRUM = np.round(np.linspace(1e-4, 1e-3, 201), 7)
+
+
+class SpectrumSerial(LoopbackSerial):
+    replies = dict(LoopbackSerial.replies)
+    replies[b'RM Spectrum'] = (b'OK:0:RM Spectrum:380.0,780.0,2.0,201\r\n' +
+                               b''.join(b'%.3e\r\n' % value for value in SPECTRUM))
+    replies[b'RM Foo'] = b'ER:10:RM Foo:Invalid command\r\n'
+
+
+def serial_probe():
+    p = cri.CriProbe(simulated=True)
+    p.probes = p.probes[1:]
+    p.probes[0]['Port'] = SpectrumSerial()
+    return p
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'broker.sock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_client(self):
+        with ProbeBroker(serial_probe(), self.path).start(), BrokerClient(self.path) as client:
+            self.assertEqual(client.probes, [{'ID': 'A29999', 'Model': 'CR-250', 'Type': 'Spectroradiometer'}])
+            self.assertEqual(client.measure(), b'OK:0:M:No errors\r\n')
+
+            result = client.read_measure(['xy', 'Exposure'])
+            self.assertEqual(result[0]['xy'].tolist(), [0.3754, 0.3773])
+            self.assertEqual(result[0]['Exposure'], 111.622)
+            self.assertEqual(result[0]['Units'], {'Exposure': 'msec'})
+
+            # Spectra come back through shared memory
+            for _ in range(2):
+                result = client.read_measure('Spectrum')
+                self.assertIsNotNone(client.block)
+                np.testing.assert_array_equal(result[0]['Spectrum'], SPECTRUM)
+                self.assertEqual(result[0]['Wavelength'][-1], 780.0)
+
+    def test_errors(self):
+        with ProbeBroker(serial_probe(), self.path).start(), BrokerClient(self.path) as client:
+            with self.assertRaises(cri.CommandError) as cm:
+                client.read_measure('Foo')
+            self.assertEqual((cm.exception.code, cm.exception.command), (10, 'RM Foo'))
+            with self.assertRaises(ValueError):
+                client.read_measure('xy', degree=3)
+            with self.assertRaises(ValueError):
+                client.call('close')
+            # The connection is still usable afterwards
+            self.assertEqual(client.read_measure('Y')[0]['Y'], 2.239)
+
+    def test_fair_coalescing(self):
+        broker = ProbeBroker(serial_probe(), self.path)
+        a, b, c = object(), object(), object()
+        broker.submit(a, 'read_measure', {'measure_type': 'xy'})
+        broker.submit(a, 'read_measure', {'measure_type': 'Y'})
+        broker.submit(b, 'read_measure', {'measure_type': 'xy'})
+        broker.submit(c, 'read_measure', {'measure_type': 'Y'})
+
+        # One xy exchange answers both a and b; c is served before a's second
+        # request and shares it
+        first = broker.next_request()
+        self.assertEqual((first.client, first.args, len(first.futures)), (a, {'measure_type': 'xy'}, 2))
+        second = broker.next_request()
+        self.assertEqual((second.client, second.args, len(second.futures)), (c, {'measure_type': 'Y'}, 2))
+        self.assertFalse(broker.queues)
+
+    def test_coalesced_results(self):
+        broker = ProbeBroker(serial_probe(), self.path)
+        futures = [broker.submit(object(), 'read_measure', {'measure_type': 'xy'}) for _ in range(3)]
+        broker.start()
+        try:
+            results = [future.result(timeout=5) for future in futures]
+        finally:
+            broker.close()
+        self.assertEqual(broker.executed, 1)
+        self.assertEqual([result[0]['xy'].tolist() for result in results], [[0.3754, 0.3773]] * 3)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_socket_in_use(self):
+        with ProbeBroker(serial_probe(), self.path).start():
+            with self.assertRaises(RuntimeError):
+                ProbeBroker(serial_probe(), self.path).start()
+
+        # A socket left behind by a dead broker is replaced
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        with ProbeBroker(serial_probe(), self.path).start(), BrokerClient(self.path) as client:
+            self.assertEqual(client.read_measure('Y')[0]['Y'], 2.239)
+
+
+if __name__ == '__main__':
+    unittest.main()
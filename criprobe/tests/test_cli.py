@@ -0,0 +1,113 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+import criprobe as cri
+from criprobe import cli
+from criprobe.broker import ProbeBroker
+from criprobe.emulator import CriEmulator
+
+
+def run(*argv):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        cli.main(list(argv))
+    return out.getvalue()
+
+
+class MyTestCase(unittest.TestCase):
+    def test_lazy_import(self):
+        code = 'import sys, criprobe; print("numpy" in sys.modules, "serial" in sys.modules, criprobe.CriProbe.__name__)'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split(), ['False', 'False', 'CriProbe'])
+        self.assertIn('CaptureStore', dir(cri))
+        with self.assertRaises(AttributeError):
+            cri.NotAThing
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pseudo-terminal')
+    def test_list_imports(self):
+        # Without a broker running, listing probes loads neither the broker
+        # nor numpy
+        code = ('import sys\n'
+                'from unittest.mock import patch\n'
+                'from criprobe import cli\n'
+                'with patch("serial.tools.list_ports.comports", return_value=[]):\n'
+                '    cli.main(["--cache", sys.argv[1], "list"])\n'
+                'print("numpy" in sys.modules, "criprobe.broker" in sys.modules)\n')
+        with tempfile.TemporaryDirectory() as directory, CriEmulator('A00489') as emulator:
+            env = dict(os.environ, CRIPROBE_PORTS=emulator.device, CRIPROBE_SOCKET=os.path.join(directory, 'none.sock'))
+            result = subprocess.run([sys.executable, '-c', code, os.path.join(directory, 'probes.json')],
+                                    capture_output=True, text=True, check=True, env=env)
+        self.assertEqual(result.stdout.splitlines(), ['A00489  CR-250  Spectroradiometer', 'False False'])
+
+    def test_help(self):
+        result = subprocess.run([sys.executable, '-m', 'criprobe', '--help'], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0)
+        self.assertIn('spectrum', result.stdout)
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pseudo-terminal')
+    def test_commands(self):
+        with tempfile.TemporaryDirectory() as directory, CriEmulator('A00489', integration_time=0.0) as emulator, \
+                patch('serial.tools.list_ports.comports', return_value=[]), \
+                patch.dict(os.environ, {'CRIPROBE_PORTS': emulator.device}):
+            cache = os.path.join(directory, 'probes.json')
+            options = ['--no-broker', '--cache', cache]
+
+            self.assertEqual(run(*options, 'list'), 'A00489  CR-250  Spectroradiometer\n')
+            # Detection filled the identity cache
+            self.assertTrue(os.path.exists(cache))
+
+            records = json.loads(run(*options, 'measure', 'xy', 'Y'))
+            self.assertEqual(records, [{'Probe ID': 'A00489', 'xy': [0.3127, 0.329], 'Y': 100.0}])
+            self.assertEqual(emulator.commands[-3:], ['M', 'RM xy', 'RM Y'])
+
+            # The 10 degree observer asks for RM xy10 and RM Y10
+            records = json.loads(run(*options, 'measure', 'xy', 'Y', '--degree', '10', '--no-trigger'))
+            self.assertEqual(records, [{'Probe ID': 'A00489', 'xy': [0.3138, 0.331], 'Y': 100.0}])
+            self.assertEqual(emulator.commands[-2:], ['RM xy10', 'RM Y10'])
+
+            lines = run(*options, 'measure', 'xy', 'Y', '--format', 'csv', '--no-trigger').splitlines()
+            self.assertEqual(lines, ['Probe ID,xy[0],xy[1],Y', 'A00489,0.3127,0.329,100.0'])
+            self.assertNotEqual(emulator.commands[-3], 'M')
+
+            path = os.path.join(directory, 'spectrum.npy')
+            run(*options, 'spectrum', '-o', path)
+            table = np.load(path)
+            wavelength, values = emulator.spectrum
+            np.testing.assert_array_equal(table[0], wavelength)
+            np.testing.assert_allclose(table[1], values, rtol=1e-3)
+
+            lines = run(*options, 'spectrum', '--format', 'csv').splitlines()
+            self.assertEqual(lines[0], 'Wavelength,A00489')
+            self.assertEqual(len(lines), 202)
+
+            with self.assertRaises(SystemExit) as cm:
+                run(*options, 'measure', 'Bogus')
+            self.assertIn('Invalid command', str(cm.exception.code))
+
+    @unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pseudo-terminal')
+    def test_broker(self):
+        with tempfile.TemporaryDirectory() as directory, CriEmulator('A00489', integration_time=0.0) as emulator, \
+                patch('serial.tools.list_ports.comports', return_value=[]), \
+                patch.dict(os.environ, {'CRIPROBE_PORTS': emulator.device}):
+            path = os.path.join(directory, 'broker.sock')
+            with cri.CriProbe() as cri_probe, ProbeBroker(cri_probe, path).start():
+                detected = len(emulator.commands)
+                self.assertEqual(run('--socket', path, 'list', '--format', 'json'),
+                                 json.dumps([{'ID': 'A00489', 'Model': 'CR-250', 'Type': 'Spectroradiometer'}],
+                                            indent=2) + '\n')
+                records = json.loads(run('--socket', path, 'spectrum'))
+                self.assertEqual(len(records[0]['Spectrum']), 201)
+                # The broker's probes are used as they are, without detection
+                self.assertEqual(emulator.commands[detected:],
+                                 ['RM Exposure', 'RM SyncFreq', 'RM RangeMode', 'RS ExposureMode', 'M', 'RM Spectrum'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from criprobe import codec
+
+
+class MyTestCase(unittest.TestCase):
+    def test_status(self):
+        self.assertEqual(codec.decode_status(b'OK:0:RM Y:2.239e+00\r\n'), (0, 'RM Y', b'2.239e+00'))
+
+    def test_command_error(self):
+        with self.assertRaises(codec.CommandError) as cm:
+            codec.decode_status(b'ER:10:RM Foo:Invalid command\r\n')
+        self.assertNotIsInstance(cm.exception, codec.MeasurementError)
+        self.assertEqual((cm.exception.code, cm.exception.command, cm.exception.message),
+                         (10, 'RM Foo', 'Invalid command'))
+
+    def test_measurement_error(self):
+        with self.assertRaises(codec.MeasurementError) as cm:
+            codec.decode_measure(b'ER:20:M:Measurement failed\r\n')
+        self.assertEqual(cm.exception.code, 20)
+        self.assertEqual(codec.decode_measure(b'OK:0:M:No errors\r\n'), 0)
+
+    def test_malformed(self):
+        for reply in [b'', b'garbage\r\n', b'OK:x:RM Y:1.0\r\n', b'XX:0:RM Y:1.0\r\n']:
+            with self.assertRaises(codec.ProtocolError):
+                codec.decode_status(reply)
+        with self.assertRaises(ValueError):
+            codec.decode_measurement('Y', b'OK:0:RM Y:\r\n')
+
+    def test_shapes(self):
+        value, unit = codec.decode_measurement('Y', b'OK:0:RM Y:2.239e+00\r\n')
+        self.assertEqual((value, unit), (2.239, None))
+        value, unit = codec.decode_measurement('xy', b'OK:0:RM xy:0.3754,0.3773\r\n')
+        np.testing.assert_array_equal(value, [0.3754, 0.3773])
+        value, unit = codec.decode_measurement('Exposure', b'OK:0:RM Exposure:111.622 msec\r\n')
+        self.assertEqual((value, unit), (111.622, 'msec'))
+        value, unit = codec.decode_measurement('RangeMode', b'OK:0:RM RangeMode:Auto\r\n')
+        self.assertEqual((value, unit), ('Auto', None))
+        # Quantities the codec does not know are decoded by their reply's shape
+        value, unit = codec.decode_measurement('Foo', b'OK:0:RM Foo:12.5 deg\r\n')
+        self.assertEqual((value, unit), (12.5, 'deg'))
+
+    def test_reply_checks(self):
+        # A reply to another command, e.g. one crossed with it or a late one
+        with self.assertRaises(codec.ProtocolError):
+            codec.decode_measurement('xy', b'OK:0:RM Y:1.0e+02\r\n')
+        with self.assertRaises(codec.ProtocolError):
+            codec.decode_spectrum(b'OK:0:RM Radiometric:380.0,384.0,2.0,3\r\n1\r\n2\r\n3\r\n')
+        # The 10 degree variant echoes its own command
+        value, unit = codec.decode_measurement('xy', b'OK:0:RM xy10:0.3,0.31\r\n', 'RM xy10')
+        np.testing.assert_array_equal(value, [0.3, 0.31])
+        # Fixed-width quantities must carry that many values
+        for quantity, value in [('XYZ', b'1.0,2.0'), ('xy', b'0.3'), ('Y', b'1.0,2.0')]:
+            with self.assertRaises(codec.ProtocolError):
+                codec.decode_measurement(quantity, b'OK:0:RM %s:%s\r\n' % (quantity.encode(), value))
+        self.assertEqual(codec.decode_measurement('XYZ', b'OK:0:RM XYZ:NA\r\n'), ('NA', None))
+
+    def test_decode_into(self):
+        out = np.zeros(3)
+        codec.QUANTITIES['Radiometric'].decode_into(b'0,3.209e-01,8.835e+17', out)
+        np.testing.assert_array_equal(out, [0, 0.3209, 8.835e17])
+        codec.QUANTITIES['Radiometric'].decode_into(b'NA', out)
+        self.assertTrue(np.all(np.isnan(out)))
+
+    def test_spectrum(self):
+        reply = b'OK:0:RM Spectrum:380.0,384.0,2.0,3\r\n1.0e-04\r\n2.0e-04\r\n3.0e-04\r\n'
+        wavelength, spectrum = codec.decode_spectrum(reply)
+        np.testing.assert_array_equal(wavelength, [380.0, 382.0, 384.0])
+        np.testing.assert_array_equal(spectrum, [1e-4, 2e-4, 3e-4])
+        with self.assertRaises(codec.ProtocolError):
+            codec.decode_spectrum(reply[:-9])
+
+
+if __name__ == '__main__':
+    unittest.main()
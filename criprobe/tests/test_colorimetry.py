@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+from criprobe import colorimetry
+
+WAVELENGTH = np.arange(380, 781, 2.0)
+
+
+class MyTestCase(unittest.TestCase):
+    def test_equal_energy(self):
+        # An equal-energy spectrum sits at the centre of the chromaticity diagram
+        spectra = np.ones((4, len(WAVELENGTH)))
+        for observer in (2, 10):
+            xy = colorimetry.chromaticity_xy(colorimetry.tristimulus(spectra, WAVELENGTH, observer))
+            self.assertEqual(xy.shape, (4, 2))
+            np.testing.assert_allclose(xy, 1 / 3, atol=1e-4)
+
+    def test_luminance(self):
+        # 1 W/(sr m^2) at 555 nm is 683 cd/m^2
+        wavelength = np.arange(550, 561, 1.0)
+        spectrum = np.where(wavelength == 555, 1.0, 0.0)
+        self.assertAlmostEqual(colorimetry.tristimulus(spectrum, wavelength)[1], colorimetry.KM)
+
+    def test_illuminant_a(self):
+        XYZ = colorimetry.tristimulus(colorimetry.planck(WAVELENGTH, 2856), WAVELENGTH)
+        np.testing.assert_allclose(colorimetry.chromaticity_xy(XYZ), [0.4476, 0.4074], atol=2e-4)
+
+    def test_uv(self):
+        uv = colorimetry.chromaticity_uv([[95.047, 100.0, 108.883]])
+        np.testing.assert_allclose(uv, [[0.1978, 0.4683]], atol=1e-4)
+
+    def test_cct(self):
+        temperatures = np.array([2000.0, 2856.0, 4000.0, 6500.0, 10000.0])
+        XYZ = colorimetry.tristimulus(colorimetry.planck(WAVELENGTH, temperatures), WAVELENGTH)
+        result = colorimetry.cct(XYZ)
+        self.assertEqual(result.shape, (5, 2))
+        np.testing.assert_allclose(result[:, 0], temperatures, rtol=1e-3)
+        np.testing.assert_allclose(result[:, 1], 0, atol=1e-5)
+
+        # D65 lies slightly above the locus
+        x, y = 0.3127, 0.3290
+        CCT, duv = colorimetry.cct([x / y, 1, (1 - x - y) / y])
+        self.assertAlmostEqual(CCT, 6504, delta=5)
+        self.assertAlmostEqual(duv, 0.0032, delta=2e-4)
+
+    def test_colorimetry(self):
+        spectra = np.random.default_rng(0).random((3, len(WAVELENGTH)))
+        result = colorimetry.colorimetry(spectra, WAVELENGTH)
+        self.assertEqual(set(result), set(colorimetry.QUANTITIES))
+        self.assertEqual(result['Y'].shape, (3,))
+        self.assertEqual(result['xy10'].shape, (3, 2))
+        self.assertEqual(result['CCT'].shape, (3, 2))
+        np.testing.assert_array_equal(result['XYZ'][:, 1], result['Y'])
+        self.assertFalse(np.allclose(result['XYZ'], result['XYZ10']))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            colorimetry.colorimetry(np.ones(len(WAVELENGTH)), WAVELENGTH, ['Radiometric'])
+        with self.assertRaises(ValueError):
+            colorimetry.tristimulus(np.ones(len(WAVELENGTH)), WAVELENGTH, observer=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,11 @@ import unittest
 import warnings
 from unittest.mock import patch
 import criprobe as cri
+from criprobe.cri import same_setting, setting_text
+import os
 import re
+import tempfile
+import threading
 import numpy as np
 
 
@@ -11,6 +15,40 @@ class TestPort:
     description ='Colorimetry Research (COMx)'
 
 
+class FakeSerial:
+    # Replays canned replies as one byte stream and records what was written
+    def __init__(self, replies):
+        self.data = bytearray(b''.join(replies))
+        self.writes = []
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def write(self, data):
+        self.writes.append(data)
+        return len(data)
+
+    def read(self, size=1):
+        chunk = bytes(self.data[:size])
+        del self.data[:size]
+        return chunk
+
+    def readline(self):
+        end = self.data.find(b'\n')
+        return self.read(len(self.data) if end < 0 else end + 1)
+
+
+# Replies to the settings read before a probe's first M
+DEADLINE_REPLIES = [b'OK:0:RM Exposure:100.000 msec\r\n', b'OK:0:RM SyncFreq:NA\r\n', b'OK:0:RM RangeMode:Fixed\r\n',
+                    b'OK:0:RS ExposureMode:Fixed\r\n']
+
+
+def spectrum_reply(values):
+    return (b'OK:0:RM Spectrum:380.0,780.0,2.0,%d\r\n' % len(values) +
+            b''.join(b'%.3e\r\n' % value for value in values))
+
+
 class MyTestCase(unittest.TestCase):
     def test_init(self):
         # Create a simulated probe object
@@ -112,10 +150,12 @@ class MyTestCase(unittest.TestCase):
 
         p = cri.CriProbe()
         p.measure()
-        with self.assertRaises(ValueError) as cm:
+        with self.assertRaises(RuntimeError) as cm:
             p.read_measure('xy', degree=10)
-            err = cm.exception
-            self.assertEqual(str(err), '10 degree only valid if instrument type is spectroradiometer')
+        self.assertEqual(str(cm.exception), '10 degree only valid if instrument type is spectroradiometer')
+        with self.assertRaises(ValueError) as cm:
+            p.read_measure('CCT', degree=10)
+        self.assertEqual(str(cm.exception), '10 degree only valid with X, Y, Z, XYZ, and xy')
 
     @patch('criprobe.CriProbe.get_ports', autospec=True)
     @patch('criprobe.CriProbe.open_port', autospec=True)
@@ -409,9 +449,245 @@ class MyTestCase(unittest.TestCase):
 
         p = cri.CriProbe()
         p.measure()
-        result = p.read_measure('Radiometric')
+        # A spectrum reply is not taken for the Radiometric reading
+        with self.assertRaises(cri.ProtocolError):
+            p.read_measure('Radiometric')
+
+    @patch('criprobe.CriProbe.send_command', autospec=True)
+    def test_measure_concurrent(self, mock_send_command):
+        p = cri.CriProbe(simulated=True)
+        for n, probe in enumerate(p.probes):
+            probe['Port'] = 'Port %d' % n
+        # Both probes must be integrating at once to get past the barrier
+        barrier = threading.Barrier(len(p.probes))
+
+        def send_command(self, port, cmd):
+            barrier.wait(timeout=5)
+            return b'OK:0:M:No errors\r\n' if port == 'Port 0' else b'ER:10:M:Invalid command\r\n'
+
+        mock_send_command.side_effect = send_command
+        with self.assertRaises(cri.MeasurementError) as cm:
+            p.measure(concurrent=True)
+
+        # The failing probe is reported with its error code, and the other
+        # probe's status is kept
+        self.assertEqual(cm.exception.code, 10)
+        self.assertEqual(cm.exception.probe_id, 'A29999')
+        self.assertTrue(str(cm.exception).startswith('A29999: M failed with error 10'))
+        self.assertEqual(cm.exception.results[0], {'Probe ID': 'A19999', 'Status': b'OK:0:M:No errors\r\n'})
+        self.assertEqual(cm.exception.results[1]['Status'], b'ER:10:M:Invalid command\r\n')
+        self.assertIs(cm.exception.results[1]['Error'], cm.exception)
+
+        mock_send_command.side_effect = lambda self, port, cmd: b'OK:0:M:No errors\r\n'
+        self.assertEqual(p.measure(concurrent=True), [{'Probe ID': 'A19999', 'Status': b'OK:0:M:No errors\r\n'},
+                                                      {'Probe ID': 'A29999', 'Status': b'OK:0:M:No errors\r\n'}])
+
+    @patch('criprobe.CriProbe.get_ports', autospec=True)
+    @patch('criprobe.CriProbe.open_port', autospec=True)
+    @patch('criprobe.CriProbe.send_command', autospec=True)
+    def test_init_parallel_detect(self, mock_send_command, mock_open_port, mock_get_ports):
+        devices = ['/dev/cu.usbmodemA00489%d' % n for n in range(4)]
+        ports = []
+        for device in devices:
+            port = TestPort()
+            port.device = device
+            ports.append(port)
+        mock_get_ports.return_value = ports
+        mock_open_port.side_effect = lambda self, device: device
+        # Only released once every port is being queried at the same time
+        barrier = threading.Barrier(len(devices))
+
+        def send_command(self, port, cmd):
+            if cmd == 'RC ID':
+                barrier.wait(timeout=5)
+            return {'RC ID': b'OK:0:RC ID:A0048' + port[-1].encode() + b'\r\n',
+                    'RC Model': b'OK:0:RC Model:CR-250\r\n',
+                    'RC InstrumentType': b'OK:0:RC InstrumentType:2\r\n'}[cmd]
+
+        mock_send_command.side_effect = send_command
+        # Querying the ports one at a time would break the barrier
+        p = cri.CriProbe()
+        self.assertEqual([probe['Port'] for probe in p.probes], devices)
+        self.assertEqual([probe['ID'] for probe in p.probes], ['A00480', 'A00481', 'A00482', 'A00483'])
+
+    @patch('criprobe.CriProbe.get_ports', autospec=True)
+    @patch('criprobe.CriProbe.open_port', autospec=True)
+    @patch('criprobe.CriProbe.send_command', autospec=True)
+    def test_init_identity_cache(self, mock_send_command, mock_open_port, mock_get_ports):
+        test_port = TestPort()
+        mock_get_ports.return_value = [test_port]
+        mock_open_port.return_value = 'Mock Port'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_path = os.path.join(tmp_dir, 'probes.json')
+
+            # First start runs a full detection and writes the cache
+            mock_send_command.side_effect = [b'OK:0:RC ID:A00489\r\n',
+                                             b'OK:0:RC Model:CR-100\r\n',
+                                             b'OK:0:RC InstrumentType:1\r\n']
+            cri.CriProbe(cache_path=cache_path)
+            self.assertTrue(os.path.exists(cache_path))
+
+            # Second start only confirms the ID
+            mock_send_command.reset_mock()
+            mock_send_command.side_effect = [b'OK:0:RC ID:A00489\r\n']
+            p = cri.CriProbe(cache_path=cache_path)
+            self.assertEqual(mock_send_command.call_count, 1)
+            self.assertEqual(p.probes[0], {'Port': 'Mock Port', 'ID': 'A00489', 'Model': 'CR-100',
+                                           'Type': 'Colorimeter'})
+
+            # Skipping validation sends no RC queries at all
+            mock_send_command.reset_mock()
+            p = cri.CriProbe(cache_path=cache_path, validate_cache=False)
+            self.assertEqual(mock_send_command.call_count, 0)
+            self.assertEqual(p.probes[0]['Model'], 'CR-100')
+
+            # A different meter on the same port triggers a refresh
+            mock_send_command.reset_mock()
+            mock_send_command.side_effect = [b'OK:0:RC ID:A00500\r\n',
+                                             b'OK:0:RC Model:CR-250\r\n',
+                                             b'OK:0:RC InstrumentType:2\r\n']
+            p = cri.CriProbe(cache_path=cache_path)
+            self.assertEqual(p.probes[0]['ID'], 'A00500')
+            self.assertEqual(p.probes[0]['Type'], 'Spectroradiometer')
+
+    def test_read_measure_batched(self):
+        p = cri.CriProbe(simulated=True)
+        ports = [FakeSerial([b'OK:0:RM xy:0.3754,0.3773\r\n',
+                             b'OK:0:RM Y:2.239e+00\r\n',
+                             b'OK:0:RM CCT:5577,-0.0100\r\n',
+                             b'OK:0:RM Exposure:111.622 msec\r\n']) for _ in p.probes]
+        for probe, port in zip(p.probes, ports):
+            probe['Port'] = port
+
+        result = p.read_measure(['xy', 'Y', 'CCT', 'Exposure'])
+
+        # Every probe gets all of its commands in a single write
+        for port in ports:
+            self.assertEqual(port.writes, [b'RM xy\r\nRM Y\r\nRM CCT\r\nRM Exposure\r\n'])
+        self.assertEqual([r['Probe ID'] for r in result], ['A19999', 'A29999'])
         for probe_dict in result:
-            self.assertEqual(probe_dict['Radiometric'].tolist(), [380.0, 780.0, 2.0, 201, 2.119e-24, 1.913e-24])
+            self.assertEqual(probe_dict['xy'].tolist(), [0.3754, 0.3773])
+            self.assertEqual(probe_dict['Y'], 2.239)
+            self.assertEqual(probe_dict['CCT'].tolist(), [5577.0, -0.01])
+            self.assertEqual(probe_dict['Exposure'], 111.622)
+            self.assertEqual(probe_dict['Units'], {'Exposure': 'msec'})
+
+    def test_read_measure_batched_invalid_degree(self):
+        p = cri.CriProbe(simulated=True)
+        ports = [FakeSerial([]) for _ in p.probes]
+        for probe, port in zip(p.probes, ports):
+            probe['Port'] = port
+
+        with self.assertRaises(ValueError) as cm:
+            p.read_measure(['xy', 'Y'], degree=4)
+        self.assertEqual(str(cm.exception), 'Degree of 2 or 10 required')
+        # Nothing is sent when a command is invalid
+        self.assertEqual([port.writes for port in ports], [[], []])
+
+    def test_read_spectrum(self):
+        p = cri.CriProbe(simulated=True)
+        spectra = np.round(np.random.default_rng(0).random((2, 201)), 3)
+        for probe, values in zip(p.probes, spectra):
+            probe['Port'] = FakeSerial([spectrum_reply(values)])
+
+        out = np.zeros((2, 201))
+        result = p.read_spectrum(out=out)
+
+        # All 201 samples are read into the caller's buffer
+        np.testing.assert_array_equal(out, spectra)
+        for n, probe_dict in enumerate(result):
+            self.assertTrue(np.shares_memory(probe_dict['Spectrum'], out[n]))
+            self.assertEqual(probe_dict['Wavelength'][0], 380.0)
+            self.assertEqual(probe_dict['Wavelength'][-1], 780.0)
+            self.assertEqual(len(probe_dict['Wavelength']), 201)
+        # Nothing is left on the wire
+        self.assertEqual([probe['Port'].in_waiting for probe in p.probes], [0, 0])
+
+    def test_read_measure_spectrum(self):
+        p = cri.CriProbe(simulated=True)
+        p.probes = p.probes[1:]
+        port = FakeSerial([b'OK:0:RM Spectrum:380.0,382.0,2.0,2\r\n2.119e-24\r\n1.913e-24\r\n'])
+        p.probes[0]['Port'] = port
+
+        result = p.read_measure('Spectrum')
+        self.assertEqual(port.writes, [b'RM Spectrum\r\n'])
+        for probe_dict in result:
+            self.assertEqual(probe_dict['Spectrum'].tolist(), [2.119e-24, 1.913e-24])
+            self.assertEqual(probe_dict['Wavelength'].tolist(), [380.0, 382.0])
+
+    def test_read_measure_batched_spectrum(self):
+        p = cri.CriProbe(simulated=True)
+        p.probes = p.probes[1:]
+        # The spectrum is requested last, whatever its position in the list
+        port = FakeSerial([b'OK:0:RM Y:2.239e+00\r\n',
+                           b'OK:0:RM xy:0.3754,0.3773\r\n',
+                           spectrum_reply([0.25, 0.5, 0.75])])
+        p.probes[0]['Port'] = port
+
+        result = p.read_measure(['Y', 'Spectrum', 'xy'])
+        self.assertEqual(port.writes, [b'RM Y\r\nRM xy\r\nRM Spectrum\r\n'])
+        self.assertEqual(result[0]['Y'], 2.239)
+        self.assertEqual(result[0]['xy'].tolist(), [0.3754, 0.3773])
+        self.assertEqual(result[0]['Spectrum'].tolist(), [0.25, 0.5, 0.75])
+        self.assertEqual(result[0]['Wavelength'].tolist(), [380.0, 382.0, 384.0])
+
+    def test_read_colorimetry(self):
+        p = cri.CriProbe(simulated=True)
+        p.probes = p.probes[1:]
+        port = FakeSerial([spectrum_reply(np.full(201, 0.01))])
+        p.probes[0]['Port'] = port
+
+        result = p.read_colorimetry(['Y', 'xy', 'CCT'])
+
+        # One spectrum readout replaces an RM per quantity
+        self.assertEqual(port.writes, [b'RM Spectrum\r\n'])
+        self.assertEqual(set(result[0]), {'Probe ID', 'Y', 'xy', 'CCT'})
+        np.testing.assert_allclose(result[0]['xy'], 1 / 3, atol=1e-4)
+        self.assertAlmostEqual(result[0]['CCT'][0], 5455, delta=5)
+
+        # Colorimeters have no spectrum to compute from
+        p = cri.CriProbe(simulated=True)
+        with self.assertRaises(RuntimeError):
+            p.read_colorimetry()
+
+    def test_same_setting(self):
+        self.assertTrue(same_setting('Exposure', '100.000 msec', 100))
+        self.assertFalse(same_setting('Exposure', '100.000 msec', 200.0))
+        self.assertTrue(same_setting('ExposureMode', 'Auto', 'auto'))
+        self.assertFalse(same_setting('Aperture', '1 deg', '1/8 deg'))
+        self.assertFalse(same_setting('Accessory', 'MS-75', 'LP-75'))
+        self.assertFalse(same_setting('Range', None, 0))
+        # More than the 6 significant digits of '%g'
+        self.assertEqual(setting_text(59.94006), '59.94006')
+        self.assertEqual(setting_text(np.float64(59.94006)), '59.94006')
+        self.assertFalse(same_setting('SyncFreq', '59.9401 Hz', 59.94006))
+        self.assertTrue(same_setting('SyncFreq', '59.94006 Hz', 59.94006))
+
+    def test_read_resampled(self):
+        p = cri.CriProbe(simulated=True)
+        p.probes = p.probes[1:]
+        port = FakeSerial([spectrum_reply(np.linspace(0.0, 2.0, 201))])
+        p.probes[0]['Port'] = port
+
+        result = p.read_resampled(np.arange(400, 701, 5.0), method='bin')
+
+        self.assertEqual(port.writes, [b'RM Spectrum\r\n'])
+        np.testing.assert_array_equal(result[0]['Wavelength'], np.arange(400, 701, 5.0))
+        np.testing.assert_allclose(result[0]['Spectrum'], (np.arange(400, 701, 5.0) - 380) / 200, rtol=1e-3)
+
+        p = cri.CriProbe(simulated=True)
+        with self.assertRaises(RuntimeError):
+            p.read_resampled(np.arange(400, 701, 5.0))
+
+    def test_read_spectrum_timeout(self):
+        p = cri.CriProbe(simulated=True)
+        p.probes = p.probes[1:]
+        p.probes[0]['Port'] = FakeSerial([spectrum_reply([0.25, 0.5, 0.75])[:-12]])
+
+        with self.assertRaises(RuntimeError) as cm:
+            p.read_spectrum()
+        self.assertEqual(str(cm.exception), 'Timed out reading from probe')
 
 
 if __name__ == '__main__':
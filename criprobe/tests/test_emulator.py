@@ -0,0 +1,190 @@
+import os
+import time
+import unittest
+from unittest.mock import patch
+import numpy as np
+import serial
+import criprobe as cri
+from criprobe.emulator import CriEmulator
+from criprobe.timeouts import AUTO_RANGE_FACTOR, MEASURE_TIMEOUT
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pseudo-terminal')
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        # Only the emulated meters should be detected
+        patcher = patch('serial.tools.list_ports.comports', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_detect_and_measure(self):
+        with CriEmulator('A00489', 'CR-250', integration_time=0.05) as spectro, \
+                CriEmulator('A00490', 'CR-100', 'Colorimeter', integration_time=0.05) as colorimeter:
+            with patch.dict(os.environ, {'CRIPROBE_PORTS': os.pathsep.join([spectro.device, colorimeter.device])}):
+                p = cri.CriProbe()
+
+            self.assertEqual([(probe['ID'], probe['Model'], probe['Type']) for probe in p.probes],
+                             [('A00489', 'CR-250', 'Spectroradiometer'), ('A00490', 'CR-100', 'Colorimeter')])
+
+            status = p.measure(concurrent=True)
+            self.assertEqual([s['Status'] for s in status], [b'OK:0:M:No errors\r\n'] * 2)
+
+            result = p.read_measure(['xy', 'Y', 'Exposure'])
+            self.assertEqual(result[0]['xy'].tolist(), [0.3127, 0.3290])
+            self.assertEqual(result[1]['Exposure'], 50.0)
+
+            p.probes = p.probes[:1]
+            spectrum = p.read_spectrum()[0]
+            wavelength, values = spectro.spectrum
+            self.assertEqual(len(spectrum['Spectrum']), 201)
+            np.testing.assert_array_equal(spectrum['Wavelength'], wavelength)
+            np.testing.assert_allclose(spectrum['Spectrum'], values, rtol=1e-3)
+
+    def test_error_injection(self):
+        with CriEmulator(integration_time=0.0) as emulator:
+            port = serial.Serial(emulator.device, 115200, timeout=1)
+            p = cri.CriProbe(simulated=True)
+            p.prepare_deadline(port)
+            emulator.inject_error(20, 'Low light')
+            self.assertEqual(p.send_command(port, 'M'), b'ER:20:M:Low light\r\n')
+            self.assertEqual(p.send_command(port, 'M'), b'OK:0:M:No errors\r\n')
+            self.assertEqual(p.send_command(port, 'RM Bogus'), b'ER:1:RM Bogus:Invalid command\r\n')
+            port.close()
+
+    @patch('criprobe.cri.QUERY_TIMEOUT', 0.2)
+    def test_hung_meter(self):
+        with CriEmulator(drop_rate=1.0) as emulator:
+            port = serial.Serial(emulator.device, 115200, timeout=30)
+            p = cri.CriProbe(simulated=True)
+            start = time.perf_counter()
+            with self.assertRaises(cri.ProbeTimeoutError):
+                p.send_command(port, 'RC ID')
+            # A query gives up after its own short deadline, not the port's 30 s
+            self.assertLess(time.perf_counter() - start, 1.0)
+            self.assertEqual(emulator.commands, ['RC ID'])
+            port.close()
+
+    def test_measure_deadline(self):
+        with CriEmulator(integration_time=0.2) as emulator:
+            emulator.settings['ExposureMode'] = 'Fixed'
+            port = serial.Serial(emulator.device, 115200, timeout=30)
+            p = cri.CriProbe(simulated=True)
+            p.probes = [{'Port': port, 'ID': 'A00001', 'Type': 'Spectroradiometer'}]
+
+            # The exposure settings are read in one batch before the first M,
+            # so even that M is bounded by the reported exposure
+            p.measure()
+            self.assertEqual(emulator.commands, ['RM Exposure', 'RM SyncFreq', 'RM RangeMode', 'RS ExposureMode', 'M'])
+            self.assertLess(port.timeout, 3.0)
+            self.assertGreater(port.timeout, 1.2)
+
+            # After that M goes out on its own
+            p.measure()
+            self.assertEqual(emulator.commands[5:], ['M'])
+
+            # A meter that stops answering costs the deadline, not 30 s
+            emulator.drop_rate = 1.0
+            start = time.perf_counter()
+            with self.assertRaises(cri.ProbeTimeoutError):
+                p.measure()
+            self.assertLess(time.perf_counter() - start, 3.0)
+            port.close()
+
+    def test_auto_exposure_deadline(self):
+        with CriEmulator(integration_time=0.05) as emulator:
+            port = serial.Serial(emulator.device, 115200, timeout=30)
+            p = cri.CriProbe(simulated=True)
+            p.probes = [{'Port': port, 'ID': 'A00001', 'Type': 'Spectroradiometer'}]
+            p.measure()
+            # Auto exposure may lengthen at any time, so M keeps the maximum
+            self.assertEqual(port.timeout, MEASURE_TIMEOUT)
+            emulator.integration_time = 1.3
+            p.measure()
+            port.close()
+
+    @patch('criprobe.timeouts.OVERHEAD', 0.1)
+    def test_growing_integration(self):
+        with CriEmulator(integration_time=0.05) as emulator:
+            emulator.settings['ExposureMode'] = 'Fixed'
+            port = serial.Serial(emulator.device, 115200, timeout=30)
+            p = cri.CriProbe(simulated=True)
+            p.probes = [{'Port': port, 'ID': 'A00001', 'Type': 'Spectroradiometer'}]
+            p.measure()
+            first = port.timeout
+
+            # The exposure grows behind the deadline's back, e.g. from the
+            # front panel: missed deadlines double until M gets through
+            emulator.integration_time = 0.5
+            timeouts = 0
+            while True:
+                try:
+                    p.measure()
+                    break
+                except cri.ProbeTimeoutError:
+                    timeouts += 1
+                    self.assertLess(timeouts, 4)
+            self.assertGreater(timeouts, 0)
+            self.assertAlmostEqual(port.timeout, first * 2 ** timeouts)
+
+            # Later cycles follow the longer measurements
+            p.measure()
+            self.assertGreater(port.timeout, 0.5)
+            self.assertEqual(p.send_command(port, 'RM Exposure'), b'OK:0:RM Exposure:500.000 msec\r\n')
+            port.close()
+
+    @patch('criprobe.cri.QUERY_TIMEOUT', 0.2)
+    def test_hung_on_first_measure(self):
+        with CriEmulator(drop_rate=1.0) as emulator:
+            port = serial.Serial(emulator.device, 115200, timeout=30)
+            p = cri.CriProbe(simulated=True)
+            p.probes = [{'Port': port, 'ID': 'A00001', 'Type': 'Spectroradiometer'}]
+            start = time.perf_counter()
+            # Reading the exposure settings already fails, long before M's 30 s
+            with self.assertRaises(cri.ProbeTimeoutError):
+                p.measure()
+            self.assertLess(time.perf_counter() - start, 1.0)
+            self.assertNotIn('M', emulator.commands)
+            port.close()
+
+    def test_configure(self):
+        with CriEmulator('A00489', integration_time=0.1) as first, CriEmulator('A00490', integration_time=0.1) as second:
+            with patch.dict(os.environ, {'CRIPROBE_PORTS': os.pathsep.join([first.device, second.device])}):
+                p = cri.CriProbe()
+            second.settings['ExposureMode'] = 'Fixed'
+
+            result = p.configure(ExposureMode='Fixed', Exposure=200, Speed='normal')
+            self.assertEqual(result, [{'Probe ID': 'A00489', 'Changed': {'ExposureMode': 'Fixed', 'Exposure': 200}},
+                                      {'Probe ID': 'A00490', 'Changed': {'Exposure': 200}}])
+            # The current setup is read once, then only the differences are sent
+            self.assertEqual(first.commands[-5:], ['RS Speed', 'RS ExposureMode', 'RS Exposure',
+                                                   'SM ExposureMode Fixed', 'SM Exposure 200'])
+            self.assertEqual(second.commands[-1], 'SM Exposure 200')
+            self.assertEqual(p.read_measure('Exposure')[1]['Exposure'], 200.0)
+            # The M deadline follows the new exposure; auto-ranging may take
+            # several of them
+            self.assertAlmostEqual(p.deadline(p.probes[0]['Port']).expected(), 0.2 * AUTO_RANGE_FACTOR)
+
+            # Nothing to send when the setup already matches
+            sent = len(first.commands)
+            self.assertEqual(p.configure({'Exposure': 200.0, 'ExposureMode': 'Fixed'})[0]['Changed'], {})
+            self.assertEqual(len(first.commands), sent)
+            self.assertEqual(p.read_settings('Exposure')[0], {'Probe ID': 'A00489', 'Exposure': '200'})
+            self.assertEqual(len(first.commands), sent)
+
+            # Text settings sharing leading digits are different settings
+            self.assertEqual(p.configure(Aperture='1/8 deg')[0]['Changed'], {'Aperture': '1/8 deg'})
+            self.assertEqual(first.settings['Aperture'], '1/8 deg')
+            self.assertEqual(p.configure(Aperture='1/8 DEG')[0]['Changed'], {})
+
+            # A rejected value is forgotten and read back next time
+            with self.assertRaises(cri.CommandError):
+                p.configure(Exposure='long')
+            self.assertEqual(p.read_settings('Exposure')[0]['Exposure'], '200.000 msec')
+
+            with self.assertRaises(ValueError):
+                p.configure(Brightness=1)
+            p.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import unittest
+import criprobe as cri
+from criprobe.framing import ReplyReader, COMPACT_SIZE
+from criprobe.tests.test_cri import spectrum_reply
+
+
+class ChunkedSerial:
+    # Delivers data in the given chunks, as a serial port would as bytes
+    # arrive over time; an empty chunk stands for a timeout
+    timeout = 1.0
+
+    def __init__(self, chunks, answers=()):
+        self.chunks = list(chunks)
+        # Chunks that arrive after each write
+        self.answers = list(answers)
+        self.reads = 0
+        self.writes = []
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        self.reads += 1
+        if not self.chunks:
+            return b''
+        chunk, self.chunks[0] = self.chunks[0][:size], self.chunks[0][size:]
+        if not self.chunks[0]:
+            self.chunks.pop(0)
+        return chunk
+
+    def write(self, data):
+        self.writes.append(data)
+        if self.answers:
+            self.chunks += self.answers.pop(0)
+        return len(data)
+
+
+class MyTestCase(unittest.TestCase):
+    def test_replies_in_one_read(self):
+        port = ChunkedSerial([b'OK:0:RM Y:2.239e+00\r\nOK:0:RM xy:0.3754,0.3773\r\n'])
+        reader = ReplyReader(port)
+        self.assertEqual(reader.read_reply('RM Y'), b'OK:0:RM Y:2.239e+00\r\n')
+        self.assertEqual(reader.read_reply('RM xy'), b'OK:0:RM xy:0.3754,0.3773\r\n')
+        self.assertEqual(port.reads, 1)
+        self.assertEqual(len(reader), 0)
+
+    def test_spectrum_frame(self):
+        reply = spectrum_reply([0.25 * n for n in range(201)])
+        # Split mid-line, as bytes trickle in from the meter
+        port = ChunkedSerial([reply[n:n + 100] for n in range(0, len(reply), 100)] + [b'OK:0:M:No errors\r\n'])
+        reader = ReplyReader(port)
+        self.assertEqual(reader.read_reply('RM Spectrum'), reply)
+        self.assertEqual(reader.read_reply('M'), b'OK:0:M:No errors\r\n')
+
+    def test_error_reply_is_one_line(self):
+        port = ChunkedSerial([b'ER:10:RM Spectrum:Invalid command\r\nOK:0:M:No errors\r\n'])
+        reader = ReplyReader(port)
+        self.assertEqual(reader.read_reply('RM Spectrum'), b'ER:10:RM Spectrum:Invalid command\r\n')
+
+    def test_timeout_recovery(self):
+        port = ChunkedSerial([b'OK:0:RM Y:2.2', b''])
+        reader = ReplyReader(port)
+        with self.assertRaises(cri.ProbeTimeoutError) as cm:
+            reader.read_reply('RM Y')
+        self.assertEqual(str(cm.exception), 'No reply to RM Y within 1.0 s')
+        self.assertTrue(reader.stale)
+
+        # The rest of the late reply and noise are waiting when the next
+        # command goes out; another late reply arrives after it
+        port.chunks = [b'39e+00\r\n\x00garbage']
+        reader.discard()
+        port.chunks = [b'OK:0:RM Y:2.239e+00\r\n', b'OK:0:RM xy:0.3754,0.3773\r\n']
+        self.assertEqual(reader.read_reply('RM xy'), b'OK:0:RM xy:0.3754,0.3773\r\n')
+        self.assertFalse(reader.stale)
+
+    def test_late_reply_to_same_command(self):
+        port = ChunkedSerial([b''])
+        reader = ReplyReader(port)
+        with self.assertRaises(cri.ProbeTimeoutError):
+            reader.read_reply('M')
+        self.assertEqual(reader.unanswered, {'M': 1})
+        # The first M's reply arrives after the second M is sent
+        reader.discard()
+        port.chunks = [b'OK:0:M:late\r\n', b'OK:0:M:No errors\r\n']
+        self.assertEqual(reader.read_reply('M'), b'OK:0:M:No errors\r\n')
+        self.assertEqual(reader.unanswered, {})
+
+    def test_late_reply_drained(self):
+        port = ChunkedSerial([b''])
+        reader = ReplyReader(port)
+        with self.assertRaises(cri.ProbeTimeoutError):
+            reader.read_reply('M')
+        # The late reply is already waiting when the next M goes out
+        port.chunks = [b'OK:0:M:late\r\n']
+        reader.discard()
+        port.chunks = [b'OK:0:M:No errors\r\n']
+        self.assertEqual(reader.read_reply('M'), b'OK:0:M:No errors\r\n')
+
+    def test_late_replies_in_a_row(self):
+        # Each M times out while the meter is still busy with the one before
+        port = ChunkedSerial([b'', b'OK:0:M:first\r\n', b'', b'OK:0:M:second\r\n', b'OK:0:M:third\r\n'])
+        reader = ReplyReader(port)
+        for _ in range(2):
+            with self.assertRaises(cri.ProbeTimeoutError):
+                reader.read_reply('M')
+        self.assertEqual(reader.read_reply('M'), b'OK:0:M:third\r\n')
+
+    def test_lost_reply(self):
+        # The first M is never answered, so the second M's reply is taken
+        # for the late one; any other reply shows it was lost
+        port = ChunkedSerial([b'', b'OK:0:M:second\r\n', b'', b'OK:0:RM Y:2.239e+00\r\n', b'OK:0:M:third\r\n'])
+        reader = ReplyReader(port)
+        for _ in range(2):
+            with self.assertRaises(cri.ProbeTimeoutError):
+                reader.read_reply('M')
+        self.assertEqual(reader.read_reply('RM Y'), b'OK:0:RM Y:2.239e+00\r\n')
+        self.assertEqual(reader.read_reply('M'), b'OK:0:M:third\r\n')
+
+    def test_partial_spectrum(self):
+        port = ChunkedSerial([spectrum_reply([0.25, 0.5, 0.75])[:-12], b''])
+        reader = ReplyReader(port)
+        with self.assertRaises(cri.ProbeTimeoutError) as cm:
+            reader.read_reply('RM Spectrum')
+        self.assertEqual(str(cm.exception), 'Timed out reading from probe')
+
+    def test_compaction(self):
+        reply = b'OK:0:RM Y:2.239e+00\r\n'
+        count = 2 * COMPACT_SIZE // len(reply)
+        port = ChunkedSerial([reply] * count)
+        reader = ReplyReader(port)
+        for _ in range(count):
+            self.assertEqual(reader.read_reply('RM Y'), reply)
+        self.assertLess(len(reader.buffer), COMPACT_SIZE + len(reply))
+
+    def test_send_command_recovers(self):
+        p = cri.CriProbe(simulated=True)
+        port = ChunkedSerial([], [[b'OK:0:RM Y:2.2', b''], [b'OK:0:RM xy:0.3754,0.3773\r\n']])
+        with self.assertRaises(cri.ProbeTimeoutError):
+            p.send_command(port, 'RM Y')
+        # The end of the late reply is dropped before the next command
+        port.chunks = [b'39e+00\r\n']
+        self.assertEqual(p.send_command(port, 'RM xy'), b'OK:0:RM xy:0.3754,0.3773\r\n')
+        self.assertEqual(port.writes, [b'RM Y\r\n', b'RM xy\r\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
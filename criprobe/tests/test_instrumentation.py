@@ -0,0 +1,74 @@
+import unittest
+import criprobe as cri
+from criprobe.instrumentation import Histogram, command_verb
+from criprobe.tests.test_cri import DEADLINE_REPLIES, FakeSerial, spectrum_reply
+
+
+class MyTestCase(unittest.TestCase):
+    def test_command_verb(self):
+        self.assertEqual(command_verb('RC ID'), 'RC')
+        self.assertEqual(command_verb('M'), 'M')
+        self.assertEqual(command_verb('RM xy'), 'RM xy')
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in [0.001] * 90 + [1.0] * 10:
+            histogram.observe(value)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['mean'], 0.1009)
+        self.assertLess(summary['p50'], 0.002)
+        self.assertEqual(summary['p99'], 1.0)
+
+    def test_disabled_by_default(self):
+        p = cri.CriProbe(simulated=True)
+        self.assertIsNone(p.instrumentation)
+        p.probes[0]['Port'] = FakeSerial(DEADLINE_REPLIES + [b'OK:0:M:No errors\r\n'])
+        p.send_command(p.probes[0]['Port'], 'M')
+        self.assertIsNone(p.instrumentation)
+
+    def test_per_probe_stats(self):
+        events = []
+        p = cri.CriProbe(simulated=True)
+        instrumentation = p.instrument(events.append)
+        p.probes[0]['Port'] = FakeSerial(DEADLINE_REPLIES + [b'OK:0:M:No errors\r\n', b'OK:0:RM Y:2.239e+00\r\n',
+                                                             b'OK:0:RM xy:0.3754,0.3773\r\n', b'OK:0:RM Y:2.239e+00\r\n'])
+        p.probes[1]['Port'] = FakeSerial(DEADLINE_REPLIES + [b'OK:0:M:No errors\r\n', b'OK:0:RM Y:2.239e+00\r\n',
+                                                             b'OK:0:RM xy:0.3754,0.3773\r\n', b'OK:0:RM Y:2.239e+00\r\n'])
+
+        p.measure()
+        p.read_measure('Y')
+        p.read_measure(['xy', 'Y'])
+        snapshot = instrumentation.snapshot()
+
+        self.assertEqual(sorted(snapshot), ['A19999', 'A29999'])
+        stats = snapshot['A19999']
+        self.assertEqual(stats['M']['latency']['count'], 1)
+        self.assertEqual(stats['M']['bytes_written'], 3)
+        self.assertEqual(stats['M']['bytes_read'], len(b'OK:0:M:No errors\r\n'))
+        self.assertEqual(stats['RM Y']['latency']['count'], 2)
+        self.assertEqual(stats['RM Y']['parse_time']['count'], 1)
+        self.assertEqual(stats['RM xy,Y']['parse_time']['count'], 1)
+        self.assertEqual(stats['RM Y']['timeouts'], 0)
+        # Including the settings read before the first M
+        self.assertEqual(stats['RM Exposure']['latency']['count'], 1)
+        self.assertEqual(len([event for event in events if event.latency is not None]), 16)
+
+    def test_timeouts(self):
+        p = cri.CriProbe(simulated=True)
+        p.probes = p.probes[1:]
+        instrumentation = p.instrument()
+        p.probes[0]['Port'] = FakeSerial([b'OK:0:RM Y:2.2'])
+        with self.assertRaises(cri.ProbeTimeoutError):
+            p.send_command(p.probes[0]['Port'], 'RM Y')
+
+        p.probes[0]['Port'] = FakeSerial([spectrum_reply([0.25, 0.5])[:-6]])
+        with self.assertRaises(cri.ProbeTimeoutError):
+            p.read_spectrum()
+        stats = instrumentation.snapshot()['A29999']
+        self.assertEqual(stats['RM Y']['timeouts'], 1)
+        self.assertEqual(stats['RM Spectrum']['timeouts'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import threading
+import unittest
+from unittest.mock import patch
+import serial
+import criprobe as cri
+from criprobe.emulator import CriEmulator
+from criprobe.pool import SessionPool
+
+
+class UnpluggedSerial:
+    is_open = True
+
+    def write(self, data):
+        raise serial.SerialException('device disconnected')
+
+    def close(self):
+        self.is_open = False
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'requires a pseudo-terminal')
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('serial.tools.list_ports.comports', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.emulator = CriEmulator('A00489').start()
+        self.addCleanup(self.emulator.stop)
+        environ = patch.dict(os.environ, {'CRIPROBE_PORTS': self.emulator.device})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def test_reuse_session(self):
+        pool = SessionPool()
+        self.addCleanup(pool.close_all)
+
+        with cri.CriProbe(pool=pool) as first:
+            port = first.probes[0]['Port']
+        self.assertEqual(self.emulator.commands, ['RC ID', 'RC Model', 'RC InstrumentType'])
+        # The port stays open in the pool after the instance is closed
+        self.assertTrue(port.is_open)
+        self.assertEqual(len(pool), 1)
+
+        with cri.CriProbe(pool=pool) as second:
+            self.assertIs(second.probes[0]['Port'], port)
+            self.assertEqual(second.probes[0]['ID'], 'A00489')
+            second.measure()
+        # No detection round trips for the second instance, only the exposure
+        # settings read before its first M
+        self.assertEqual(self.emulator.commands, ['RC ID', 'RC Model', 'RC InstrumentType',
+                                                  'RM Exposure', 'RM SyncFreq', 'RM RangeMode', 'RS ExposureMode', 'M'])
+
+        pool.close_all()
+        self.assertFalse(port.is_open)
+        self.assertEqual(len(pool), 0)
+
+    def test_concurrent_instances(self):
+        # Two instances borrow the same port and use it from their own threads
+        pool = SessionPool()
+        self.addCleanup(pool.close_all)
+        first, second = cri.CriProbe(pool=pool), cri.CriProbe(pool=pool)
+        self.assertIs(first.reader(first.probes[0]['Port']), second.reader(second.probes[0]['Port']))
+        results = {}
+
+        def read(p, quantity):
+            results[quantity] = [p.read_measure(quantity)[0][quantity] for _ in range(200)]
+
+        threads = [threading.Thread(target=read, args=(first, 'xy')), threading.Thread(target=read, args=(second, 'Y'))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every reply went to the instance that sent its command
+        self.assertEqual([value.tolist() for value in results['xy']], [[0.3127, 0.329]] * 200)
+        self.assertEqual(results['Y'], [100.0] * 200)
+
+    def test_unpooled_close(self):
+        with cri.CriProbe() as p:
+            port = p.probes[0]['Port']
+            self.assertTrue(port.is_open)
+        self.assertFalse(port.is_open)
+        self.assertEqual(p.probes, [])
+
+    def test_prune_unplugged(self):
+        pool = SessionPool()
+        self.addCleanup(pool.close_all)
+        cri.CriProbe(pool=pool).close()
+        port = pool.sessions[self.emulator.device].info['Port']
+
+        # The meter disappears from the port list
+        with patch.dict(os.environ, {'CRIPROBE_PORTS': ''}):
+            p = cri.CriProbe(pool=pool)
+        self.assertEqual(p.probes, [])
+        self.assertFalse(port.is_open)
+        self.assertEqual(len(pool), 0)
+
+    def test_discard_on_serial_error(self):
+        pool = SessionPool()
+        port = UnpluggedSerial()
+        info = pool.acquire('COM7', lambda: {'Port': port, 'ID': 'A00001', 'Model': 'CR-100', 'Type': 'Colorimeter'})
+        p = cri.CriProbe(simulated=True, pool=pool)
+        p.probes = [info]
+
+        with self.assertRaises(serial.SerialException):
+            p.measure()
+        self.assertFalse(port.is_open)
+        self.assertEqual(len(pool), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+import criprobe as cri
+
+
+class MyTestCase(unittest.TestCase):
+    def test_measurement_slots(self):
+        m = cri.Measurement('A00489', 'Y', 2.239, 'cd/m2', 1.0)
+        self.assertFalse(hasattr(m, '__dict__'))
+        with self.assertRaises(AttributeError):
+            m.other = 1
+
+    def test_from_records(self):
+        results = [{'Probe ID': 'A00489', 'xy': np.array([0.3754, 0.3773]), 'Y': 2.239, 'Time': 'NA',
+                    'Exposure': 111.622, 'Units': {'Exposure': 'msec'}},
+                   {'Probe ID': 'A00490', 'xy': np.array([0.31, 0.32]), 'Y': 1.5, 'Time': 'NA',
+                    'Exposure': 50.0, 'Units': {'Exposure': 'msec'}}]
+        batch = cri.MeasurementBatch.from_records(results, timestamp=10.0)
+
+        self.assertEqual(len(batch), 8)
+        self.assertEqual(batch[0], cri.Measurement('A00489', 'xy', np.array([0.3754, 0.3773]), '', 10.0))
+        self.assertEqual(batch[2], cri.Measurement('A00489', 'Time', 'NA', '', 10.0))
+        self.assertEqual(batch[3], cri.Measurement('A00489', 'Exposure', 111.622, 'msec', 10.0))
+        self.assertEqual(batch.array('xy').tolist(), [[0.3754, 0.3773], [0.31, 0.32]])
+        self.assertEqual(batch.select('Y', probe_id='A00490').array('Y').tolist(), [[1.5]])
+
+    def test_single_unit(self):
+        results = [{'Probe ID': 'A00489', 'Unit': 'Hz', 'SyncFreq': 60.0}]
+        batch = cri.MeasurementBatch.from_records(results)
+        self.assertEqual(batch[0].unit, 'Hz')
+        self.assertTrue(np.isnan(batch[0].timestamp))
+
+    def test_concatenate(self):
+        first = cri.MeasurementBatch.from_records([{'Probe ID': 'A00489', 'xy': np.array([0.1, 0.2])}], 1.0)
+        second = cri.MeasurementBatch.from_records([{'Probe ID': 'A00489', 'xy': np.array([0.3, 0.4]),
+                                                     'Spectrum': np.arange(5.0)}], 2.0)
+        batch = cri.MeasurementBatch.concatenate([first, second])
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.array('xy').tolist(), [[0.1, 0.2], [0.3, 0.4]])
+        self.assertEqual(batch.array('Spectrum').tolist(), [[0.0, 1.0, 2.0, 3.0, 4.0]])
+        self.assertEqual(batch.records['timestamp'].tolist(), [1.0, 2.0, 2.0])
+
+    def test_wavelength_once_per_batch(self):
+        wavelength = np.arange(380.0, 781.0, 2.0)
+        results = [{'Probe ID': probe_id, 'Wavelength': wavelength, 'Spectrum': np.ones(201)}
+                   for probe_id in ('A00489', 'A00490')]
+        batch = cri.MeasurementBatch.from_records(results, 1.0)
+
+        # Only the spectra are stored as readings
+        self.assertEqual(batch.records['quantity'].tolist(), [b'Spectrum', b'Spectrum'])
+        self.assertEqual(len(batch.values), 2 * 201)
+        self.assertIs(batch.wavelength, wavelength)
+        self.assertIs(batch[:1].wavelength, wavelength)
+        self.assertIs(cri.MeasurementBatch.concatenate([cri.MeasurementBatch(), batch]).wavelength, wavelength)
+
+        results[1]['Wavelength'] = np.arange(380.0, 781.0, 5.0)
+        with self.assertRaises(ValueError):
+            cri.MeasurementBatch.from_records(results)
+
+    def test_array_mixed_sizes(self):
+        batch = cri.MeasurementBatch.from_measurements([cri.Measurement('A00489', 'CCT', np.array([5577.0, -0.01])),
+                                                        cri.Measurement('A00489', 'CCT', 5577.0)])
+        with self.assertRaises(ValueError):
+            batch.array('CCT')
+
+    @patch('criprobe.CriProbe.send_commands', autospec=True)
+    def test_read_measure_columnar(self, mock_send_commands):
+        mock_send_commands.return_value = [b'OK:0:RM xy:0.3754,0.3773\r\n', b'OK:0:RM Y:2.239e+00\r\n']
+        p = cri.CriProbe(simulated=True)
+        batch = p.read_measure(['xy', 'Y'], columnar=True)
+
+        self.assertIsInstance(batch, cri.MeasurementBatch)
+        self.assertEqual(batch.records['probe_id'].tolist(), [b'A19999', b'A19999', b'A29999', b'A29999'])
+        self.assertEqual(batch.array('Y').ravel().tolist(), [2.239, 2.239])
+        self.assertFalse(np.isnan(batch.records['timestamp']).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import numpy as np
+from criprobe import resample
+from criprobe.codec import wavelength_axis
+
+WAVELENGTH = wavelength_axis(380.0, 2.0, 201)
+
+
+class MyTestCase(unittest.TestCase):
+    def test_grid(self):
+        target = resample.grid(400, 700, 5)
+        self.assertEqual(len(target), 61)
+        self.assertEqual((target[0], target[-1]), (400, 700))
+        self.assertIs(target, resample.grid(400, 700, 5))
+
+    def test_interpolate(self):
+        # Linear spectra are reproduced exactly at any wavelength
+        spectra = np.stack([0.001 * WAVELENGTH, 2 - 0.002 * WAVELENGTH, np.ones(201)])
+        target = resample.grid(400, 700, 1)
+        result = resample.resample(spectra, WAVELENGTH, target)
+        self.assertEqual(result.shape, (3, 301))
+        np.testing.assert_allclose(result, np.stack([0.001 * target, 2 - 0.002 * target, np.ones(301)]))
+
+        # Samples on the source grid are copied
+        np.testing.assert_array_equal(resample.resample(spectra, WAVELENGTH, WAVELENGTH), spectra)
+
+    def test_bin(self):
+        spectrum = np.sin(WAVELENGTH / 20) + 2
+        target = resample.grid(380, 780, 10)
+        result = resample.resample(spectrum, WAVELENGTH, target, method='bin')
+        # Band averages of a linear spectrum are its values at band centres
+        np.testing.assert_allclose(resample.resample(0.001 * WAVELENGTH, WAVELENGTH, target[1:-1], method='bin'),
+                                   0.001 * target[1:-1])
+        # The integral over the measured range is kept; end bands are half inside it
+        widths = np.full(len(target), 10.0)
+        widths[[0, -1]] = 5
+        self.assertAlmostEqual(np.sum(result * widths), np.sum((spectrum[1:] + spectrum[:-1]) / 2 * np.diff(WAVELENGTH)))
+
+    def test_cached_matrix(self):
+        target = resample.grid(400, 700, 5)
+        matrix = resample.resampling_matrix(WAVELENGTH, target, 'bin')
+        self.assertIs(resample.resampling_matrix(WAVELENGTH.copy(), target.copy(), 'bin'), matrix)
+        self.assertIsNot(resample.resampling_matrix(WAVELENGTH, target), matrix)
+        self.assertEqual(matrix.shape, (201, 61))
+        self.assertFalse(matrix.flags.writeable)
+
+    def test_out(self):
+        spectra = np.ones((4, 201))
+        out = np.empty((4, 61))
+        self.assertIs(resample.resample(spectra, WAVELENGTH, resample.grid(400, 700, 5), out=out), out)
+        np.testing.assert_allclose(out, 1)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            resample.resample(np.ones(201), WAVELENGTH, resample.grid(360, 700, 5))
+        with self.assertRaises(ValueError):
+            resample.resample(np.ones(201), WAVELENGTH, WAVELENGTH, method='cubic')
+        with self.assertRaises(ValueError):
+            resample.resample(np.ones(201), WAVELENGTH[::-1], WAVELENGTH)
+
+    def test_records(self):
+        other = wavelength_axis(380.0, 5.0, 81)
+        records = [{'Probe ID': 'A', 'Wavelength': WAVELENGTH, 'Spectrum': np.ones(201)},
+                   {'Probe ID': 'B', 'Wavelength': other, 'Spectrum': np.full(81, 2.0)},
+                   {'Probe ID': 'C', 'Wavelength': WAVELENGTH, 'Spectrum': np.full(201, 3.0)}]
+        target = resample.grid(400, 700, 1)
+        result = resample.resample_records(records, target, 'bin')
+        self.assertEqual([record['Probe ID'] for record in result], ['A', 'B', 'C'])
+        for record, value in zip(result, (1, 2, 3)):
+            self.assertIs(record['Wavelength'], target)
+            np.testing.assert_allclose(record['Spectrum'], value)
+        # The input records are left alone
+        self.assertIs(records[0]['Wavelength'], WAVELENGTH)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import criprobe as cri
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def log(self, *event):
+        with self.lock:
+            self.events.append(event)
+
+    def fake_probe(self, integration_times, fail_on=None):
+        def send_command(p, port, cmd):
+            self.log('M start', port)
+            time.sleep(integration_times[port])
+            self.log('M done', port)
+            return b'OK:0:M:No errors\r\n'
+
+        def send_commands(p, port, cmds):
+            if fail_on == (port, len([e for e in self.events if e == ('M done', port)])):
+                raise cri.ProbeTimeoutError('No reply')
+            time.sleep(0.05)
+            self.log('RM done', port)
+            return [b'OK:0:%s:%s\r\n' % (cmd.encode(), b'0.3,0.3' if cmd == 'RM xy' else b'%d' % port) for cmd in cmds]
+
+        patches = [patch('criprobe.CriProbe.send_command', autospec=True, side_effect=send_command),
+                   patch('criprobe.CriProbe.send_commands', autospec=True, side_effect=send_commands)]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        p = cri.CriProbe(simulated=True)
+        for n, probe in enumerate(p.probes):
+            probe['Port'] = n
+        return p
+
+    def test_run_plan(self):
+        p = self.fake_probe({0: 0.05, 1: 0.1})
+        plan = cri.MeasurementPlan()
+        for k in range(4):
+            plan.add(['Y'], setup=lambda k=k: self.log('setup', k))
+        results = []
+        steps = []
+
+        records = p.run_plan(plan, on_result=lambda k, probe_id, record: results.append((k, probe_id)),
+                             on_step=lambda k, records: steps.append(k))
+
+        self.assertEqual([[record['Y'] for record in step] for step in records], [[0.0, 1.0]] * 4)
+        self.assertEqual(sorted(results), [(k, probe_id) for k in range(4) for probe_id in ('A19999', 'A29999')])
+        self.assertEqual(sorted(steps), [0, 1, 2, 3])
+
+        # The pattern only changes once both probes have integrated the
+        # previous step, and never while a probe is integrating
+        for k in range(1, 4):
+            setup = self.events.index(('setup', k))
+            done = [n for n, event in enumerate(self.events) if event[0] == 'M done']
+            self.assertEqual(len([n for n in done if n < setup]), 2 * k)
+
+    def test_overlap(self):
+        p = self.fake_probe({0: 0.1, 1: 0.1})
+        plan = cri.MeasurementPlan([cri.MeasurementStep(['Y', 'xy']) for _ in range(5)])
+        start = time.perf_counter()
+        p.run_plan(plan)
+        elapsed = time.perf_counter() - start
+        # 5 x (0.1 s integration + 0.05 s readout) per probe, both probes at
+        # once; one probe after the other would take twice as long
+        self.assertLess(elapsed, 1.2)
+
+    def test_futures_and_failure(self):
+        p = self.fake_probe({0: 0.01, 1: 0.01}, fail_on=(1, 2))
+        plan = cri.MeasurementPlan([cri.MeasurementStep(['Y']) for _ in range(4)])
+        scheduler = p.start_plan(plan)
+        with self.assertRaises(cri.ProbeTimeoutError):
+            scheduler.join()
+
+        self.assertEqual([record['Y'] for record in scheduler.step_futures[0].result()], [0.0, 1.0])
+        with self.assertRaises(cri.ProbeTimeoutError):
+            scheduler.futures[1][1].result()
+        with self.assertRaises(cri.ProbeTimeoutError):
+            scheduler.step_futures[1].result()
+        self.assertTrue(scheduler.futures[3][0].cancelled())
+
+    def test_failing_callbacks(self):
+        plan = [cri.MeasurementStep(['Y']) for _ in range(3)]
+
+        def on_result(k, probe_id, record):
+            if k == 1:
+                raise KeyError(probe_id)
+
+        p = self.fake_probe({0: 0.01, 1: 0.01})
+        scheduler = p.start_plan(plan, on_result=on_result)
+        # The error fails the plan instead of leaving run_plan() waiting
+        with self.assertRaises(KeyError):
+            scheduler.step_futures[1].result(timeout=3)
+        with self.assertRaises(KeyError):
+            scheduler.join()
+        self.assertEqual(len(scheduler.step_futures[0].result()), 2)
+
+        def on_step(k, records):
+            raise ValueError('bad step %d' % k)
+
+        with self.assertRaises(ValueError):
+            p.run_plan(plan, on_step=on_step)
+
+        # An error in on_step for the last step, after its records are set
+        with self.assertRaises(ValueError):
+            p.run_plan(cri.MeasurementPlan().add(['Y']), on_step=on_step)
+
+    def test_invalid_step(self):
+        p = cri.CriProbe(simulated=True)
+        with self.assertRaises(ValueError):
+            p.run_plan([cri.MeasurementStep(['xy'], degree=4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
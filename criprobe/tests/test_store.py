@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import criprobe as cri
+from criprobe.store import CaptureStore, open_capture
+from criprobe.tests.test_acquisition import loopback_probe
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'capture.cri')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_append_and_read(self):
+        wavelength = [380.0, 382.0, 384.0]
+        with CaptureStore.create(self.path, ['Y', 'xy', 'Spectrum'], wavelength) as store:
+            results = [{'Probe ID': 'A00001', 'Y': 2.5, 'xy': np.array([0.31, 0.32]),
+                        'Wavelength': np.array(wavelength), 'Spectrum': np.array([0.25, 0.5, 0.75])},
+                       {'Probe ID': 'A00002', 'Y': 'NA', 'xy': np.array([0.41, 0.42])}]
+            self.assertEqual(store.append_measurements(results, 100.0), 2)
+            store.append_measurements(results[:1], 101.0)
+
+        with open_capture(self.path) as store:
+            self.assertEqual(len(store), 3)
+            self.assertEqual(store.wavelength.tolist(), wavelength)
+            self.assertIsInstance(store.records, np.memmap)
+            self.assertEqual(store.records['timestamp'].tolist(), [100.0, 100.0, 101.0])
+            self.assertEqual(store.array('xy').shape, (3, 2))
+            self.assertEqual(store.array('Y', 'A00001').tolist(), [2.5, 2.5])
+            # Missing and text readings are stored as NaN
+            self.assertTrue(np.isnan(store[1]['Y']))
+            self.assertTrue(np.all(np.isnan(store[1]['Spectrum'])))
+            np.testing.assert_array_equal(store[2]['Spectrum'], [0.25, 0.5, 0.75])
+            with self.assertRaises(RuntimeError):
+                store.append(store.empty(1))
+
+    def test_create_existing(self):
+        CaptureStore.create(self.path, ['Y']).close()
+        with self.assertRaises(FileExistsError):
+            CaptureStore.create(self.path, ['Y'])
+
+    def test_schema(self):
+        with self.assertRaises(ValueError):
+            CaptureStore.create(self.path, ['Spectrum'])
+        with self.assertRaises(ValueError):
+            CaptureStore.create(self.path, ['RangeMode'])
+        with open(self.path, 'wb') as f:
+            f.write(b'not a capture' * 10)
+        with self.assertRaises(ValueError):
+            open_capture(self.path)
+
+    def test_torn_append(self):
+        store = CaptureStore.create(self.path, ['Y'], durable=False)
+        store.append_measurements([{'Probe ID': 'A00001', 'Y': 1.0}], 1.0)
+        store.close()
+        # A crash after writing record data but before updating the count
+        with open(self.path, 'ab') as f:
+            f.write(b'\xff' * 11)
+
+        reader = open_capture(self.path)
+        self.assertEqual(len(reader), 1)
+        with CaptureStore(self.path) as store:
+            self.assertEqual(len(store), 1)
+            store.append_measurements([{'Probe ID': 'A00001', 'Y': 2.0}], 2.0)
+            self.assertEqual(store.array('Y').tolist(), [1.0, 2.0])
+        # Readers see new records once they refresh
+        self.assertEqual(reader.refresh(), 2)
+        self.assertEqual(reader.array('Y').tolist(), [1.0, 2.0])
+        reader.close()
+
+    def test_stream_to_store(self):
+        p = loopback_probe()
+        p.probes = p.probes[1:]
+        samples = list(p.stream(['xy', 'Y', 'Spectrum'], count=3, store=self.path))
+        self.assertEqual(len(samples), 3)
+
+        with open_capture(self.path) as store:
+            self.assertEqual(store.quantities, ['xy', 'Y', 'Spectrum'])
+            self.assertEqual(store.wavelength.tolist(), [380.0, 382.0, 384.0])
+            self.assertEqual(store.records['probe_id'].tolist(), [b'A29999'] * 3)
+            self.assertEqual(store.array('Y').tolist(), [2.239] * 3)
+            np.testing.assert_array_equal(store.array('Spectrum'), [[0.25, 0.5, 0.75]] * 3)
+            self.assertEqual(store.records['timestamp'].tolist(), [timestamp for timestamp, _ in samples])
+
+    def test_export(self):
+        self.assertIs(cri.CaptureStore, CaptureStore)
+
+
+if __name__ == '__main__':
+    unittest.main()
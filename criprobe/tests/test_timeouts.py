@@ -0,0 +1,52 @@
+import unittest
+from criprobe.timeouts import MeasureDeadline, MEASURE_TIMEOUT
+
+
+class MyTestCase(unittest.TestCase):
+    def test_unknown_probe(self):
+        self.assertEqual(MeasureDeadline().timeout(), MEASURE_TIMEOUT)
+
+    def test_fixed_range(self):
+        deadline = MeasureDeadline()
+        deadline.update(exposure=200.0, range_mode='Fixed')
+        self.assertAlmostEqual(deadline.expected(), 0.2)
+        self.assertAlmostEqual(deadline.timeout(), 1.3)
+
+    def test_auto_range_and_sync(self):
+        deadline = MeasureDeadline()
+        deadline.update(exposure=100.0, sync_freq=50.0, range_mode='Auto')
+        self.assertAlmostEqual(deadline.expected(), (0.1 + 0.04) * 3)
+
+    def test_history(self):
+        deadline = MeasureDeadline(history=3)
+        deadline.update(exposure=100.0, range_mode='Fixed')
+        for duration in [2.0, 0.5, 0.5, 0.5]:
+            deadline.observe(duration)
+        # The slow measurement has aged out of the history
+        self.assertAlmostEqual(deadline.expected(), 0.5)
+
+    def test_auto_exposure(self):
+        deadline = MeasureDeadline()
+        deadline.update(exposure=100.0, range_mode='Fixed', exposure_mode='Auto')
+        self.assertEqual(deadline.timeout(), MEASURE_TIMEOUT)
+
+    def test_backoff(self):
+        deadline = MeasureDeadline(maximum=5.0)
+        deadline.update(exposure=200.0, range_mode='Fixed', exposure_mode='Fixed')
+        deadline.missed()
+        self.assertAlmostEqual(deadline.timeout(), 2.6)
+        deadline.missed()
+        deadline.missed()
+        self.assertEqual(deadline.timeout(), 5.0)
+        # A measurement that gets through resets it
+        deadline.observe(0.2)
+        self.assertAlmostEqual(deadline.timeout(), 1.3)
+
+    def test_maximum(self):
+        deadline = MeasureDeadline(maximum=5.0)
+        deadline.update(exposure=60000.0)
+        self.assertEqual(deadline.timeout(), 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import collections
+
+# Queries (RC, RM) are answered in milliseconds, so a silent meter is given
+# up on quickly
+QUERY_TIMEOUT = 1.0
+
+# Upper bound for M while nothing is known about the probe's exposure
+MEASURE_TIMEOUT = 30.0
+
+# M deadline = expected duration * MARGIN + OVERHEAD
+MARGIN = 1.5
+OVERHEAD = 1.0
+
+# Auto range may take a few trial exposures before the real one
+AUTO_RANGE_FACTOR = 3.0
+
+
+class MeasureDeadline:
+    # Deadline for M on one probe, derived from its reported Exposure,
+    # SyncFreq and RangeMode and refined from recent measurement durations.
+    # Auto exposure is free to grow up to the meter's limit, so it keeps the
+    # maximum; a missed deadline doubles the next one until an M succeeds
+    def __init__(self, maximum=MEASURE_TIMEOUT, history=20):
+        self.maximum = maximum
+        self.exposure = None
+        self.sync_freq = None
+        self.range_mode = None
+        self.exposure_mode = None
+        self.durations = collections.deque(maxlen=history)
+        self.backoff = 1.0
+        # Set once the probe has been asked for its exposure settings
+        self.queried = False
+
+    def update(self, exposure=None, sync_freq=None, range_mode=None, exposure_mode=None):
+        # exposure in msec and sync_freq in Hz, as the meter reports them
+        if exposure is not None:
+            self.exposure = exposure / 1000.0
+        if sync_freq is not None:
+            self.sync_freq = sync_freq
+        if range_mode is not None:
+            self.range_mode = range_mode
+        if exposure_mode is not None:
+            self.exposure_mode = exposure_mode
+
+    def unknown(self):
+        # True while there is nothing to base a deadline on and the probe's
+        # settings have not been read yet
+        return self.exposure is None and not self.durations and not self.queried
+
+    def observe(self, duration):
+        self.durations.append(duration)
+        self.backoff = 1.0
+
+    def missed(self):
+        # An M timed out: the exposure may have grown since it was read
+        self.backoff *= 2
+
+    def expected(self):
+        # Expected M duration in seconds, or None when nothing is known yet
+        estimates = []
+        if self.exposure is not None:
+            integration = self.exposure
+            if self.sync_freq:
+                # Synchronized exposures wait for, and round up to, whole periods
+                integration += 2.0 / self.sync_freq
+            if self.range_mode is None or str(self.range_mode).lower().startswith('auto'):
+                integration *= AUTO_RANGE_FACTOR
+            estimates.append(integration)
+        if self.durations:
+            estimates.append(max(self.durations))
+        return max(estimates) if estimates else None
+
+    def timeout(self):
+        expected = self.expected()
+        if expected is None or str(self.exposure_mode).lower().startswith('auto'):
+            return self.maximum
+        return min((expected * MARGIN + OVERHEAD) * self.backoff, self.maximum)